@@ -2,7 +2,7 @@
 # This file is automatically generated by pywf script
 # based on the content in pyproject.toml file
 
-__version__ = "0.1.1"
+__version__ = "0.2.0"
 __short_description__ = "The simplest way to make AI work with your specific codebase, even in environments where external AI tools are restricted."
 __license__ = "AGPL-3.0-or-later"
 __author__ = "Sanhe Hu"
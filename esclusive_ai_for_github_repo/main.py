@@ -37,18 +37,42 @@ Main workflow:
 """
 
 import typing as T
+import io
 import os
+import re
+import sys
+import time
+import errno
+import struct
+import random
+import gzip
 import json
 import shutil
+import zipfile
+import codecs
+import hashlib
+import tokenize
+import ast
+import argparse
+import threading
+import subprocess
+import contextlib
 import dataclasses
 from pathlib import Path
-from urllib import request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import cached_property
 
-from github import Github, GithubException, Repository, GitReleaseAsset
-from docpack.api import GitHubPipeline
+from docpack import __version__ as docpack_version
+from pathspec.patterns import GitWildMatchPattern
 
-__version__ = "0.1.1"
+# ``requests``, ``github`` (PyGithub) and ``docpack.github_fetcher`` (pydantic)
+# take most of the import time, they are imported where they are used, so a
+# local ``build`` with a warm render cache, ``stats`` and ``explain`` never
+# import them.
+if T.TYPE_CHECKING:  # pragma: no cover
+    import requests
+
+__version__ = "0.2.0"
 __license__ = "AGPL-3.0-or-later"
 __author__ = "Sanhe Hu"
 __author_email__ = "sanhehu@easyscalecloud.com"
@@ -56,6 +80,9 @@ __maintainer__ = "Sanhe Hu"
 __maintainer_email__ = "sanhehu@easyscalecloud.com"
 
 release_name = "knowledge-base"
+build_state_asset_name = "knowledge-base-state.json"
+# bump this when the rendered XML changes, it invalidates the render cache
+renderer_version = f"{__version__}+docpack-{docpack_version}"
 
 
 @dataclasses.dataclass
@@ -63,20 +90,62 @@ class EnvVar:
     """
     Environment variables lazy loader.
 
+    Outside GitHub Actions, the server, repository and branch fall back to
+    the ``origin`` remote and the current branch of the local git repo, so a
+    local ``build`` needs no environment variable.
+
     - `Default environment variables
  <https://docs.github.com/en/actions/writing-workflows/choosing-what-your-workflow-does/store-information-in-variables#default-environment-variables>`_
     """
+    @cached_property
+    def git_origin(self) -> T.Optional[tuple[str, str]]:
+        """
+        The server URL and the ``owner/repo`` of the ``origin`` remote.
+        """
+        url = run_git(Path.cwd(), "remote", "get-url", "origin")
+        if url is None:
+            return None
+        return parse_git_remote_url(url.strip())
+
+    def get(self, name: str, fallback: T.Callable[[], T.Optional[str]]) -> str:
+        value = os.environ.get(name) or fallback()
+        if not value:
+            raise KeyError(
+                f"{name} is not set, and it can not be found from the local git repo"
+            )
+        return value
+
     @property
     def GITHUB_SERVER_URL(self) -> str:
-        return os.environ["GITHUB_SERVER_URL"]
+        return self.get(
+            "GITHUB_SERVER_URL",
+            lambda: self.git_origin[0] if self.git_origin else "https://github.com",
+        )
 
     @property
     def GITHUB_REPOSITORY(self) -> str:
-        return os.environ["GITHUB_REPOSITORY"]
+        return self.get(
+            "GITHUB_REPOSITORY",
+            lambda: self.git_origin[1] if self.git_origin else None,
+        )
 
     @property
     def GITHUB_REF_NAME(self) -> str:
-        return os.environ["GITHUB_REF_NAME"]
+        def get_branch() -> T.Optional[str]:
+            branch = run_git(Path.cwd(), "symbolic-ref", "--short", "-q", "HEAD")
+            if branch is None:  # detached, GitHub URLs also work with a sha
+                branch = run_git(Path.cwd(), "rev-parse", "HEAD")
+            return None if branch is None else branch.strip()
+
+        return self.get("GITHUB_REF_NAME", get_branch)
+
+    @property
+    def GITHUB_API_URL(self) -> str:
+        """
+        The REST API base URL, point it to a local fake server to publish
+        offline.
+        """
+        return os.environ.get("GITHUB_API_URL", "https://api.github.com")
 
     @property
     def ACC_NAME(self) -> str:
@@ -95,13 +164,63 @@ class EnvVar:
         """
         return os.environ["GITHUB_TOKEN"]
 
+    @property
+    def ESCLUSIVE_AI_CACHE_DIR(self) -> T.Optional[str]:
+        """
+        Override the render cache directory.
+        """
+        return os.environ.get("ESCLUSIVE_AI_CACHE_DIR")
+
+    @property
+    def ESCLUSIVE_AI_CACHE_MAX_BYTES(self) -> int:
+        """
+        Size limit of the render cache, ``0`` disables the cache.
+        """
+        return int(os.environ.get("ESCLUSIVE_AI_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+    @property
+    def ESCLUSIVE_AI_PROFILE(self) -> bool:
+        """
+        Same as the ``--profile`` option.
+        """
+        return os.environ.get("ESCLUSIVE_AI_PROFILE", "") not in ("", "0", "false")
+
+    @property
+    def GITHUB_STEP_SUMMARY(self) -> T.Optional[str]:
+        """
+        The job summary markdown file, it is only set in GitHub Actions.
+        """
+        return os.environ.get("GITHUB_STEP_SUMMARY")
+
 env_var = EnvVar()
 
+_git_remote_url_regex = re.compile(
+    r"^(?:(?P<scheme>[a-z][a-z+]*)://)?(?:[^@/]+@)?(?P<host>[^/:]+)(?::\d+)?[:/]"
+    r"(?P<full_name>[^/]+/[^/]+?)(?:\.git)?/?$"
+)
+
+
+def parse_git_remote_url(url: str) -> T.Optional[tuple[str, str]]:
+    """
+    Parse a git remote URL, e.g. ``git@github.com:owner/repo.git`` or
+    ``https://github.com/owner/repo``.
+
+    :returns: the server URL and the ``owner/repo``, ``None`` if it is not
+        a recognized URL.
+    """
+    match = _git_remote_url_regex.match(url)
+    if match is None:
+        return None
+    scheme = "http" if match.group("scheme") == "http" else "https"
+    return f"{scheme}://{match.group('host')}", match.group("full_name")
+
 def get_url_content(url: str) -> str:  # pragma: no cover
     """
     Fetch and return the content of a URL as a string.
     """
-    with request.urlopen(url) as response:
+    from urllib.request import urlopen
+
+    with urlopen(url) as response:
         return response.read().decode("utf-8").strip()
 
 
@@ -113,6 +232,223 @@ def write_text(path: Path, text: str):
         path.write_text(text, encoding="utf-8")
 
 
+def sha256_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def sha256_of_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def run_git(dir_repo: Path, *args: str) -> T.Optional[str]:
+    """
+    Run a git command in the repo and return the stdout, or ``None`` if the
+    command fails, for example when it is not a git repo.
+    """
+    try:
+        res = subprocess.run(
+            ["git", *args],
+            cwd=dir_repo,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+        )
+    except FileNotFoundError:  # pragma: no cover
+        return None
+    if res.returncode != 0:
+        return None
+    return res.stdout
+
+
+@dataclasses.dataclass
+class StageMetrics:
+    """
+    What a stage of the run did.
+
+    :param name: the stage name, e.g. ``"upload:all.txt"``.
+    :param seconds: wall time of the stage.
+    :param files: number of files the stage processed.
+    :param bytes: number of bytes the stage read, wrote or transferred.
+    :param api_calls: number of GitHub API calls the stage made.
+    """
+
+    name: str = dataclasses.field()
+    seconds: float = dataclasses.field(default=0.0)
+    files: int = dataclasses.field(default=0)
+    bytes: int = dataclasses.field(default=0)
+    api_calls: int = dataclasses.field(default=0)
+
+    def add(self, files: int = 0, bytes: int = 0, api_calls: int = 0):
+        self.files += files
+        self.bytes += bytes
+        self.api_calls += api_calls
+
+
+class _DisabledStage:
+    """
+    The stage of disabled :class:`Metrics`, it records nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, files: int = 0, bytes: int = 0, api_calls: int = 0):
+        pass
+
+
+_disabled_stage = _DisabledStage()
+
+
+class Metrics:
+    """
+    Per-stage wall time, file, byte and API call counters of a run.
+
+    It is disabled by default, then :meth:`stage` returns a shared no-op
+    object, so the instrumentation costs nothing.
+
+    Usage:
+
+    .. code-block:: python
+
+        with metrics.stage("combine:all") as stage:
+            ...
+            stage.add(files=len(documents), bytes=size)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages: list[StageMetrics] = list()
+        self._lock = threading.Lock()
+
+    def stage(self, name: str):
+        if self.enabled is False:
+            return _disabled_stage
+        return self._record(name)
+
+    @contextlib.contextmanager
+    def _record(self, name: str):
+        stage = StageMetrics(name=name)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            with self._lock:
+                self.stages.append(stage)
+
+    def to_dict(self) -> dict[str, T.Any]:
+        return {
+            "stages": [dataclasses.asdict(stage) for stage in self.stages],
+        }
+
+    def to_json(self, path: Path):
+        write_text(path, json.dumps(self.to_dict(), indent=2))
+
+    def to_markdown(self) -> str:
+        lines = [
+            "### Knowledge base metrics",
+            "",
+            "| Stage | Seconds | Files | Bytes | API calls |",
+            "| --- | ---: | ---: | ---: | ---: |",
+        ]
+        for stage in self.stages:
+            lines.append(
+                f"| {stage.name} | {stage.seconds:.3f} | {stage.files} "
+                f"| {stage.bytes} | {stage.api_calls} |"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write_step_summary(self):
+        """
+        Append the markdown table to the GitHub Actions job summary, if it is
+        running in GitHub Actions.
+        """
+        if env_var.GITHUB_STEP_SUMMARY:
+            with open(env_var.GITHUB_STEP_SUMMARY, "a", encoding="utf-8") as f:
+                f.write(self.to_markdown())
+
+
+metrics = Metrics()
+
+
+@contextlib.contextmanager
+def profile(dir_profile: Path, name: str, enabled: bool = True, top_n: int = 30):
+    """
+    Profile the CPU time and the memory allocations of the block with
+    ``cProfile`` and ``tracemalloc``, and write the reports to
+    ``dir_profile``:
+
+    - ``${name}.prof``: the raw ``cProfile`` stats, open it with ``pstats``
+      or ``snakeviz``.
+    - ``${name}-cpu.txt``: the ``top_n`` functions by cumulative time.
+    - ``${name}-memory.txt``: the peak traced memory and the ``top_n``
+      source lines by allocated memory still alive at the end.
+
+    Only the current process is profiled, not the ``--jobs`` worker
+    processes. The threads started in the block, e.g. the document group and
+    the upload thread pools, are profiled too, and merged into the reports.
+    """
+    if enabled is False:
+        yield
+        return
+    import pstats
+    import cProfile
+    import tracemalloc
+
+    dir_profile.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+    thread_profilers = list()
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # called once by every new thread, a profiler only traces the thread
+        # that enables it
+        thread_profiler = cProfile.Profile()
+        with lock:
+            thread_profilers.append(thread_profiler)
+        thread_profiler.enable()
+
+    # since Python 3.12 one profiler traces all threads
+    is_per_thread = sys.version_info < (3, 12)
+    is_tracing = tracemalloc.is_tracing()
+    if not is_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    if is_per_thread:
+        threading.setprofile(profile_thread)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if is_per_thread:
+            threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if not is_tracing:
+            tracemalloc.stop()
+        stats = pstats.Stats(profiler)
+        with lock:
+            for thread_profiler in thread_profilers:
+                stats.add(thread_profiler)
+        stats.dump_stats(dir_profile.joinpath(f"{name}.prof"))
+        with dir_profile.joinpath(f"{name}-cpu.txt").open("w", encoding="utf-8") as f:
+            stats.stream = f
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+        lines = [f"peak traced memory: {peak} bytes", ""]
+        for stat in snapshot.statistics("lineno")[:top_n]:
+            lines.append(str(stat))
+        write_text(dir_profile.joinpath(f"{name}-memory.txt"), "\n".join(lines) + "\n")
+        print(f"write profile of {name!r} to {dir_profile}")
+
+
 @dataclasses.dataclass
 class Paths:
     """
@@ -137,8 +473,20 @@ class Paths:
         git_repo/tmp/staging/...
         git_repo/tmp/document_groups/
         git_repo/tmp/document_groups/${group_name_1}.txt
+        git_repo/tmp/document_groups/${group_name_1}.manifest.json
         git_repo/tmp/document_groups/${group_name_2}.txt
         git_repo/tmp/document_groups/...
+        git_repo/tmp/document_groups/knowledge-base-state.json
+        git_repo/tmp/token-report.json
+        git_repo/tmp/profile/${stage}.prof
+        git_repo/tmp/profile/${stage}-cpu.txt
+        git_repo/tmp/profile/${stage}-memory.txt
+        git_repo/tmp/previous/
+        git_repo/tmp/previous/knowledge-base-state.json
+        git_repo/tmp/previous/${group_name_1}.txt
+        git_repo/tmp/previous/...
+        ${HOME}/.cache/esclusive_ai_for_github_repo/
+        ${HOME}/.cache/esclusive_ai_for_github_repo/${key[:2]}/${key}.xml
     """
 
     dir_project_root: Path = dataclasses.field()
@@ -176,185 +524,3921 @@ class Paths:
         """Path to the consolidated knowledge base output file."""
         return self.dir_tmp / "document_groups"
 
+    @property
+    def path_build_state_json(self) -> Path:
+        """Path to the :class:`BuildState` of the current build."""
+        return self.dir_document_groups / build_state_asset_name
+
+    @property
+    def path_token_report_json(self) -> Path:
+        """Path to the :class:`TokenReport` of the current build."""
+        return self.dir_tmp / "token-report.json"
+
+    @property
+    def dir_profile(self) -> Path:
+        """Directory of the ``--profile`` reports."""
+        return self.dir_tmp / "profile"
+
+    @property
+    def dir_previous(self) -> Path:
+        """Directory where the previously published assets are downloaded to."""
+        return self.dir_tmp / "previous"
+
+    @property
+    def dir_cache(self) -> Path:
+        """
+        Render cache directory, it should be persisted across workflow runs.
+
+        It is outside the git repo on purpose, so the cached files are never
+        picked up by the include patterns.
+        """
+        if env_var.ESCLUSIVE_AI_CACHE_DIR:
+            return Path(env_var.ESCLUSIVE_AI_CACHE_DIR)
+        return Path.home().joinpath(".cache", "esclusive_ai_for_github_repo")
+
+    @property
+    def path_etag_cache_json(self) -> Path:
+        """Path to the :class:`ETagCache` of the GitHub API responses."""
+        return self.dir_cache / "github-etags.json"
+
 
 @dataclasses.dataclass
 class DocumentGroup:
+    """
+    :param compression: compressed variants to publish next to the plain text
+        asset, any of ``"gz"``, ``"zst"`` and ``"zip"``. ``None`` means use
+        :attr:`Config.compression`.
+    :param max_bytes: if the asset is larger than this, also publish it as
+        numbered shards that are no larger than this, see :func:`plan_shards`.
+    :param max_tokens: same as ``max_bytes``, but for the estimated number
+        of tokens.
+    :param priority: gitignore style patterns, documents matching the first
+        pattern come first, then the second, and so on. The other documents
+        come last. Documents are in path order within each of them.
+    :param dedup: emit the content of identical files only once in the
+        asset, see :func:`dedup_documents`. ``None`` means use
+        :attr:`Config.dedup`.
+    :param compact: make Python files smaller, see :func:`compact_python`.
+        ``"basic"`` removes the license banner and redundant whitespace,
+        ``"strip"`` also removes comments and docstrings. ``None`` means
+        keep the files as is.
+    :param max_file_bytes: files larger than this are handled according to
+        ``oversize``. ``None`` means use :attr:`Config.max_file_bytes`.
+    :param oversize: ``"skip"`` drops files larger than ``max_file_bytes``,
+        ``"excerpt"`` replaces them with their head and tail, see
+        :meth:`DocumentRenderer.render`. ``None`` means use
+        :attr:`Config.oversize`.
+    """
+
     name: str = dataclasses.field()
     include: list[str] = dataclasses.field()
     exclude: list[str] = dataclasses.field()
+    compression: T.Optional[list[str]] = dataclasses.field(default=None)
+    max_bytes: T.Optional[int] = dataclasses.field(default=None)
+    max_tokens: T.Optional[int] = dataclasses.field(default=None)
+    priority: list[str] = dataclasses.field(default_factory=list)
+    dedup: T.Optional[bool] = dataclasses.field(default=None)
+    compact: T.Optional[str] = dataclasses.field(default=None)
+    max_file_bytes: T.Optional[int] = dataclasses.field(default=None)
+    oversize: T.Optional[str] = dataclasses.field(default=None)
 
     @property
     def asset_name(self) -> str:
         return f"{self.name}.txt"
 
+    def is_oversize(self, file_size: int) -> bool:
+        return bool(self.max_file_bytes) and file_size > self.max_file_bytes
+
+    @property
+    def manifest_asset_name(self) -> str:
+        return f"{self.name}.manifest.json"
+
+    @property
+    def compressed_asset_names(self) -> list[str]:
+        return [f"{self.asset_name}.{fmt}" for fmt in self.compression or []]
+
+    @property
+    def asset_names(self) -> list[str]:
+        """
+        The plain text asset and all its compressed variants.
+        """
+        return [self.asset_name] + self.compressed_asset_names
+
+    def get_shard_asset_name(self, nth: int) -> str:
+        """
+        :param nth: the shard number, starting from 1.
+        """
+        return f"{self.name}.part-{nth:03d}.txt"
+
+    def is_shard_asset_name(self, asset_name: str) -> bool:
+        return (
+            re.match(rf"^{re.escape(self.name)}\.part-\d{{3,}}\.txt$", asset_name)
+            is not None
+        )
+
+
+compression_formats = ("gz", "zst", "zip")
+
+
+def is_zstd_available() -> bool:
+    """
+    Check if ``compression.zstd`` (Python 3.14+) or ``zstandard`` can be
+    imported, without importing them.
+    """
+    import importlib.util
+
+    for name in ("compression.zstd", "zstandard"):
+        try:
+            if importlib.util.find_spec(name) is not None:
+                return True
+        except ModuleNotFoundError:  # the parent package doesn't exist
+            continue
+    return False
+
+oversize_modes = ("skip", "excerpt")
+
 
 @dataclasses.dataclass
 class Config:
     """
     Configuration for the knowledge base builder.
+
+    :param compression: default compressed variants of all document groups.
+    :param dedup: default dedup option of all document groups.
+    :param max_file_bytes: default max file size of all document groups,
+        10 MB by default, a larger file doesn't fit in any AI assistant.
+        ``None`` means no limit.
+    :param oversize: default oversize option of all document groups.
     """
 
     document_groups: list[DocumentGroup] = dataclasses.field()
+    compression: list[str] = dataclasses.field(default_factory=list)
+    dedup: bool = dataclasses.field(default=False)
+    max_file_bytes: T.Optional[int] = dataclasses.field(default=10_000_000)
+    oversize: str = dataclasses.field(default="skip")
 
     @classmethod
     def from_dict(cls, dct: dict[str, T.Any]):
         dct["document_groups"] = [
             DocumentGroup(**dct) for dct in dct.get("document_groups", [])
         ]
-        return cls(**dct)
+        config = cls(**dct)
+        for group in config.document_groups:
+            if group.compression is None:
+                group.compression = list(config.compression)
+            if group.dedup is None:
+                group.dedup = config.dedup
+            if group.max_file_bytes is None:
+                group.max_file_bytes = config.max_file_bytes
+            if group.oversize is None:
+                group.oversize = config.oversize
+            if group.oversize not in oversize_modes:
+                raise ValueError(
+                    f"invalid oversize {group.oversize!r} in document group "
+                    f"{group.name!r}, must be one of {oversize_modes}"
+                )
+            if group.compact is not None and group.compact not in compact_modes:
+                raise ValueError(
+                    f"invalid compact {group.compact!r} in document group "
+                    f"{group.name!r}, must be one of {compact_modes}"
+                )
+            for fmt in group.compression:
+                if fmt not in compression_formats:
+                    raise ValueError(
+                        f"invalid compression {fmt!r} in document group "
+                        f"{group.name!r}, must be one of {compression_formats}"
+                    )
+                # fail before the build, not when the asset is compressed
+                if fmt == "zst" and is_zstd_available() is False:
+                    raise ValueError(
+                        f"compression 'zst' in document group {group.name!r} "
+                        f"requires Python 3.14+ or 'pip install zstandard'"
+                    )
+        return config
 
     @classmethod
     def from_json(cls, path_config: Path):  # pragma: no cover
         print("=== Load config")
         print(f"load config from {path_config}")
-        dct = json.loads(path_config.read_text(encoding="utf-8"))
-        config = cls.from_dict(dct)
+        with metrics.stage("load config") as stage:
+            text = path_config.read_text(encoding="utf-8")
+            config = cls.from_dict(json.loads(text))
+            stage.add(files=1, bytes=len(text))
         print("done")
         return config
 
 
-def build_knowledge_base(
-    paths: Paths,
-    config: "Config",
-):
+_GLOB_CHARS = set("*?[\\")
+
+# regex suffixes ``pathspec`` appends to a pattern that matches a directory
+# and everything below it
+_DIR_CONTENT_SUFFIXES = (
+    "(?:(?P<ps_d>/).*)?$",
+    "(?P<ps_d>/).*$",
+    "(?:/.*)?$",
+    "/.*$",
+)
+# the only named group ``pathspec`` puts in a regex, named groups can't repeat
+# in a combined regex
+_PS_D_GROUP = "(?P<ps_d>"
+
+
+def split_pathspec_regex(regex: str) -> T.Optional[tuple[str, str]]:
     """
-    Build the knowledge base from all configured sources.
+    Rewrite the regex ``pathspec`` generates for a pattern, so it can be
+    combined with others, see :class:`CompiledPatterns`.
 
-    This is the main processing function that extracts content from
-    the repository and combines it into a single knowledge base file.
+    :returns: the regex without the named group and the regex of the
+        directory it matches everything below, ``None`` if the regex doesn't
+        end with a known suffix or has another named group, for example
+        after a ``pathspec`` upgrade.
     """
-    print("=== Build knowledge base")
-    for group in config.document_groups:
-        print(f"--- processing document group {group.name!r}")
-        print("Extract documents from git repo ...")
-        # Clean up the staging directory to get a fresh start
-        shutil.rmtree(paths.dir_staging, ignore_errors=True)
-        github_pipeline = GitHubPipeline(
-            domain=env_var.GITHUB_SERVER_URL,
-            account=env_var.ACC_NAME,
-            repo=env_var.REPO_NAME,
-            branch=env_var.GITHUB_REF_NAME,
-            dir_repo=paths.dir_project_root,
-            include=group.include,
-            exclude=group.exclude,
-            dir_out=paths.dir_staging,
-        )
-        github_pipeline.fetch()
-        print("Combine documents into a single file ...")
-        prompt = paths.path_prompt_md.read_text(encoding="utf-8")
-        lines = [prompt]
-        for path in paths.dir_staging.glob("*.xml"):
-            lines.append(path.read_text(encoding="utf-8"))
-        content = "\n".join(lines)
-        path_asset = paths.dir_document_groups.joinpath(group.asset_name)
-        print(f"Write to asset file {path_asset}...")
-        write_text(path_asset, content)
+    for suffix in _DIR_CONTENT_SUFFIXES:
+        if regex.endswith(suffix):
+            break
+    else:
+        return None
+    regex = regex.replace(_PS_D_GROUP, "(?:")
+    if "(?P<" in regex:
+        return None
+    suffix = suffix.replace(_PS_D_GROUP, "(?:")
+    return regex, regex[: -len(suffix)] + "$"
 
 
-def create_tag(repo: Repository):  # pragma: no cover
+def get_literal_dir_prefix(pattern: str) -> tuple[str, ...]:
     """
-    Create a Git tag for the knowledge base release.
+    Get the literal leading directories an include pattern is anchored to.
 
-    Creates a tag pointing to the latest commit on the default branch,
-    which will be used for the GitHub release.
+    Example: ``docs/source/**/*.rst`` -> ``("docs", "source")``. An empty
+    tuple means the pattern may match at any depth, for example ``*.py``,
+    ``tmp/`` or ``**/index.rst``.
     """
-    default_branch = repo.default_branch
-    commit = repo.get_branch(default_branch).commit
-    commit_sha = commit.sha
-    tag = repo.create_git_tag(
-        tag=release_name,
-        message=f"Release {release_name}",
-        object=commit_sha,
-        type="commit",
-    )
-    repo.create_git_ref(
-        ref=f"refs/tags/{release_name}",
-        sha=tag.sha,
-    )
+    pattern = pattern.rstrip()
+    if pattern.startswith("/"):
+        pattern = pattern[1:]
+    elif "/" not in pattern.rstrip("/"):
+        return tuple()
+    prefix = list()
+    for part in pattern.split("/")[:-1]:
+        if not part or _GLOB_CHARS.intersection(part):
+            break
+        prefix.append(part)
+    return tuple(prefix)
 
 
-def create_release(repo: Repository):  # pragma: no cover
+@dataclasses.dataclass
+class PrefixTrie:
     """
-    Create or get the GitHub release for publishing the knowledge base.
+    A trie of the literal directory prefixes of include patterns.
 
-    Checks if a release with the specified name already exists.
-    If not, creates a new one.
+    A terminal node means that some pattern may match anything below it.
     """
-    print(f"--- Create release {release_name!r} if not exists ...")
-    try:
-        release = repo.get_release(release_name)
-    except GithubException as e:
-        if e.status == 404:  # pragma: no cover
-            release = None
+
+    children: dict[str, "PrefixTrie"] = dataclasses.field(default_factory=dict)
+    is_terminal: bool = dataclasses.field(default=False)
+
+    def add(self, prefix: tuple[str, ...]):
+        node = self
+        for part in prefix:
+            node = node.children.setdefault(part, PrefixTrie())
+        node.is_terminal = True
+
+    def can_match_below(self, parts: T.Sequence[str]) -> bool:
+        """
+        Check whether any pattern may match a path below the given directory.
+        """
+        node = self
+        for part in parts:
+            if node.is_terminal:
+                return True
+            node = node.children.get(part)
+            if node is None:
+                return False
+        return True
+
+
+@dataclasses.dataclass
+class CompiledPatterns:
+    """
+    A list of gitignore-style patterns parsed once.
+
+    :param rules: per pattern regex and whether it is a positive pattern,
+        only used when there is a negation (``!``) pattern.
+    :param regex: all patterns combined into a single regex, ``None`` if
+        there is a negation pattern, or if ``pathspec`` generated a regex
+        :func:`split_pathspec_regex` doesn't know, then rules are evaluated
+        in order and the last match wins.
+    :param dir_regex: matches a directory if every path below it matches,
+        ``None`` if it is not safe to prune.
+    :param trie: the literal directory prefixes of the positive patterns.
+    """
+
+    rules: list[tuple[re.Pattern, bool]] = dataclasses.field()
+    regex: T.Optional[re.Pattern] = dataclasses.field()
+    dir_regex: T.Optional[re.Pattern] = dataclasses.field()
+    trie: PrefixTrie = dataclasses.field()
+
+    @classmethod
+    def compile(cls, patterns: list[str]):
+        parsed = list()
+        trie = PrefixTrie()
+        for pattern in dict.fromkeys(patterns):
+            regex, include = GitWildMatchPattern.pattern_to_regex(pattern)
+            if include is None:  # blank line or comment
+                continue
+            parsed.append((regex, include))
+            if include:
+                trie.add(get_literal_dir_prefix(pattern))
+        splits = [split_pathspec_regex(regex) for regex, _ in parsed]
+        if None in splits:
+            # match with the regexes as pathspec generated them, one by one
+            rules = [(re.compile(regex), include) for regex, include in parsed]
+            return cls(rules=rules, regex=None, dir_regex=None, trie=trie)
+        rules = list()
+        regexes = list()
+        dir_regexes = list()
+        for (_, include), (regex, dir_regex) in zip(parsed, splits):
+            rules.append((re.compile(regex), include))
+            if include:
+                regexes.append(regex)
+                dir_regexes.append(dir_regex)
+        if len(regexes) == len(rules):
+            combined = re.compile(
+                "|".join(f"(?:{regex})" for regex in regexes) or "(?!)"
+            )
+            dir_regex = re.compile(
+                "|".join(f"(?:{regex})" for regex in dir_regexes) or "(?!)"
+            )
         else:
-            raise e
+            combined = None
+            dir_regex = None
+        return cls(rules=rules, regex=combined, dir_regex=dir_regex, trie=trie)
 
-    if release is None:
-        print(f"Release not exists, creating it ...")
-        create_tag(repo)
-        release = repo.create_git_release(
-            tag=release_name,
-            name=release_name,
-            message=f"Release {release_name}",
-        )
-    else:
-        print("Release already exists.")
-    return release
+    def match(self, path: str) -> bool:
+        if self.regex is not None:
+            return self.regex.match(path) is not None
+        matched = False
+        for regex, include in self.rules:
+            if regex.match(path) is not None:
+                matched = include
+        return matched
+
+    def match_all_below(self, dirpath: str) -> bool:
+        """
+        Check whether every path below the given directory matches.
+        """
+        if self.dir_regex is None:
+            return False
+        return self.dir_regex.match(dirpath) is not None
 
 
-def upload_assets(
-    release: Repository,
-    paths: Paths,
-    config: "Config",
-):  # pragma: no cover
+@dataclasses.dataclass
+class PathMatcher:
     """
-    Upload knowledge base files as assets to the GitHub release.
+    Compiled include/exclude matcher of a :class:`DocumentGroup`.
 
-    Replaces any existing assets with the same names to ensure
-    the release always has the latest versions of all document groups.
+    It has the same semantic as the ``.gitignore`` style matching described
+    in the Include-Exclude Pattern Matching Guide: a path matches if it
+    matches any include pattern (or the include list is empty) and does not
+    match any exclude pattern. In addition, it can tell whether a directory
+    can be skipped without listing its content.
     """
-    print("--- Publish all in one knowledge base")
-    existing_assets: dict[str, GitReleaseAsset] = {
-        asset.name: asset for asset in release.get_assets()
-    }
-    for group in config.document_groups:
-        if group.asset_name in existing_assets:
-            existing_assets[group.asset_name].delete_asset()
-        release.upload_asset(
-            path=f"{paths.dir_document_groups.joinpath(group.asset_name)}",
-            label=group.asset_name,
+
+    include: T.Optional[CompiledPatterns] = dataclasses.field()
+    exclude: T.Optional[CompiledPatterns] = dataclasses.field()
+
+    @classmethod
+    def new(cls, include: list[str], exclude: list[str]):
+        return cls(
+            include=CompiledPatterns.compile(include) if include else None,
+            exclude=CompiledPatterns.compile(exclude) if exclude else None,
         )
 
+    def is_match(self, path: str) -> bool:
+        """
+        :param path: a relative path using ``/`` as the separator.
+        """
+        if self.include is not None and self.include.match(path) is False:
+            return False
+        if self.exclude is not None and self.exclude.match(path):
+            return False
+        return True
+
+    def is_dir_pruned(self, dirpath: str) -> bool:
+        """
+        Check whether no path below the given directory can match.
+
+        :param dirpath: a relative directory path using ``/`` as the separator.
+        """
+        if self.include is not None:
+            if self.include.trie.can_match_below(dirpath.split("/")) is False:
+                return True
+        if self.exclude is not None and self.exclude.match_all_below(dirpath):
+            return True
+        return False
+
 
-def publish_knowledge_base(paths: Paths, config: "Config"):  # pragma: no cover
+def iter_repo_files(
+    dir_repo: Path,
+    matchers: list[PathMatcher],
+    reldir: str = "",
+    exclude_dirs: T.Container[str] = (),
+) -> T.Iterable[str]:
     """
-    Publish all document group files to GitHub releases.
+    Walk the repository and yield the relative path of every candidate file.
 
-    This is the main publishing function that handles GitHub authentication,
-    release creation, and asset uploading for all document groups.
+    Like the ``**/*.*`` glob, only file names with a dot are candidates.
+    A directory is not listed at all if it is pruned by every matcher.
+
+    :param reldir: only walk this directory, relative to ``dir_repo``.
+    :param exclude_dirs: relative paths of directories to never list.
     """
-    print("=== Publish knowledge base")
-    gh = Github(env_var.GITHUB_TOKEN)
-    repo = gh.get_repo(env_var.GITHUB_REPOSITORY)
-    release = create_release(repo)
-    upload_assets(release=release, paths=paths, config=config)
+    stack = [(reldir, dir_repo.joinpath(reldir))]
+    while stack:
+        reldir, dirpath = stack.pop()
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                relpath = f"{reldir}/{entry.name}" if reldir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if relpath in exclude_dirs:
+                        continue
+                    for matcher in matchers:
+                        if matcher.is_dir_pruned(relpath) is False:
+                            stack.append((relpath, entry.path))
+                            break
+                elif "." in entry.name and entry.is_file():
+                    yield relpath
 
 
-if __name__ == "__main__":  # pragma: no cover
-    paths = Paths(
-        dir_project_root=Path.cwd().absolute(),
+@dataclasses.dataclass
+class RenderCache:
+    """
+    Content addressed, size bounded on-disk cache of rendered XML documents.
+
+    The key is derived from the file content, the relative path, the
+    repo / branch metadata and the :data:`renderer_version`, so an entry never
+    needs to be invalidated. Least recently used entries are evicted when the
+    cache grows beyond ``max_bytes``.
+
+    :param dir_root: the cache directory.
+    :param max_bytes: size limit of the cache directory.
+    """
+
+    dir_root: Path = dataclasses.field()
+    max_bytes: int = dataclasses.field()
+    hits: int = dataclasses.field(default=0)
+    misses: int = dataclasses.field(default=0)
+
+    @classmethod
+    def get_key(cls, metadata: str, data: bytes) -> str:
+        """
+        :param metadata: everything other than the file content that affects
+            the rendered XML.
+        :param data: the file content.
+        """
+        h = hashlib.sha256()
+        h.update(renderer_version.encode("utf-8"))
+        h.update(b"\0")
+        h.update(metadata.encode("utf-8"))
+        h.update(b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def get_path(self, key: str, ext: str = "xml") -> Path:
+        return self.dir_root.joinpath(key[:2], f"{key}.{ext}")
+
+    def get(self, key: str, path_out: Path, ext: str = "xml") -> bool:
+        """
+        Copy the cached XML to ``path_out`` if the key is in the cache.
+
+        :param ext: file extension of the entry, other than rendered XML, the
+            cache also stores compressed assets.
+        """
+        path = self.get_path(key, ext)
+        try:
+            shutil.copyfile(path, path_out)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        # mark it as recently used
+        os.utime(path)
+        self.hits += 1
+        return True
+
+    def put(self, key: str, path_xml: Path, ext: str = "xml"):
+        path = self.get_path(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temp file first, a killed run never leaves a partial entry
+        path_tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        shutil.copyfile(path_xml, path_tmp)
+        os.replace(path_tmp, path)
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries until the cache fits in
+        ``max_bytes``.
+
+        :returns: number of removed entries.
+        """
+        entries = list()
+        total = 0
+        for path in self.dir_root.glob("*/*.*"):
+            if path.suffix == ".tmp":  # being written by another process
+                continue
+            # the zipapp extracts into a temp directory next to its entry,
+            # a killed extraction leaves it behind
+            if not path.is_file():
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        n_removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink()
+            total -= size
+            n_removed += 1
+        return n_removed
+
+
+@dataclasses.dataclass
+class RenderedDocument:
+    """
+    A repository file that has been rendered to its XML staging file.
+
+    :param path: the file path relative to the repository root, using ``/``
+        as the separator.
+    :param path_xml: the rendered XML file in the staging directory, or a
+        previously published asset that contains the rendered XML.
+    :param offset: byte offset of the rendered XML in ``path_xml``.
+    :param size: byte size of the rendered XML, ``None`` means until the end
+        of ``path_xml``.
+    :param sha256: hash of the file content, ``None`` if unknown.
+    """
+
+    path: str = dataclasses.field()
+    path_xml: Path = dataclasses.field()
+    offset: int = dataclasses.field(default=0)
+    size: T.Optional[int] = dataclasses.field(default=None)
+    sha256: T.Optional[str] = dataclasses.field(default=None)
+
+    def get_size(self) -> int:
+        if self.size is None:
+            return self.path_xml.stat().st_size - self.offset
+        return self.size
+
+    def read_bytes(self) -> bytes:
+        with self.path_xml.open("rb") as f:
+            f.seek(self.offset)
+            return f.read(-1 if self.size is None else self.size)
+
+
+@dataclasses.dataclass
+class DocumentSet:
+    """
+    The shared, in-memory set of rendered documents.
+
+    Every candidate file is rendered exactly once, no matter how many document
+    groups include it. Each group is then resolved as a selection over this
+    set instead of walking and rendering the repository again.
+
+    :param documents: rendered documents keyed by their relative path.
+    :param selections: document group name to the sorted list of relative
+        paths selected by that group.
+    :param compacted: compact mode to the compacted Python documents keyed by
+        their relative path, they are used by the groups with
+        :attr:`DocumentGroup.compact`.
+    :param excerpts: head and tail excerpts of the files that are too large
+        for some groups, keyed by their relative path.
+    :param file_sizes: relative path to the file size of every selected file.
+    """
+
+    documents: dict[str, RenderedDocument] = dataclasses.field()
+    selections: dict[str, list[str]] = dataclasses.field()
+    compacted: dict[str, dict[str, RenderedDocument]] = dataclasses.field(
+        default_factory=dict
     )
-    # fmt: off
+    excerpts: dict[str, RenderedDocument] = dataclasses.field(default_factory=dict)
+    file_sizes: dict[str, int] = dataclasses.field(default_factory=dict)
+
+    def select(self, group: DocumentGroup) -> list[RenderedDocument]:
+        """
+        Return the rendered documents of a document group, sorted by path,
+        or by :attr:`DocumentGroup.priority` if given.
+        """
+        relpaths = self.selections[group.name]
+        if group.priority:
+            matchers = [
+                PathMatcher.new(include=[pattern], exclude=[])
+                for pattern in group.priority
+            ]
+
+            def get_rank(relpath: str) -> int:
+                for rank, matcher in enumerate(matchers):
+                    if matcher.is_match(relpath):
+                        return rank
+                return len(matchers)
+
+            # sorted is stable, so it keeps the path order within a rank
+            relpaths = sorted(relpaths, key=get_rank)
+        compacted = self.compacted.get(group.compact, {})
+        documents = list()
+        for relpath in relpaths:
+            if group.is_oversize(self.file_sizes[relpath]):
+                documents.append(self.excerpts[relpath])
+            else:
+                documents.append(compacted.get(relpath) or self.documents[relpath])
+        return documents
+
+    def get_missing_compacted(self, config: "Config") -> dict[str, list[str]]:
+        """
+        :returns: compact mode to the sorted Python files that are selected
+            by a group with that mode, but not compacted yet.
+        """
+        missing = dict()
+        for group in config.document_groups:
+            if group.compact is None:
+                continue
+            compacted = self.compacted.get(group.compact, {})
+            missing.setdefault(group.compact, set()).update(
+                relpath
+                for relpath in self.selections[group.name]
+                if is_compactable(relpath)
+                and relpath not in compacted
+                and not group.is_oversize(self.file_sizes[relpath])
+            )
+        return {mode: sorted(relpaths) for mode, relpaths in missing.items() if relpaths}
+
+
+def scan_repo(
+    dir_repo: Path,
+    config: "Config",
+) -> dict[str, list[str]]:
+    """
+    Walk the repository once and match every file against all document groups.
+
+    :returns: relative path to the list of document group names including it,
+        sorted by path.
+    """
+    matchers = {
+        group.name: PathMatcher.new(include=group.include, exclude=group.exclude)
+        for group in config.document_groups
+    }
+    matches = dict()
+    for relpath in iter_repo_files(dir_repo, list(matchers.values())):
+        names = [name for name, matcher in matchers.items() if matcher.is_match(relpath)]
+        if names:
+            matches[relpath] = names
+    return dict(sorted(matches.items()))
+
+
+def get_staging_name(domain: str, path: str) -> str:
+    """
+    Get the staging XML file name of a document, same as
+    :meth:`docpack.api.GitHubFile.export_to_file`.
+    """
+    hash_key = "/".join(
+        [domain, env_var.ACC_NAME, env_var.REPO_NAME, env_var.GITHUB_REF_NAME, path]
+    )
+    uri_hash = hashlib.sha256(hash_key.encode("utf-8")).hexdigest()[:7]
+    return f"{path.replace('/', '~')}~{uri_hash}.xml"
+
+
+compact_modes = ("basic", "strip")
+
+_license_banner_regex = re.compile(r"licen[cs]e|copyright|spdx", re.IGNORECASE)
+
+
+def is_compactable(relpath: str) -> bool:
+    return relpath.endswith(".py")
+
+
+def compact_python(source: str, strip: bool = False) -> str:
+    """
+    Make Python source code smaller without changing what it does.
+
+    It removes the license banner at the top of the file, trailing
+    whitespace, and collapses blank line runs into a single blank line. With
+    ``strip``, it also removes comments and docstrings. It works on the
+    ``tokenize`` tokens, so string literals are never touched, and returns
+    the source unchanged if it can't be tokenized or the result is not valid
+    Python.
+    """
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    except (tokenize.TokenError, SyntaxError, IndentationError):
+        return source
+    lines = source.splitlines(keepends=True)
+    line_offsets = [0]
+    for line in lines:
+        line_offsets.append(line_offsets[-1] + len(line))
+
+    def get_offset(position: tuple[int, int]) -> int:
+        return line_offsets[position[0] - 1] + position[1]
+
+    def is_pragma(token: tokenize.TokenInfo) -> bool:
+        # the shebang and the encoding declaration
+        return token.start[0] <= 2 and (
+            token.string.startswith("#!") or "coding" in token.string
+        )
+
+    # (start, end, replacement) of the spans to remove
+    removes = list()
+    # the leading comment block, if it looks like a license banner
+    banner = list()
+    for token in tokens:
+        if token.type == tokenize.COMMENT:
+            if not is_pragma(token):
+                banner.append(token)
+        elif token.type != tokenize.NL:
+            break
+    if any(_license_banner_regex.search(token.string) for token in banner):
+        removes.extend((token.start, token.end, "") for token in banner)
+
+    if strip:
+        significant = [
+            token
+            for token in tokens
+            if token.type not in (tokenize.NL, tokenize.COMMENT)
+        ]
+        for token in tokens:
+            if token.type == tokenize.COMMENT and not is_pragma(token):
+                if token not in banner:
+                    removes.append((token.start, token.end, ""))
+        for i, token in enumerate(significant):
+            if token.type != tokenize.STRING:
+                continue
+            prev_type = significant[i - 1].type if i else None
+            if prev_type not in (None, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+                continue
+            if i + 1 >= len(significant) or significant[i + 1].type != tokenize.NEWLINE:
+                continue
+            # a bare string statement, keep a placeholder if it is the only
+            # statement of its block
+            is_only = (
+                prev_type == tokenize.INDENT
+                and i + 2 < len(significant)
+                and significant[i + 2].type == tokenize.DEDENT
+            )
+            removes.append((token.start, token.end, "..." if is_only else ""))
+
+    # the lines ending inside a multi-line token, they must be kept as is
+    removed = {start for start, _, _ in removes}
+    protected = set()
+    for token in tokens:
+        if (
+            token.start[0] < token.end[0]
+            and token.type not in (tokenize.NEWLINE, tokenize.NL)
+            and token.start not in removed
+        ):
+            protected.update(range(token.start[0], token.end[0]))
+
+    chars = list()
+    cursor = 0
+    for start, end, replacement in sorted(removes):
+        start, end = get_offset(start), get_offset(end)
+        chars.append(source[cursor:start])
+        # keep the line breaks so the line numbers don't change
+        chars.append(replacement + "\n" * source.count("\n", start, end))
+        cursor = end
+    chars.append(source[cursor:])
+    compacted = "".join(chars)
+
+    results = list()
+    for lineno, line in enumerate(compacted.splitlines(keepends=True), start=1):
+        if lineno in protected:
+            results.append(line)
+            continue
+        line = line.rstrip() + "\n"
+        if line == "\n":
+            # the whole line was removed, or a blank line run
+            if lines[lineno - 1].strip() or not results or results[-1] == "\n":
+                continue
+        results.append(line)
+    while results and results[-1] == "\n":
+        results.pop()
+    compacted = "".join(results)
+    try:
+        ast.parse(compacted)
+    except SyntaxError:
+        return source
+    return compacted
+
+
+# how much of a file is read to tell if it is binary
+SNIFF_BYTES = 8 * 1024
+# how much of the head and of the tail of a large file goes into its excerpt
+EXCERPT_BYTES = 8 * 1024
+
+
+def is_binary(head: bytes) -> bool:
+    """
+    Tell if a file is binary from its first bytes, it is binary if it has a
+    NUL byte or is not valid UTF-8.
+    """
+    if b"\0" in head:
+        return True
+    try:
+        # the head may end in the middle of a multibyte character
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def extract_domain(url: str) -> str:
+    """
+    Same as :func:`docpack.github_fetcher.extract_domain`, without importing
+    pydantic, the domain is part of the render cache key.
+    """
+    domain = url.split("://")[1] if "://" in url else url
+    return domain.split("/")[0]
+
+
+def render_document(
+    domain: str,
+    path: str,
+    content: str,
+) -> str:
+    """
+    Render a repository file to the knowledge base XML format.
+    """
+    from docpack.github_fetcher import GitHubFile, get_github_url
+
+    path_parts = tuple(path.split("/"))
+    github_file = GitHubFile(
+        domain=domain,
+        account=env_var.ACC_NAME,
+        repo=env_var.REPO_NAME,
+        branch=env_var.GITHUB_REF_NAME,
+        github_url=get_github_url(
+            domain=domain,
+            account=env_var.ACC_NAME,
+            repo=env_var.REPO_NAME,
+            branch=env_var.GITHUB_REF_NAME,
+            path_parts=path_parts,
+        ),
+        path_parts=path_parts,
+        title="",
+        description="",
+        content=content,
+    )
+    return github_file.to_xml()
+
+
+@dataclasses.dataclass
+class DocumentRenderer:
+    """
+    Render repository files into the staging directory.
+
+    :param cache: if given, unchanged files are copied from the render cache
+        instead of being rendered again.
+    """
+
+    paths: Paths = dataclasses.field()
+    cache: T.Optional[RenderCache] = dataclasses.field(default=None)
+
+    @cached_property
+    def domain(self) -> str:
+        return extract_domain(env_var.GITHUB_SERVER_URL)
+
+    @cached_property
+    def metadata(self) -> str:
+        """
+        The repo and branch metadata that goes into every rendered document.
+        """
+        return "/".join(
+            [self.domain, env_var.ACC_NAME, env_var.REPO_NAME, env_var.GITHUB_REF_NAME]
+        )
+
+    def render(
+        self,
+        relpath: str,
+        compact: T.Optional[str] = None,
+        excerpt: bool = False,
+    ) -> T.Optional[RenderedDocument]:
+        """
+        :param compact: the compact mode, see :attr:`DocumentGroup.compact`.
+        :param excerpt: only render the first and the last
+            :data:`EXCERPT_BYTES` of the file with a marker in between, the
+            rest of the file is never read.
+
+        :returns: ``None`` if it is a binary file, it is detected from the
+            first :data:`SNIFF_BYTES` before reading the rest.
+        """
+        path_xml = self.paths.dir_staging.joinpath(
+            get_staging_name(self.domain, relpath)
+        )
+        metadata = f"{self.metadata}/{relpath}"
+        variant = "excerpt" if excerpt else compact
+        if variant is not None:
+            path_xml = self.paths.dir_staging.joinpath(variant, path_xml.name)
+            path_xml.parent.mkdir(exist_ok=True)
+            metadata = f"{metadata}/{variant if excerpt else f'compact-{compact}'}"
+        with self.paths.dir_project_root.joinpath(relpath).open("rb") as f:
+            data = f.read(SNIFF_BYTES)
+            if is_binary(data):
+                return None
+            if excerpt:
+                file_size = os.fstat(f.fileno()).st_size
+                head = data[:EXCERPT_BYTES]
+                f.seek(max(file_size - EXCERPT_BYTES, len(head)))
+                tail = f.read(EXCERPT_BYTES)
+                n_omitted = file_size - len(head) - len(tail)
+                data = head + f"\0{n_omitted}\0".encode("utf-8") + tail
+            else:
+                data += f.read()
+        sha256 = None if excerpt else sha256_of(data)
+        key = None
+        if self.cache is not None:
+            key = self.cache.get_key(metadata, data)
+        if key is None or self.cache.get(key, path_xml) is False:
+            if excerpt:
+                # the cut may be in the middle of a multibyte character
+                content = "\n".join(
+                    [
+                        head.decode("utf-8", errors="ignore"),
+                        f"... {n_omitted} bytes omitted, the file is too large ...",
+                        tail.decode("utf-8", errors="ignore"),
+                    ]
+                )
+            else:
+                try:
+                    content = data.decode("utf-8")
+                except UnicodeDecodeError:
+                    return None
+            # same as ``Path.read_text``, with universal newlines
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+            if compact is not None and not excerpt:
+                content = compact_python(content, strip=compact == "strip")
+            xml = render_document(domain=self.domain, path=relpath, content=content)
+            xml_data = xml.encode("utf-8")
+            path_xml.write_bytes(xml_data)
+            size = len(xml_data)
+            if key is not None:
+                self.cache.put(key, path_xml)
+        else:
+            size = path_xml.stat().st_size
+        return RenderedDocument(
+            path=relpath,
+            path_xml=path_xml,
+            size=size,
+            sha256=sha256,
+        )
+
+    def render_many(
+        self,
+        relpaths: list[str],
+        jobs: int = 1,
+        compact: T.Optional[str] = None,
+        excerpt: bool = False,
+    ) -> list[T.Optional[RenderedDocument]]:
+        """
+        Render many files, in a pool of ``jobs`` worker processes if ``jobs > 1``.
+
+        Every file is rendered to its own staging file, so the result doesn't
+        depend on the number of workers.
+        """
+        if jobs <= 1 or len(relpaths) <= jobs:
+            return [
+                self.render(relpath, compact=compact, excerpt=excerpt)
+                for relpath in relpaths
+            ]
+        # a few chunks per worker balances the load without much IPC overhead
+        n_chunks = jobs * 4
+        chunks = [relpaths[i::n_chunks] for i in range(n_chunks)]
+        documents = dict()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(
+                _render_chunk,
+                [self] * n_chunks,
+                chunks,
+                [compact] * n_chunks,
+                [excerpt] * n_chunks,
+            )
+            for chunk, (rendered, hits, misses) in zip(chunks, results):
+                documents.update(zip(chunk, rendered))
+                if self.cache is not None:
+                    self.cache.hits += hits
+                    self.cache.misses += misses
+        return [documents[relpath] for relpath in relpaths]
+
+    def reset_staging(self):
+        # Clean up the staging directory to get a fresh start
+        shutil.rmtree(self.paths.dir_staging, ignore_errors=True)
+        self.paths.dir_staging.mkdir(parents=True)
+
+    def report_cache(self):
+        if self.cache is not None:
+            n_evicted = self.cache.evict()
+            print(
+                f"render cache: {self.cache.hits} hits, {self.cache.misses} misses, "
+                f"{n_evicted} evicted"
+            )
+
+
+def _render_chunk(
+    renderer: DocumentRenderer,
+    relpaths: list[str],
+    compact: T.Optional[str] = None,
+    excerpt: bool = False,
+) -> tuple[list[T.Optional[RenderedDocument]], int, int]:
+    """
+    Worker process entry point of :meth:`DocumentRenderer.render_many`.
+
+    :returns: the rendered documents and the render cache hits and misses.
+    """
+    cache = renderer.cache
+    hits, misses = (0, 0) if cache is None else (cache.hits, cache.misses)
+    documents = [
+        renderer.render(relpath, compact=compact, excerpt=excerpt)
+        for relpath in relpaths
+    ]
+    if cache is None:
+        return documents, 0, 0
+    return documents, cache.hits - hits, cache.misses - misses
+
+
+def render_documents(
+    paths: Paths,
+    config: "Config",
+    cache: T.Optional[RenderCache] = None,
+    jobs: int = 1,
+) -> DocumentSet:
+    """
+    Render every file selected by at least one document group exactly once.
+
+    :param cache: if given, unchanged files are copied from the render cache
+        instead of being rendered again.
+    :param jobs: number of worker processes to render files.
+    """
+    print("Extract documents from git repo ...")
+    renderer = DocumentRenderer(paths=paths, cache=cache)
+    renderer.reset_staging()
+    # the walk finishes before rendering, so staging files never match
+    with metrics.stage("scan") as stage:
+        matches = scan_repo(dir_repo=paths.dir_project_root, config=config)
+        stage.add(files=len(matches))
+    document_set = DocumentSet(
+        documents=dict(),
+        selections={group.name: list() for group in config.document_groups},
+    )
+    render_matches(
+        renderer=renderer,
+        config=config,
+        document_set=document_set,
+        matches=matches,
+        jobs=jobs,
+    )
+    print(f"rendered {len(document_set.documents)} documents")
+    render_compacted(renderer=renderer, config=config, document_set=document_set, jobs=jobs)
+    renderer.report_cache()
+    return document_set
+
+
+def render_matches(
+    renderer: DocumentRenderer,
+    config: "Config",
+    document_set: DocumentSet,
+    matches: dict[str, list[str]],
+    jobs: int = 1,
+    unresolved: T.Iterable[str] = (),
+):
+    """
+    Add the matched files to the selections of their document groups, and
+    render them into the document set.
+
+    The size of every file is checked before it is read. A file larger than
+    :attr:`DocumentGroup.max_file_bytes` is dropped from the group, or
+    rendered as an excerpt, depending on :attr:`DocumentGroup.oversize`.
+    Binary files are dropped from all groups.
+
+    :param matches: relative path to the document group names including it,
+        see :func:`scan_repo`.
+    :param unresolved: files that are already selected, but not rendered yet.
+    """
+    groups = {group.name: group for group in config.document_groups}
+    full = list(unresolved)
+    excerpt = list()
+    for relpath, names in matches.items():
+        file_size = renderer.paths.dir_project_root.joinpath(relpath).stat().st_size
+        document_set.file_sizes[relpath] = file_size
+        is_full = is_excerpt = False
+        for name in names:
+            group = groups[name]
+            if group.is_oversize(file_size):
+                if group.oversize == "skip":
+                    print(
+                        f"skip {relpath!r} in document group {name!r}, {file_size} "
+                        f"bytes is larger than max_file_bytes {group.max_file_bytes}"
+                    )
+                    continue
+                is_excerpt = True
+            else:
+                is_full = True
+            document_set.selections[name].append(relpath)
+        if is_full:
+            full.append(relpath)
+        if is_excerpt:
+            excerpt.append(relpath)
+    binaries = set()
+    with metrics.stage("render") as stage:
+        for relpaths, documents, is_excerpt in [
+            (full, document_set.documents, False),
+            (excerpt, document_set.excerpts, True),
+        ]:
+            rendered = renderer.render_many(relpaths, jobs=jobs, excerpt=is_excerpt)
+            for relpath, document in zip(relpaths, rendered):
+                if document is None:
+                    binaries.add(relpath)
+                else:
+                    documents[relpath] = document
+                    stage.add(files=1, bytes=document.size or 0)
+    for relpath in sorted(binaries):
+        print(f"skip binary file {relpath!r}")
+        document_set.documents.pop(relpath, None)
+        document_set.excerpts.pop(relpath, None)
+    if binaries:
+        for name, relpaths in document_set.selections.items():
+            document_set.selections[name] = [
+                relpath for relpath in relpaths if relpath not in binaries
+            ]
+
+
+def render_compacted(
+    renderer: DocumentRenderer,
+    config: "Config",
+    document_set: DocumentSet,
+    jobs: int = 1,
+):
+    """
+    Render the compacted variant of the Python files selected by the groups
+    with :attr:`DocumentGroup.compact`, and print the size before and after.
+    """
+    for mode, relpaths in document_set.get_missing_compacted(config).items():
+        compacted = document_set.compacted.setdefault(mode, dict())
+        with metrics.stage(f"compact:{mode}") as stage:
+            for document in renderer.render_many(relpaths, jobs=jobs, compact=mode):
+                compacted[document.path] = document
+                stage.add(files=1, bytes=document.size or 0)
+        before = sum(document_set.documents[relpath].get_size() for relpath in relpaths)
+        after = sum(compacted[relpath].get_size() for relpath in relpaths)
+        print(f"compact {len(relpaths)} Python files ({mode}): {before} -> {after} bytes")
+
+
+@dataclasses.dataclass
+class BuildState:
+    """
+    What a published knowledge base was built from.
+
+    It is published as the ``knowledge-base-state.json`` release asset next
+    to the document group assets, so the next run can patch the previous
+    assets instead of building everything from scratch.
+
+    :param renderer_version: the :data:`renderer_version` of the build.
+    :param metadata: the repo and branch metadata of the rendered documents.
+    :param commit: the git commit the knowledge base was built from.
+    :param config_sha256: hash of the :class:`Config`.
+    :param prompt_sha256: hash of the ``prompt.md``.
+    :param groups: document group name to the list of
+        ``(path, offset, size)`` of every document in the group asset.
+    :param digests: asset name to the sha256 of the asset, it is used to skip
+        uploading unchanged assets.
+    :param hashes: relative path to the sha256 of the file content.
+    :param duplicates: document group name to the paths that are emitted as
+        a reference to an identical file in the group asset.
+    """
+
+    renderer_version: str = dataclasses.field()
+    metadata: str = dataclasses.field()
+    commit: T.Optional[str] = dataclasses.field()
+    config_sha256: str = dataclasses.field()
+    prompt_sha256: str = dataclasses.field()
+    groups: dict[str, list[tuple[str, int, int]]] = dataclasses.field()
+    digests: dict[str, str] = dataclasses.field(default_factory=dict)
+    hashes: dict[str, str] = dataclasses.field(default_factory=dict)
+    duplicates: dict[str, list[str]] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, dct: dict[str, T.Any]):
+        dct = dict(dct)
+        dct["groups"] = {
+            name: [tuple(row) for row in rows] for name, rows in dct["groups"].items()
+        }
+        return cls(**dct)
+
+    @classmethod
+    def from_json(cls, path: Path):
+        return cls.from_dict(json.loads(path.read_text(encoding="utf-8")))
+
+    def to_json(self, path: Path):
+        write_text(path, json.dumps(dataclasses.asdict(self), indent=2))
+
+
+def get_changed_paths(
+    dir_repo: Path,
+    commit: str,
+) -> T.Optional[tuple[set[str], set[str]]]:
+    """
+    Get the tracked files changed between the given commit and the working
+    tree, committed or not. Files git doesn't track are not included.
+
+    If the commit is not in a shallow clone, it tries to fetch it first.
+
+    :returns: ``(deleted, updated)`` relative paths, renamed files show up
+        in both, or ``None`` if the diff is not available.
+    """
+    if run_git(dir_repo, "cat-file", "-e", f"{commit}^{{commit}}") is None:
+        print(f"commit {commit} not found, fetching it ...")
+        if run_git(dir_repo, "fetch", "--no-tags", "--depth=1", "origin", commit) is None:
+            return None
+    out = run_git(dir_repo, "diff", "--name-status", "-M", "-z", commit)
+    if out is None:
+        return None
+    deleted, updated = set(), set()
+    fields = out.split("\0")
+    i = 0
+    while i < len(fields) - 1:
+        status = fields[i]
+        if status[0] in "RC":  # rename and copy have both the old and new path
+            old, new = fields[i + 1], fields[i + 2]
+            if status[0] == "R":
+                deleted.add(old)
+            updated.add(new)
+            i += 3
+        else:
+            if status[0] == "D":
+                deleted.add(fields[i + 1])
+            else:
+                updated.add(fields[i + 1])
+            i += 2
+    return deleted, updated
+
+
+def get_config_sha256(config: "Config") -> str:
+    return sha256_of(
+        json.dumps(dataclasses.asdict(config), sort_keys=True).encode("utf-8")
+    )
+
+
+def patch_documents(
+    paths: Paths,
+    config: "Config",
+    previous: BuildState,
+    prompt: bytes,
+    cache: T.Optional[RenderCache] = None,
+    jobs: int = 1,
+) -> T.Optional[DocumentSet]:
+    """
+    Reuse the documents of the previously published assets and only render
+    the files that are added, modified or renamed since the previous build.
+
+    The previous assets have to be downloaded to :attr:`Paths.dir_previous`.
+
+    :returns: ``None`` if an incremental build is not possible, for example
+        the config or the prompt changed, then a full build is needed.
+    """
+    print("Patch previously published documents ...")
+    renderer = DocumentRenderer(paths=paths, cache=cache)
+    reason = None
+    if previous.renderer_version != renderer_version:
+        reason = "renderer version changed"
+    elif previous.metadata != renderer.metadata:
+        reason = "repo or branch changed"
+    elif previous.config_sha256 != get_config_sha256(config):
+        reason = "config changed"
+    elif previous.prompt_sha256 != sha256_of(prompt):
+        reason = "prompt changed"
+    elif previous.commit is None:
+        reason = "previous commit is unknown"
+    elif set(previous.groups) != {group.name for group in config.document_groups}:
+        reason = "document groups changed"
+    elif any(
+        paths.dir_previous.joinpath(group.asset_name).exists() is False
+        for group in config.document_groups
+    ):
+        reason = "previous assets are not available"
+    if reason is None:
+        changes = get_changed_paths(paths.dir_project_root, previous.commit)
+        if changes is None:
+            reason = f"can not diff against commit {previous.commit}"
+    if reason is not None:
+        print(f"{reason}, fall back to full build")
+        return None
+
+    deleted, updated = changes
+    renderer.reset_staging()
+    # Untracked, ignored or generated files are not in the diff, but the full
+    # build finds them by walking the file system, so walk it too. They are
+    # rendered again every time, mostly from the render cache.
+    with metrics.stage("scan") as stage:
+        all_matches = scan_repo(dir_repo=paths.dir_project_root, config=config)
+        stage.add(files=len(all_matches))
+    tracked = run_git(paths.dir_project_root, "ls-files", "-z")
+    if tracked is None:  # pragma: no cover
+        print("can not list the tracked files, fall back to full build")
+        return None
+    untracked = set(all_matches).difference(tracked.split("\0"))
+    updated = updated | untracked
+    deleted = deleted | {
+        relpath
+        for index in previous.groups.values()
+        for relpath, _, _ in index
+        if relpath not in all_matches
+    }
+    print(
+        f"{len(deleted)} deleted, {len(updated)} added or modified files, "
+        f"{len(untracked)} of them are not tracked by git"
+    )
+    documents = dict()
+    selections = {group.name: list() for group in config.document_groups}
+    compacted = dict()
+    excerpts = dict()
+    file_sizes = dict()
+    for group in config.document_groups:
+        path_asset = paths.dir_previous.joinpath(group.asset_name)
+        duplicates = set(previous.duplicates.get(group.name, []))
+        if group.compact is not None:
+            compacted.setdefault(group.compact, dict())
+        for relpath, offset, size in previous.groups[group.name]:
+            if relpath in deleted or relpath in updated:
+                continue
+            selections[group.name].append(relpath)
+            if relpath not in file_sizes:
+                file_sizes[relpath] = (
+                    paths.dir_project_root.joinpath(relpath).stat().st_size
+                )
+            # the previous asset only has a reference to an identical file
+            if relpath in duplicates:
+                continue
+            reused = documents
+            if group.is_oversize(file_sizes[relpath]):
+                reused = excerpts
+            elif group.compact is not None and is_compactable(relpath):
+                reused = compacted[group.compact]
+            if relpath not in reused:
+                reused[relpath] = RenderedDocument(
+                    path=relpath,
+                    path_xml=path_asset,
+                    offset=offset,
+                    size=size,
+                    # the whole content of an excerpt is never read
+                    sha256=None if reused is excerpts else previous.hashes.get(relpath),
+                )
+    # same candidates as the full repo walk
+    matches = {
+        relpath: names for relpath, names in all_matches.items() if relpath in updated
+    }
+    # unchanged files that are only available as a reference
+    unresolved = sorted(
+        {
+            relpath
+            for group in config.document_groups
+            for relpath in selections[group.name]
+            if not group.is_oversize(file_sizes[relpath])
+        }
+        - set(documents)
+    )
+    document_set = DocumentSet(
+        documents=documents,
+        selections=selections,
+        compacted=compacted,
+        excerpts=excerpts,
+        file_sizes=file_sizes,
+    )
+    n_reused = len(documents) + len(excerpts)
+    render_matches(
+        renderer=renderer,
+        config=config,
+        document_set=document_set,
+        matches=matches,
+        jobs=jobs,
+        unresolved=unresolved,
+    )
+    for name in selections:
+        selections[name].sort()
+    n_rendered = len(documents) + len(excerpts) - n_reused
+    print(f"rendered {n_rendered} documents, reused {n_reused}")
+    render_compacted(renderer=renderer, config=config, document_set=document_set, jobs=jobs)
+    renderer.report_cache()
+    return document_set
+
+
+# chunk size of the buffered copy, it caps the memory used by the combine step
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def _copy_with_copy_file_range(fd_in: int, fd_out: int, offset: int, size: int) -> int:
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(fd_in, fd_out, size - copied, offset + copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def _copy_with_sendfile(fd_in: int, fd_out: int, offset: int, size: int) -> int:
+    copied = 0
+    while copied < size:
+        n = os.sendfile(fd_out, fd_in, offset + copied, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def _copy_with_buffer(
+    fd_in: int,
+    fd_out: int,
+    offset: int,
+    size: int,
+    h: T.Optional["hashlib._Hash"] = None,
+) -> int:
+    os.lseek(fd_in, offset, os.SEEK_SET)
+    copied = 0
+    while copied < size:
+        data = os.read(fd_in, min(COPY_BUFFER_SIZE, size - copied))
+        if not data:
+            break
+        if h is not None:
+            h.update(data)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd_out, view) :]
+        copied += len(data)
+    return copied
+
+
+def _hash_range(fd: int, offset: int, size: int, h: "hashlib._Hash"):
+    hashed = 0
+    while hashed < size:
+        data = os.pread(fd, min(COPY_BUFFER_SIZE, size - hashed), offset + hashed)
+        if not data:
+            break
+        h.update(data)
+        hashed += len(data)
+
+
+# Copy methods in order of preference. The zero-copy ones are dropped the
+# first time the OS or file system says it doesn't support them.
+_copy_methods = list()
+if hasattr(os, "copy_file_range"):  # pragma: no cover
+    _copy_methods.append(_copy_with_copy_file_range)
+if sys.platform.startswith("linux"):  # pragma: no cover
+    _copy_methods.append(_copy_with_sendfile)
+_copy_methods.append(_copy_with_buffer)
+# document groups are combined in concurrent threads
+_copy_methods_lock = threading.Lock()
+
+_unsupported_errnos = {
+    errno.ENOSYS,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+}
+
+
+def copy_range(
+    fd_in: int,
+    fd_out: int,
+    offset: int,
+    size: int,
+    h: T.Optional["hashlib._Hash"] = None,
+):
+    """
+    Copy ``size`` bytes starting at ``offset`` of ``fd_in`` to the current
+    position of ``fd_out``.
+
+    It uses ``copy_file_range`` or ``sendfile`` when available, so the data
+    doesn't go through Python memory, otherwise a fixed-size buffer.
+
+    :param h: a hash updated with the copied bytes. The buffer hashes the
+        bytes it copies, after a zero-copy the source range is hashed, it was
+        just read so it comes from the page cache.
+    """
+    start = os.lseek(fd_out, 0, os.SEEK_CUR)
+    for method in list(_copy_methods):
+        try:
+            if method is _copy_with_buffer:
+                copied = method(fd_in, fd_out, offset, size, h=h)
+            else:
+                copied = method(fd_in, fd_out, offset, size)
+        except OSError as e:
+            if method is _copy_with_buffer or e.errno not in _unsupported_errnos:
+                raise
+            with _copy_methods_lock:
+                # another thread may have dropped it already
+                if method in _copy_methods:
+                    _copy_methods.remove(method)
+            # start over from where this document began
+            os.lseek(fd_out, start, os.SEEK_SET)
+            continue
+        if copied != size:
+            raise ValueError(
+                f"expect {size} bytes at offset {offset}, only got {copied} bytes"
+            )
+        if h is not None and method is not _copy_with_buffer:
+            _hash_range(fd_in, offset, size, h)
+        return
+
+
+def combine_documents(
+    path_asset: Path,
+    prompt: bytes,
+    documents: list[RenderedDocument],
+) -> tuple[list[tuple[str, int, int]], str]:
+    """
+    Stream the prompt and the documents, separated by newlines, into the asset.
+
+    Documents are copied from their XML files chunk by chunk, so the memory
+    usage doesn't grow with the size of the document group. The sha256 is
+    taken while writing, the asset is never read back.
+
+    :returns: ``(path, offset, size)`` of every document in the asset, and
+        the sha256 of the asset.
+    """
+    path_asset.parent.mkdir(parents=True, exist_ok=True)
+    index = list()
+    h = hashlib.sha256(prompt)
+    with path_asset.open("wb", buffering=0) as f_out:
+        fd_out = f_out.fileno()
+        f_out.write(prompt)
+        offset = len(prompt)
+        for document in documents:
+            with document.path_xml.open("rb", buffering=0) as f_in:
+                fd_in = f_in.fileno()
+                if document.size is None:
+                    size = os.fstat(fd_in).st_size - document.offset
+                else:
+                    size = document.size
+                f_out.write(b"\n")
+                h.update(b"\n")
+                offset += 1
+                copy_range(fd_in, fd_out, document.offset, size, h=h)
+            index.append((document.path, offset, size))
+            offset += size
+    return index, h.hexdigest()
+
+
+def compress_file(path_in: Path, path_out: Path, fmt: str):
+    """
+    Stream compress a file. The output only depends on the input content,
+    so an unchanged asset always has the same compressed bytes.
+
+    :param fmt: one of :data:`compression_formats`.
+    """
+    with path_in.open("rb") as f_in, path_out.open("wb") as f_raw:
+        if fmt == "gz":
+            with gzip.GzipFile(filename="", mode="wb", fileobj=f_raw, mtime=0) as f_out:
+                shutil.copyfileobj(f_in, f_out, COPY_BUFFER_SIZE)
+        elif fmt == "zip":
+            info = zipfile.ZipInfo(path_in.name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            force_zip64 = path_in.stat().st_size >= zipfile.ZIP64_LIMIT
+            with zipfile.ZipFile(f_raw, mode="w") as zf:
+                with zf.open(info, mode="w", force_zip64=force_zip64) as f_out:
+                    shutil.copyfileobj(f_in, f_out, COPY_BUFFER_SIZE)
+        elif fmt == "zst":  # pragma: no cover
+            try:  # Python 3.14+
+                from compression import zstd
+
+                with zstd.ZstdFile(f_raw, mode="wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out, COPY_BUFFER_SIZE)
+            except ImportError:
+                try:
+                    import zstandard
+                except ImportError:
+                    raise ImportError(
+                        "zst compression requires Python 3.14+ "
+                        "or 'pip install zstandard'"
+                    )
+                zstandard.ZstdCompressor().copy_stream(
+                    f_in,
+                    f_raw,
+                    size=path_in.stat().st_size,
+                )
+        else:
+            raise ValueError(f"invalid compression {fmt!r}")
+
+
+def estimate_tokens(size: int) -> int:
+    """
+    Cheap token estimate from the byte size, about 4 bytes per token.
+    """
+    return (size + 3) // 4
+
+
+def _iter_pack_units(
+    items: list[tuple[int, str, int]],
+    depth: int,
+    max_size: int,
+) -> T.Iterable[list[tuple[int, str, int]]]:
+    """
+    Split ``(index, path, size)`` items into units that fit ``max_size``.
+    A run of items in the same directory is kept as a single unit if it fits,
+    otherwise it is split by its sub directories and files.
+    """
+    if sum(size for _, _, size in items) <= max_size:
+        yield items
+        return
+    i = 0
+    while i < len(items):
+        parts = items[i][1].split("/")
+        if len(parts) <= depth + 1:  # a file at this level
+            yield [items[i]]
+            i += 1
+            continue
+        # in path order, a directory is a single run
+        prefix = "/".join(parts[: depth + 1]) + "/"
+        j = i
+        while j < len(items) and items[j][1].startswith(prefix):
+            j += 1
+        yield from _iter_pack_units(items[i:j], depth + 1, max_size)
+        i = j
+
+
+def plan_shards(
+    documents: list[RenderedDocument],
+    max_size: int,
+) -> list[list[RenderedDocument]]:
+    """
+    Pack documents into shards of at most ``max_size`` bytes.
+
+    It is a next-fit bin packing over directory units, see
+    :func:`_iter_pack_units`, so the documents keep the path order and a
+    directory is only split across shards if it doesn't fit in one. A
+    single document larger than ``max_size`` gets its own shard.
+    """
+    # the newline separator before every document
+    items = [
+        (i, document.path, document.get_size() + 1)
+        for i, document in enumerate(documents)
+    ]
+    shards = [[]]
+    used = 0
+    for unit in _iter_pack_units(items, 0, max_size):
+        size = sum(size for _, _, size in unit)
+        if shards[-1] and used + size > max_size:
+            shards.append([])
+            used = 0
+        shards[-1].extend(documents[i] for i, _, _ in unit)
+        used += size
+    return shards
+
+
+def render_shard_index(
+    group: DocumentGroup,
+    shards: list[list[RenderedDocument]],
+    nth: int,
+) -> bytes:
+    """
+    A small index at the top of every shard, it tells the AI this is one of
+    many parts, where the other parts are, and which documents are in this
+    part.
+    """
+    shard = shards[nth - 1]
+    lines = [
+        "<shard_index>",
+        f"  <document_group>{group.name}</document_group>",
+        f"  <shard>{nth} of {len(shards)}</shard>",
+        f"  <parts>{group.get_shard_asset_name(1)} ... "
+        f"{group.get_shard_asset_name(len(shards))}</parts>",
+        f"  <documents>{len(shard)}</documents>",
+        f"  <first_path>{shard[0].path}</first_path>",
+        f"  <last_path>{shard[-1].path}</last_path>",
+        "</shard_index>",
+    ]
+    return "\n".join(lines).encode("utf-8")
+
+
+def build_shards(
+    paths: Paths,
+    group: DocumentGroup,
+    prompt: bytes,
+    documents: list[RenderedDocument],
+) -> dict[str, str]:
+    """
+    Write the document group as numbered shards if it exceeds
+    :attr:`DocumentGroup.max_bytes` or :attr:`DocumentGroup.max_tokens`.
+    Every shard starts with the prompt and the shard index.
+
+    :returns: the shard asset names to their sha256, empty if the group
+        doesn't need sharding.
+    """
+    for path in paths.dir_document_groups.glob(f"{group.name}.part-*.txt"):
+        if group.is_shard_asset_name(path.name):
+            path.unlink()
+    limits = list()
+    if group.max_bytes:
+        limits.append(group.max_bytes)
+    if group.max_tokens:
+        # the token estimate is proportional to the bytes
+        limits.append(group.max_tokens * 4)
+    if not limits:
+        return {}
+    max_size = min(limits)
+    total = len(prompt) + sum(document.get_size() + 1 for document in documents)
+    if total <= max_size:
+        return {}
+    # the header size depends on the number of shards, start with a guess and
+    # make room for the real header until every shard fits
+    reserve = len(prompt) + 1024
+    while True:
+        shards = plan_shards(documents, max(max_size - reserve, 1))
+        headers = [
+            prompt + b"\n" + render_shard_index(group, shards, nth)
+            for nth in range(1, len(shards) + 1)
+        ]
+        overflow = 0
+        for header, shard in zip(headers, shards):
+            if len(shard) > 1:  # a single oversize document can't be helped
+                size = len(header) + sum(document.get_size() + 1 for document in shard)
+                overflow = max(overflow, size - max_size)
+        if overflow <= 0 or reserve >= max_size:
+            break
+        reserve += overflow
+    digests = dict()
+    for nth, (header, shard) in enumerate(zip(headers, shards), start=1):
+        asset_name = group.get_shard_asset_name(nth)
+        _, digests[asset_name] = combine_documents(
+            path_asset=paths.dir_document_groups.joinpath(asset_name),
+            prompt=header,
+            documents=shard,
+        )
+    print(f"split document group {group.name!r} into {len(shards)} shards")
+    return digests
+
+
+def dedup_documents(
+    paths: Paths,
+    group: DocumentGroup,
+    documents: list[RenderedDocument],
+) -> tuple[list[RenderedDocument], dict[str, str]]:
+    """
+    Replace every document whose file content is identical to an earlier
+    document of the group with a small document referring to the earlier
+    one. It uses the content hashes taken at render time, so no file is
+    read. A duplicate is kept as is if the reference is not smaller.
+
+    :returns: the documents to combine, and the path of every replaced
+        document to the path of the document it refers to.
+    """
+    dir_duplicates = paths.dir_staging.joinpath("duplicates", group.name)
+    shutil.rmtree(dir_duplicates, ignore_errors=True)
+    domain = DocumentRenderer(paths=paths).domain
+    originals = dict()
+    duplicates = dict()
+    results = list()
+    for document in documents:
+        original = originals.setdefault(document.sha256, document.path)
+        if document.sha256 is None or original == document.path:
+            results.append(document)
+            continue
+        xml_data = render_document(
+            domain=domain,
+            path=document.path,
+            content=f"Same content as {original}",
+        ).encode("utf-8")
+        if len(xml_data) >= document.get_size():
+            results.append(document)
+            continue
+        path_xml = dir_duplicates.joinpath(get_staging_name(domain, document.path))
+        path_xml.parent.mkdir(parents=True, exist_ok=True)
+        path_xml.write_bytes(xml_data)
+        results.append(
+            RenderedDocument(
+                path=document.path,
+                path_xml=path_xml,
+                size=len(xml_data),
+                sha256=document.sha256,
+            )
+        )
+        duplicates[document.path] = original
+    return results, duplicates
+
+
+def write_manifest(
+    path: Path,
+    index: list[tuple[str, int, int]],
+    documents: list[RenderedDocument],
+    duplicates: dict[str, str],
+    bytes_saved: int,
+):
+    """
+    Write the manifest of a group asset, it lists every document in the asset
+    order with its byte range in the asset and the sha256 of the file
+    content. It comes from the index of the combine pass and the hashes
+    taken at render time, no file is read again.
+
+    :param duplicates: see :func:`dedup_documents`.
+    :param bytes_saved: the bytes saved by dedup.
+    """
+    files = list()
+    for (relpath, offset, size), document in zip(index, documents):
+        file = {"path": relpath, "offset": offset, "size": size, "sha256": document.sha256}
+        if relpath in duplicates:
+            file["duplicate_of"] = duplicates[relpath]
+        files.append(file)
+    manifest = {
+        "files": files,
+        "n_duplicates": len(duplicates),
+        "bytes_saved": bytes_saved,
+    }
+    write_text(path, json.dumps(manifest, indent=2))
+
+
+def map_in_threads(
+    func: T.Callable,
+    items: T.Iterable,
+    jobs: int = 1,
+) -> T.Iterator:
+    """
+    Same as :func:`map`, but in a pool of ``jobs`` threads if ``jobs > 1``,
+    the results are in the order of the items.
+    """
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for future in futures:
+            yield future.result()
+
+
+def build_group_asset(
+    paths: Paths,
+    group: DocumentGroup,
+    prompt: bytes,
+    documents: list[RenderedDocument],
+    cache: T.Optional[RenderCache] = None,
+) -> tuple[list[tuple[str, int, int]], dict[str, str], dict[str, str]]:
+    """
+    Write the plain text asset of a document group, its manifest, its
+    compressed variants, and its shards if it is too large. A compressed
+    variant is copied from the cache if the plain text asset didn't change.
+
+    :returns: the document index of the asset, see :func:`combine_documents`,
+        the sha256 of every asset file, and the deduplicated documents, see
+        :func:`dedup_documents`.
+    """
+    path_asset = paths.dir_document_groups.joinpath(group.asset_name)
+    combined = documents
+    duplicates = dict()
+    with metrics.stage(f"combine:{group.name}") as stage:
+        if group.dedup:
+            combined, duplicates = dedup_documents(
+                paths=paths,
+                group=group,
+                documents=documents,
+            )
+        index, digest = combine_documents(
+            path_asset=path_asset,
+            prompt=prompt,
+            documents=combined,
+        )
+        stage.add(files=len(index), bytes=path_asset.stat().st_size)
+    digests = {group.asset_name: digest}
+    bytes_saved = sum(
+        before.get_size() - after.get_size()
+        for before, after in zip(documents, combined)
+    )
+    if duplicates:
+        print(
+            f"dedup document group {group.name!r}: {len(duplicates)} duplicates, "
+            f"{bytes_saved} bytes saved"
+        )
+    path_manifest = paths.dir_document_groups.joinpath(group.manifest_asset_name)
+    write_manifest(
+        path_manifest,
+        index=index,
+        documents=combined,
+        duplicates=duplicates,
+        bytes_saved=bytes_saved,
+    )
+    digests[group.manifest_asset_name] = sha256_of_file(path_manifest)
+    for fmt, asset_name in zip(group.compression or [], group.compressed_asset_names):
+        path_compressed = paths.dir_document_groups.joinpath(asset_name)
+        with metrics.stage(f"compress:{asset_name}") as stage:
+            key = None
+            if cache is not None:
+                key = cache.get_key(f"compress/{fmt}", digest.encode("utf-8"))
+            if key is None or cache.get(key, path_compressed, ext=fmt) is False:
+                compress_file(path_in=path_asset, path_out=path_compressed, fmt=fmt)
+                if key is not None:
+                    cache.put(key, path_compressed, ext=fmt)
+            digests[asset_name] = sha256_of_file(path_compressed)
+            stage.add(files=1, bytes=path_compressed.stat().st_size)
+    # every shard has to be self-contained, so shards are not deduplicated
+    with metrics.stage(f"shard:{group.name}") as stage:
+        shard_digests = build_shards(
+            paths=paths,
+            group=group,
+            prompt=prompt,
+            documents=documents,
+        )
+        for asset_name, shard_digest in shard_digests.items():
+            path_shard = paths.dir_document_groups.joinpath(asset_name)
+            digests[asset_name] = shard_digest
+            stage.add(files=1, bytes=path_shard.stat().st_size)
+    return index, digests, duplicates
+
+
+def patch_or_render_documents(
+    paths: Paths,
+    config: "Config",
+    prompt: bytes,
+    cache: T.Optional[RenderCache] = None,
+    previous: T.Optional[BuildState] = None,
+    jobs: int = 1,
+) -> DocumentSet:
+    """
+    Patch the previous build if given, see :func:`patch_documents`, or
+    render all documents if it is not given or can not be patched.
+    """
+    document_set = None
+    if previous is not None:
+        document_set = patch_documents(
+            paths=paths,
+            config=config,
+            previous=previous,
+            prompt=prompt,
+            cache=cache,
+            jobs=jobs,
+        )
+    if document_set is None:
+        document_set = render_documents(
+            paths=paths,
+            config=config,
+            cache=cache,
+            jobs=jobs,
+        )
+    return document_set
+
+
+def build_knowledge_base(
+    paths: Paths,
+    config: "Config",
+    cache: T.Optional[RenderCache] = None,
+    previous: T.Optional[BuildState] = None,
+    jobs: int = 1,
+) -> DocumentSet:
+    """
+    Build the knowledge base from all configured sources.
+
+    This is the main processing function that extracts content from
+    the repository and combines it into one knowledge base file per
+    document group. The repository is scanned and rendered only once,
+    all document groups share the same :class:`DocumentSet`.
+
+    It also writes the :class:`BuildState` to
+    :attr:`Paths.path_build_state_json`, and the :class:`TokenReport` to
+    :attr:`Paths.path_token_report_json`.
+
+    :param cache: optional :class:`RenderCache` to reuse rendered documents
+        from previous runs.
+    :param previous: optional :class:`BuildState` of the previously published
+        knowledge base, if given, only the changed files are rendered and
+        the previous assets are patched, see :func:`patch_documents`.
+    :param jobs: number of workers, files are rendered in a process pool
+        and document groups are combined concurrently. The output is
+        byte-identical to ``jobs=1``.
+    """
+    print("=== Build knowledge base")
+    prompt = paths.path_prompt_md.read_text(encoding="utf-8").encode("utf-8")
+    document_set = patch_or_render_documents(
+        paths=paths,
+        config=config,
+        prompt=prompt,
+        cache=cache,
+        previous=previous,
+        jobs=jobs,
+    )
+    groups = dict()
+    digests = dict()
+    duplicates = dict()
+
+    def build(group: DocumentGroup):
+        print(f"--- processing document group {group.name!r}")
+        print("Combine documents into a single file ...")
+        path_asset = paths.dir_document_groups.joinpath(group.asset_name)
+        print(f"Write to asset file {path_asset}...")
+        return build_group_asset(
+            paths=paths,
+            group=group,
+            prompt=prompt,
+            documents=document_set.select(group),
+            cache=cache,
+        )
+
+    # every group writes its own asset, they don't share any state
+    results = map_in_threads(build, config.document_groups, jobs=jobs)
+    for result, group in zip(results, config.document_groups):
+        groups[group.name], group_digests, group_duplicates = result
+        digests.update(group_digests)
+        if group_duplicates:
+            duplicates[group.name] = sorted(group_duplicates)
+    token_report = write_build_state(
+        paths=paths,
+        config=config,
+        prompt=prompt,
+        document_set=document_set,
+        groups=groups,
+        digests=digests,
+        duplicates=duplicates,
+    )
+    token_report.print()
+    return document_set
+
+
+def write_build_state(
+    paths: Paths,
+    config: "Config",
+    prompt: bytes,
+    document_set: DocumentSet,
+    groups: dict[str, list[tuple[str, int, int]]],
+    digests: dict[str, str],
+    duplicates: dict[str, list[str]],
+) -> "TokenReport":
+    """
+    Write the :class:`BuildState` and the :class:`TokenReport` of the
+    document group assets in :attr:`Paths.dir_document_groups`.
+
+    :returns: the token report.
+    """
+    with metrics.stage("write state") as stage:
+        commit = run_git(paths.dir_project_root, "rev-parse", "HEAD")
+        BuildState(
+            renderer_version=renderer_version,
+            metadata=DocumentRenderer(paths=paths).metadata,
+            commit=None if commit is None else commit.strip(),
+            config_sha256=get_config_sha256(config),
+            prompt_sha256=sha256_of(prompt),
+            groups=groups,
+            digests=digests,
+            hashes={
+                relpath: document.sha256
+                for relpath, document in sorted(document_set.documents.items())
+                if document.sha256 is not None
+            },
+            duplicates=duplicates,
+        ).to_json(paths.path_build_state_json)
+        token_report = TokenReport.new(paths=paths, config=config, document_set=document_set)
+        token_report.to_json(paths.path_token_report_json)
+        stage.add(
+            files=2,
+            bytes=paths.path_build_state_json.stat().st_size
+            + paths.path_token_report_json.stat().st_size,
+        )
+    return token_report
+
+
+@dataclasses.dataclass
+class TokenReport:
+    """
+    Estimated token cost of every document and document group.
+
+    The estimate only uses the byte sizes that are already known after
+    rendering, see :func:`estimate_tokens`, so it doesn't read any file.
+
+    :param groups: document group name to its asset size and tokens.
+    :param files: the ``top_n`` largest documents, sorted by tokens.
+    :param documents: the size and tokens of every document, sorted by path.
+    :param n_files: the number of rendered documents.
+    :param total_bytes: the total size of all rendered documents.
+    :param total_tokens: the estimated tokens of all rendered documents.
+    :param compaction: compact mode to the number of compacted files and
+        their size before and after, see :attr:`DocumentGroup.compact`.
+    """
+
+    groups: dict[str, dict[str, int]] = dataclasses.field()
+    files: list[dict[str, T.Any]] = dataclasses.field()
+    n_files: int = dataclasses.field()
+    total_bytes: int = dataclasses.field()
+    total_tokens: int = dataclasses.field()
+    compaction: dict[str, dict[str, int]] = dataclasses.field(default_factory=dict)
+    documents: list[dict[str, T.Any]] = dataclasses.field(default_factory=list)
+
+    @staticmethod
+    def get_file_estimates(sizes: dict[str, int]) -> list[dict[str, T.Any]]:
+        return [
+            {"path": path, "bytes": size, "tokens": estimate_tokens(size)}
+            for path, size in sizes.items()
+        ]
+
+    @classmethod
+    def new(
+        cls,
+        paths: Paths,
+        config: "Config",
+        document_set: DocumentSet,
+        top_n: int = 20,
+    ):
+        sizes = {
+            path: document.get_size()
+            for documents in [document_set.excerpts, document_set.documents]
+            for path, document in documents.items()
+        }
+        groups = dict()
+        for group in config.document_groups:
+            path_asset = paths.dir_document_groups.joinpath(group.asset_name)
+            size = path_asset.stat().st_size
+            groups[group.name] = {
+                "n_files": len(document_set.selections[group.name]),
+                "bytes": size,
+                "tokens": estimate_tokens(size),
+            }
+        largest = sorted(sizes.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+        total_bytes = sum(sizes.values())
+        compaction = {
+            mode: {
+                "n_files": len(compacted),
+                "bytes_before": sum(sizes[relpath] for relpath in compacted),
+                "bytes_after": sum(
+                    document.get_size() for document in compacted.values()
+                ),
+            }
+            for mode, compacted in sorted(document_set.compacted.items())
+        }
+        return cls(
+            groups=groups,
+            files=cls.get_file_estimates(dict(largest)),
+            n_files=len(sizes),
+            total_bytes=total_bytes,
+            total_tokens=estimate_tokens(total_bytes),
+            compaction=compaction,
+            documents=cls.get_file_estimates(dict(sorted(sizes.items()))),
+        )
+
+    @classmethod
+    def from_sources(
+        cls,
+        paths: Paths,
+        config: "Config",
+        top_n: int = 20,
+    ):
+        """
+        Estimate the report from the source files without rendering them,
+        only the first :data:`SNIFF_BYTES` of every file are read to skip
+        binary files. The rendered XML and the prompt are not accounted for.
+        """
+        matches = scan_repo(paths.dir_project_root, config)
+        sizes = dict()
+        for relpath in matches:
+            path = paths.dir_project_root.joinpath(relpath)
+            with path.open("rb") as f:
+                if is_binary(f.read(SNIFF_BYTES)) is False:
+                    sizes[relpath] = os.fstat(f.fileno()).st_size
+        groups = dict()
+        included = dict()
+        for group in config.document_groups:
+            n_files = n_bytes = 0
+            for relpath, names in matches.items():
+                if group.name not in names or relpath not in sizes:
+                    continue
+                size = sizes[relpath]
+                if group.is_oversize(size):
+                    if group.oversize == "skip":
+                        continue
+                    size = min(size, 2 * EXCERPT_BYTES)
+                n_files += 1
+                n_bytes += size
+                included[relpath] = max(size, included.get(relpath, 0))
+            groups[group.name] = {
+                "n_files": n_files,
+                "bytes": n_bytes,
+                "tokens": estimate_tokens(n_bytes),
+            }
+        largest = sorted(included.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+        total_bytes = sum(included.values())
+        return cls(
+            groups=groups,
+            files=cls.get_file_estimates(dict(largest)),
+            n_files=len(included),
+            total_bytes=total_bytes,
+            total_tokens=estimate_tokens(total_bytes),
+            documents=cls.get_file_estimates(dict(sorted(included.items()))),
+        )
+
+    def to_json(self, path: Path):
+        write_text(path, json.dumps(dataclasses.asdict(self), indent=2))
+
+    def print(self):
+        for name, group in self.groups.items():
+            print(
+                f"document group {name!r}: {group['n_files']} files, "
+                f"{group['bytes']} bytes, ~{group['tokens']} tokens"
+            )
+        if self.files:
+            print(f"top {len(self.files)} largest files:")
+        for file in self.files:
+            print(f"  ~{file['tokens']:>8} tokens  {file['path']}")
+
+
+# inotify(7) constants, see ``/usr/include/linux/inotify.h``
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_inotify_event = struct.Struct("iIII")
+
+
+def is_watched_dir(paths: Paths, matchers: list[PathMatcher], reldir: str) -> bool:
+    """
+    A directory is watched unless it is pruned by every matcher, or it is the
+    ``tmp`` directory the build writes to.
+    """
+    if reldir == paths.dir_tmp.name:
+        return False
+    return any(matcher.is_dir_pruned(reldir) is False for matcher in matchers)
+
+
+@dataclasses.dataclass
+class PollingWatcher:
+    """
+    Detect file changes by comparing the mtime and the size of every
+    candidate file between two walks of the repository.
+
+    It works everywhere, but every poll walks the whole repository, see
+    :class:`InotifyWatcher`.
+
+    :param interval: seconds between two walks.
+    """
+
+    paths: Paths = dataclasses.field()
+    matchers: list[PathMatcher] = dataclasses.field()
+    interval: float = dataclasses.field(default=0.5)
+    snapshot: dict[str, tuple[int, int]] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def open(cls, paths: Paths, matchers: list[PathMatcher], interval: float = 0.5):
+        watcher = cls(paths=paths, matchers=matchers, interval=interval)
+        watcher.snapshot = watcher.take_snapshot()
+        return watcher
+
+    def take_snapshot(self) -> dict[str, tuple[int, int]]:
+        snapshot = dict()
+        for relpath in iter_repo_files(
+            self.paths.dir_project_root,
+            self.matchers,
+            exclude_dirs={self.paths.dir_tmp.name},
+        ):
+            try:
+                stat = self.paths.dir_project_root.joinpath(relpath).stat()
+            except FileNotFoundError:  # deleted during the walk
+                continue
+            snapshot[relpath] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read(self, timeout: T.Optional[float] = None) -> set[str]:
+        """
+        Wait until some files changed, at most ``timeout`` seconds.
+
+        :returns: the relative paths of the added, modified and deleted files,
+            empty if nothing changed before the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(deadline - time.monotonic(), 0))
+            time.sleep(delay)
+            snapshot = self.take_snapshot()
+            changes = {
+                relpath
+                for relpath in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(relpath) != self.snapshot.get(relpath)
+            }
+            self.snapshot = snapshot
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self):
+        pass
+
+
+@dataclasses.dataclass
+class InotifyWatcher:  # pragma: no cover
+    """
+    Detect file changes with Linux inotify, through ``ctypes``.
+
+    Every directory that can contain a candidate file is watched, new
+    directories are watched as soon as they are created. A change of a
+    directory is reported as the directory path, the caller has to check the
+    files below it, see :meth:`WatchSession.expand_changes`. If the kernel
+    queue overflows, the repository root ``""`` is reported.
+    """
+
+    paths: Paths = dataclasses.field()
+    matchers: list[PathMatcher] = dataclasses.field()
+    fd: int = dataclasses.field()
+    libc: T.Any = dataclasses.field()
+    reldirs: dict[int, str] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def open(cls, paths: Paths, matchers: list[PathMatcher]):
+        """
+        :raises OSError: if inotify is not available.
+        """
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        watcher = cls(paths=paths, matchers=matchers, fd=fd, libc=libc)
+        try:
+            watcher.add_tree("")
+        except OSError:
+            watcher.close()
+            raise
+        return watcher
+
+    def add_tree(self, reldir: str):
+        """
+        Watch the directory and every watched directory below it.
+        """
+        import ctypes
+
+        stack = [reldir]
+        while stack:
+            reldir = stack.pop()
+            path = self.paths.dir_project_root.joinpath(reldir)
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(path), IN_WATCH_MASK
+            )
+            if wd < 0:
+                code = ctypes.get_errno()
+                if code in (errno.ENOENT, errno.ENOTDIR):  # already gone
+                    continue
+                raise OSError(code, f"can not watch {path}")
+            self.reldirs[wd] = reldir
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        relpath = f"{reldir}/{entry.name}" if reldir else entry.name
+                        if entry.is_dir(follow_symlinks=False) and is_watched_dir(
+                            self.paths, self.matchers, relpath
+                        ):
+                            stack.append(relpath)
+            except FileNotFoundError:
+                continue
+
+    def read(self, timeout: T.Optional[float] = None) -> set[str]:
+        """
+        Same as :meth:`PollingWatcher.read`.
+        """
+        import select
+
+        changes = set()
+        while not changes:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if not readable:
+                return changes
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, size = _inotify_event.unpack_from(data, offset)
+                offset += _inotify_event.size
+                name = os.fsdecode(data[offset : offset + size].rstrip(b"\0"))
+                offset += size
+                if mask & IN_Q_OVERFLOW:
+                    changes.add("")
+                    continue
+                if mask & IN_IGNORED:
+                    self.reldirs.pop(wd, None)
+                    continue
+                reldir = self.reldirs.get(wd)
+                if reldir is None or mask & IN_DELETE_SELF:
+                    continue
+                relpath = f"{reldir}/{name}" if reldir else name
+                if mask & IN_ISDIR:
+                    if is_watched_dir(self.paths, self.matchers, relpath) is False:
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.add_tree(relpath)
+                elif reldir == "" and name == self.paths.dir_tmp.name:
+                    continue
+                changes.add(relpath)
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_watcher(
+    paths: Paths,
+    matchers: list[PathMatcher],
+    poll_interval: T.Optional[float] = None,
+) -> T.Union[InotifyWatcher, PollingWatcher]:
+    """
+    Open an :class:`InotifyWatcher`, or a :class:`PollingWatcher` if inotify
+    is not available, for example on macOS, or if the inotify watch limit
+    ``fs.inotify.max_user_watches`` is reached.
+
+    :param poll_interval: if given, always poll with this interval.
+    """
+    if poll_interval is None:
+        try:
+            return InotifyWatcher.open(paths=paths, matchers=matchers)
+        except OSError as e:  # pragma: no cover
+            print(f"inotify is not available ({e}), fall back to polling")
+            poll_interval = 0.5
+    return PollingWatcher.open(paths=paths, matchers=matchers, interval=poll_interval)
+
+
+def collect_changes(
+    watcher: T.Union[InotifyWatcher, PollingWatcher],
+    debounce: float,
+    timeout: T.Optional[float] = None,
+) -> set[str]:
+    """
+    Wait for a change, then keep collecting changes until there is none for
+    ``debounce`` seconds, so a burst of saves is handled as one batch.
+    """
+    changes = watcher.read(timeout)
+    while changes:
+        more = watcher.read(debounce)
+        if not more:
+            break
+        changes |= more
+    return changes
+
+
+@dataclasses.dataclass
+class WatchSession:
+    """
+    Keep the rendered :class:`DocumentSet` of a build in memory and apply
+    file changes to it, only the changed files are rendered again and only
+    the document groups that include them, before or after the change, are
+    combined again.
+
+    :param state: the :class:`BuildState` of the build, it is updated and
+        written again after every batch of changes.
+    :param pending_groups: the document groups affected by an update that
+        failed, the changes are already applied to the document set, so the
+        next update rebuilds them even if its changes don't touch them.
+    """
+
+    paths: Paths = dataclasses.field()
+    config: "Config" = dataclasses.field()
+    document_set: DocumentSet = dataclasses.field()
+    state: BuildState = dataclasses.field()
+    prompt: bytes = dataclasses.field()
+    cache: T.Optional[RenderCache] = dataclasses.field(default=None)
+    jobs: int = dataclasses.field(default=1)
+    pending_groups: set[str] = dataclasses.field(default_factory=set)
+
+    @classmethod
+    def new(
+        cls,
+        paths: Paths,
+        config: "Config",
+        document_set: DocumentSet,
+        cache: T.Optional[RenderCache] = None,
+        jobs: int = 1,
+    ):
+        """
+        Continue from the build in :attr:`Paths.dir_document_groups`, see
+        :func:`build_knowledge_base`.
+        """
+        return cls(
+            paths=paths,
+            config=config,
+            document_set=document_set,
+            state=BuildState.from_json(paths.path_build_state_json),
+            prompt=paths.path_prompt_md.read_text(encoding="utf-8").encode("utf-8"),
+            cache=cache,
+            jobs=jobs,
+        )
+
+    @cached_property
+    def matchers(self) -> dict[str, PathMatcher]:
+        return {
+            group.name: PathMatcher.new(include=group.include, exclude=group.exclude)
+            for group in self.config.document_groups
+        }
+
+    def expand_changes(self, changes: set[str]) -> set[str]:
+        """
+        Resolve the changed directories to the files below them, the known
+        files that are gone and the candidate files that exist now.
+        """
+        matchers = list(self.matchers.values())
+        known = self.document_set.file_sizes
+        relpaths = set()
+        for change in changes:
+            below = f"{change}/" if change else ""
+            relpaths.update(
+                relpath for relpath in known if relpath == change or relpath.startswith(below)
+            )
+            if self.paths.dir_project_root.joinpath(change).is_dir() is False:
+                relpaths.add(change)
+            elif change == "" or is_watched_dir(self.paths, matchers, change):
+                relpaths.update(
+                    iter_repo_files(
+                        self.paths.dir_project_root,
+                        matchers,
+                        reldir=change,
+                        exclude_dirs={self.paths.dir_tmp.name},
+                    )
+                )
+        return relpaths
+
+    def update(self, changes: set[str]) -> list[str]:
+        """
+        Apply a batch of changes, see :meth:`expand_changes`, and rewrite the
+        affected document group assets, the build state and the token report.
+
+        :returns: the names of the rebuilt document groups.
+        """
+        document_set = self.document_set
+        relpaths = self.expand_changes(changes)
+        affected = set(self.pending_groups)
+        for name, selected in document_set.selections.items():
+            if relpaths.intersection(selected):
+                affected.add(name)
+                document_set.selections[name] = [
+                    relpath for relpath in selected if relpath not in relpaths
+                ]
+        for relpath in relpaths:
+            document_set.documents.pop(relpath, None)
+            document_set.excerpts.pop(relpath, None)
+            document_set.file_sizes.pop(relpath, None)
+            for compacted in document_set.compacted.values():
+                compacted.pop(relpath, None)
+        matches = dict()
+        for relpath in sorted(relpaths):
+            if "." not in relpath.rsplit("/", 1)[-1]:
+                continue
+            if self.paths.dir_project_root.joinpath(relpath).is_file() is False:
+                continue
+            names = [
+                name for name, matcher in self.matchers.items() if matcher.is_match(relpath)
+            ]
+            if names:
+                matches[relpath] = names
+                affected.update(names)
+        # from here on a failure leaves the document set half updated
+        self.pending_groups = set(affected)
+        renderer = DocumentRenderer(paths=self.paths, cache=self.cache)
+        render_matches(
+            renderer=renderer,
+            config=self.config,
+            document_set=document_set,
+            matches=matches,
+            jobs=self.jobs,
+        )
+        for name in affected:
+            document_set.selections[name].sort()
+        render_compacted(
+            renderer=renderer, config=self.config, document_set=document_set, jobs=self.jobs
+        )
+        groups = [group for group in self.config.document_groups if group.name in affected]
+        results = map_in_threads(
+            lambda group: build_group_asset(
+                paths=self.paths,
+                group=group,
+                prompt=self.prompt,
+                documents=document_set.select(group),
+                cache=self.cache,
+            ),
+            groups,
+            jobs=self.jobs,
+        )
+        for (index, digests, duplicates), group in zip(results, groups):
+            self.state.groups[group.name] = index
+            # a group may have fewer shards than before
+            self.state.digests = {
+                asset_name: digest
+                for asset_name, digest in self.state.digests.items()
+                if asset_name not in group.asset_names
+                and not group.is_shard_asset_name(asset_name)
+            }
+            self.state.digests.update(digests)
+            self.state.duplicates.pop(group.name, None)
+            if duplicates:
+                self.state.duplicates[group.name] = sorted(duplicates)
+        if groups:
+            write_build_state(
+                paths=self.paths,
+                config=self.config,
+                prompt=self.prompt,
+                document_set=document_set,
+                groups=self.state.groups,
+                digests=self.state.digests,
+                duplicates=self.state.duplicates,
+            )
+        self.pending_groups = set()
+        return [group.name for group in groups]
+
+
+def watch_knowledge_base(
+    paths: Paths,
+    config: "Config",
+    document_set: DocumentSet,
+    cache: T.Optional[RenderCache] = None,
+    jobs: int = 1,
+    debounce: float = 0.1,
+    poll_interval: T.Optional[float] = None,
+    max_batches: T.Optional[int] = None,
+):
+    """
+    Keep the document group assets of a build up to date with the files
+    in the repository, until interrupted, see :class:`WatchSession`.
+
+    :param document_set: the result of :func:`build_knowledge_base`.
+    :param debounce: seconds without a change before a batch is applied.
+    :param poll_interval: poll for changes instead of using inotify.
+    :param max_batches: stop after this many batches of changes.
+    """
+    session = WatchSession.new(
+        paths=paths,
+        config=config,
+        document_set=document_set,
+        cache=cache,
+        jobs=jobs,
+    )
+    watcher = open_watcher(
+        paths=paths,
+        matchers=list(session.matchers.values()),
+        poll_interval=poll_interval,
+    )
+    print(f"=== Watch {paths.dir_project_root} for changes, press Ctrl+C to stop")
+    n_batches = 0
+    pending = set()
+    try:
+        while max_batches is None or n_batches < max_batches:
+            changes = pending | collect_changes(watcher, debounce=debounce)
+            start = time.perf_counter()
+            n_batches += 1
+            try:
+                names = session.update(changes)
+            except FileNotFoundError as e:
+                # the deletion is the next change, the session rebuilds the
+                # groups of the failed update with it
+                print(f"{e.filename} is gone, apply the changes again with the next batch")
+                pending = changes
+                continue
+            pending = set()
+            elapsed = (time.perf_counter() - start) * 1000
+            print(
+                f"{len(changes)} changed paths, rebuilt {len(names)} document "
+                f"groups {names} in {elapsed:.0f} ms"
+            )
+    except KeyboardInterrupt:  # pragma: no cover
+        print("stop watching")
+    finally:
+        watcher.close()
+        if cache is not None:
+            cache.evict()
+
+
+@dataclasses.dataclass
+class ETagCache:
+    """
+    On-disk cache of the ETag and the body of GitHub API ``GET`` responses.
+
+    A conditional request with the cached ETag gets a ``304 Not Modified``
+    when the state didn't change, it has no body and does not count against
+    the rate limit. Only the entries used by a run are saved, so the file
+    never grows.
+
+    :param path: the JSON file, ``None`` keeps the cache in memory only.
+    """
+
+    path: T.Optional[Path] = dataclasses.field(default=None)
+    entries: dict[str, dict] = dataclasses.field(default_factory=dict)
+    used: set[str] = dataclasses.field(default_factory=set)
+    hits: int = dataclasses.field(default=0)
+    misses: int = dataclasses.field(default=0)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def load(cls, path: Path):
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            entries = dict()
+        return cls(path=path, entries=entries)
+
+    def get(self, key: str) -> T.Optional[dict]:
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key: str, etag: str, data, links: dict):
+        with self.lock:
+            self.entries[key] = {"etag": etag, "data": data, "links": links}
+            self.used.add(key)
+
+    def record(self, key: str, hit: bool):
+        with self.lock:
+            self.used.add(key)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            entries = {key: self.entries[key] for key in self.used if key in self.entries}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        path_tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        path_tmp.write_text(json.dumps(entries), encoding="utf-8")
+        os.replace(path_tmp, self.path)
+
+    def print(self):
+        print(
+            f"{self.hits} of {self.hits + self.misses} GitHub API GET requests "
+            f"were not modified since the last run"
+        )
+
+
+@dataclasses.dataclass
+class GitHubClient:
+    """
+    A minimal client of the GitHub REST API endpoints used to publish the
+    knowledge base.
+
+    Every request goes through one :class:`requests.Session`, the connections
+    to the api and the uploads hosts are pooled and kept alive across the
+    API calls and the concurrent uploads, instead of a new TLS handshake per
+    request.
+
+    :param token: the GitHub token.
+    :param repository: the ``owner/repo`` full name.
+    :param api_url: the REST API base URL, ``https://api.github.com`` or the
+        URL of a local fake server.
+    :param pool_size: max number of kept alive connections per host, should
+        be at least the number of concurrent uploads.
+    :param timeout: connect and read timeout of every request, in seconds.
+    :param etag_cache: the :class:`ETagCache` of the conditional ``GET``
+        requests, a new in-memory one if not given.
+    """
+
+    token: str = dataclasses.field()
+    repository: str = dataclasses.field()
+    api_url: str = dataclasses.field(default="https://api.github.com")
+    pool_size: int = dataclasses.field(default=10)
+    timeout: float = dataclasses.field(default=60.0)
+    etag_cache: ETagCache = dataclasses.field(default_factory=ETagCache)
+
+    @classmethod
+    def from_env(
+        cls,
+        pool_size: int = 10,
+        etag_cache: T.Optional[ETagCache] = None,
+    ):
+        return cls(
+            token=env_var.GITHUB_TOKEN,
+            repository=env_var.GITHUB_REPOSITORY,
+            api_url=env_var.GITHUB_API_URL,
+            pool_size=pool_size,
+            etag_cache=ETagCache() if etag_cache is None else etag_cache,
+        )
+
+    @cached_property
+    def session(self) -> "requests.Session":
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.headers.update(
+            {
+                "Authorization": f"Bearer {self.token}",
+                "Accept": "application/vnd.github+json",
+                "X-GitHub-Api-Version": "2022-11-28",
+            }
+        )
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=self.pool_size,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    def get_url(self, path: str) -> str:
+        return f"{self.api_url.rstrip('/')}/repos/{self.repository}{path}"
+
+    def request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        """
+        Send a request, raise :class:`~github.GithubException` on an error
+        status code, so :class:`RetryPolicy` works the same way as with
+        PyGithub.
+        """
+        from github import GithubException
+
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code >= 400:
+            try:
+                data = response.json()
+            except ValueError:
+                data = response.text
+            raise GithubException(
+                response.status_code,
+                data,
+                dict(response.headers),
+            )
+        return response
+
+    def get_json(
+        self,
+        url: str,
+        params: T.Optional[dict] = None,
+    ) -> tuple[T.Any, dict]:
+        """
+        Conditional ``GET`` with the cached ETag of the URL, the cached body
+        is returned on ``304 Not Modified``.
+
+        :returns: the JSON body and the parsed ``Link`` header.
+        """
+        key = url
+        if params:
+            key = f"{url}?{'&'.join(f'{k}={v}' for k, v in sorted(params.items()))}"
+        cached = self.etag_cache.get(key)
+        headers = dict()
+        if cached is not None:
+            headers["If-None-Match"] = cached["etag"]
+        response = self.request("GET", url, params=params, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.etag_cache.record(key, hit=True)
+            return cached["data"], cached["links"]
+        self.etag_cache.record(key, hit=False)
+        data, links = response.json(), response.links
+        etag = response.headers.get("ETag")
+        if etag:
+            self.etag_cache.put(key, etag, data, links)
+        return data, links
+
+    def get_release(self, tag: str) -> "Release":
+        """
+        Get the release and its assets in a single request.
+        """
+        data, _ = self.get_json(self.get_url(f"/releases/tags/{tag}"))
+        return Release.from_dict(self, data)
+
+    def create_release(self, tag: str, name: str, body: str) -> "Release":
+        """
+        Create the release, and the tag on the latest commit of the default
+        branch if it does not exist, in a single request.
+        """
+        response = self.request(
+            "POST",
+            self.get_url("/releases"),
+            json={"tag_name": tag, "name": name, "body": body},
+        )
+        return Release.from_dict(self, response.json())
+
+
+@dataclasses.dataclass
+class Release:
+    """
+    A GitHub release, same interface as PyGithub ``GitRelease`` for the
+    methods used by :func:`upload_assets`.
+
+    :param assets: the assets embedded in the release response, they were
+        current when the release was fetched.
+    """
+
+    client: GitHubClient = dataclasses.field(repr=False)
+    id: int = dataclasses.field()
+    tag_name: str = dataclasses.field()
+    upload_url: str = dataclasses.field()
+    assets: list["ReleaseAsset"] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, client: GitHubClient, data: dict):
+        return cls(
+            client=client,
+            id=data["id"],
+            tag_name=data["tag_name"],
+            # strip the ``{?name,label}`` URI template
+            upload_url=data["upload_url"].split("{", 1)[0],
+            assets=[
+                ReleaseAsset.from_dict(client, asset)
+                for asset in data.get("assets", list())
+            ],
+        )
+
+    def get_assets(self) -> T.Iterable["ReleaseAsset"]:
+        url = self.client.get_url(f"/releases/{self.id}/assets")
+        params = {"per_page": 100}
+        while url:
+            items, links = self.client.get_json(url, params=params)
+            for data in items:
+                yield ReleaseAsset.from_dict(self.client, data)
+            # the next link already carries the query string
+            url = links.get("next", {}).get("url")
+            params = None
+
+    def upload_asset(self, path: str, label: str = "") -> "ReleaseAsset":
+        path = Path(path)
+        with path.open("rb") as f:
+            response = self.client.request(
+                "POST",
+                self.upload_url,
+                params={"name": path.name, "label": label},
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(path.stat().st_size),
+                },
+                data=f,
+            )
+        return ReleaseAsset.from_dict(self.client, response.json())
+
+
+@dataclasses.dataclass
+class ReleaseAsset:
+    """
+    A GitHub release asset, same interface as PyGithub ``ReleaseAsset``
+    for the methods used by :func:`upload_assets`.
+    """
+
+    client: GitHubClient = dataclasses.field(repr=False)
+    id: int = dataclasses.field()
+    name: str = dataclasses.field()
+    size: int = dataclasses.field()
+    url: str = dataclasses.field()
+
+    @classmethod
+    def from_dict(cls, client: GitHubClient, data: dict):
+        return cls(
+            client=client,
+            id=data["id"],
+            name=data["name"],
+            size=data["size"],
+            url=data["url"],
+        )
+
+    def delete_asset(self):
+        self.client.request("DELETE", self.url)
+
+    def download_asset(self, path: str, chunk_size: int = 1024 * 1024):
+        # the API redirects to the storage host, requests drops the token there
+        with self.client.request(
+            "GET",
+            self.url,
+            headers={"Accept": "application/octet-stream"},
+            stream=True,
+        ) as response:
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+
+
+def create_release(
+    client: GitHubClient,
+    retry: T.Optional["RetryPolicy"] = None,
+) -> Release:
+    """
+    Create or get the GitHub release for publishing the knowledge base.
+
+    Checks if a release with the specified name already exists.
+    If not, creates a new one. An existing release and its assets are
+    resolved with one conditional request, that is a ``304`` when nothing
+    changed since the last run. A new release and its tag are created with
+    one request.
+
+    :param retry: the :class:`RetryPolicy` of the release lookup, use the
+        default one if not given. Creating the tag and the release is not
+        idempotent and is never retried.
+    """
+    from github import GithubException
+
+    print(f"--- Create release {release_name!r} if not exists ...")
+    if retry is None:
+        retry = RetryPolicy()
+    with metrics.stage("release") as stage:
+        stage.add(api_calls=1)
+        try:
+            release = retry.call(client.get_release, release_name)
+        except GithubException as e:
+            if e.status == 404:
+                release = None
+            else:
+                raise e
+
+        if release is None:
+            print(f"Release not exists, creating it ...")
+            release = client.create_release(
+                tag=release_name,
+                name=release_name,
+                body=f"Release {release_name}",
+            )
+            stage.add(api_calls=1)
+        else:
+            print("Release already exists.")
+    return release
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    """
+    Retry transient GitHub API errors with exponential backoff and full jitter.
+
+    :param max_attempts: give up after this many attempts.
+    :param base_delay: the delay cap of the first retry, in seconds, it
+        doubles after every attempt.
+    :param max_delay: the delay cap never goes above this, in seconds.
+    """
+
+    max_attempts: int = dataclasses.field(default=5)
+    base_delay: float = dataclasses.field(default=1.0)
+    max_delay: float = dataclasses.field(default=30.0)
+
+    def is_retryable(self, e: Exception) -> bool:
+        from github import GithubException
+
+        if isinstance(e, GithubException):
+            return e.status is None or e.status == 429 or e.status >= 500
+        # connection errors and timeouts, including the ones from requests
+        return isinstance(e, OSError)
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        :param attempt: the number of failed attempts so far, starting from 1.
+        """
+        cap = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+    def call(self, func: T.Callable, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+                delay = self.get_delay(attempt)
+                print(f"{e!r}, retry in {delay:.1f} seconds ...")
+                time.sleep(delay)
+
+
+def delete_asset(asset: ReleaseAsset):
+    from github import GithubException
+
+    try:
+        asset.delete_asset()
+    except GithubException as e:
+        if e.status != 404:  # already deleted is fine
+            raise e
+
+
+def remove_asset(asset: ReleaseAsset, retry: RetryPolicy):
+    """
+    Delete an asset, retry on transient errors.
+    """
+    with metrics.stage(f"delete:{asset.name}") as stage:
+        retry.call(delete_asset, asset)
+        stage.add(api_calls=1)
+
+
+def replace_asset(
+    release: "Release",
+    path: Path,
+    existing: T.Optional[ReleaseAsset],
+    retry: RetryPolicy,
+):
+    """
+    Delete the existing asset of the same name, then upload the file, retry
+    both on transient errors.
+    """
+    name = path.name
+    attempts = 0
+    api_calls = 0
+
+    def delete_and_upload():
+        nonlocal attempts, existing, api_calls
+        attempts += 1
+        if attempts > 1:
+            # a failed upload may have left a broken asset behind
+            existing = None
+            api_calls += 1
+            for asset in release.get_assets():
+                if asset.name == name:
+                    existing = asset
+        if existing is not None:
+            api_calls += 1
+            delete_asset(existing)
+            existing = None
+        api_calls += 1
+        release.upload_asset(path=f"{path}", label=name)
+
+    start = time.perf_counter()
+    with metrics.stage(f"upload:{name}") as stage:
+        try:
+            retry.call(delete_and_upload)
+        finally:
+            stage.add(files=1, bytes=path.stat().st_size, api_calls=api_calls)
+    elapsed = time.perf_counter() - start
+    print(
+        f"uploaded {name!r} ({path.stat().st_size} bytes) "
+        f"in {elapsed:.2f} seconds, {attempts} attempt(s)"
+    )
+
+
+@dataclasses.dataclass
+class PublishedRelease:
+    """
+    What is currently published in the release.
+
+    :param assets: the assets of the release by name.
+    :param digests: the :attr:`BuildState.digests` of the published build
+        state, empty if there is none.
+    :param state_sha256: the sha256 of the published build state, ``None``
+        if there is none.
+    """
+
+    release: "Release" = dataclasses.field()
+    assets: dict[str, ReleaseAsset] = dataclasses.field()
+    digests: dict[str, str] = dataclasses.field(default_factory=dict)
+    state_sha256: T.Optional[str] = dataclasses.field(default=None)
+
+    @classmethod
+    def fetch(
+        cls,
+        release: "Release",
+        paths: Paths,
+        retry: RetryPolicy,
+        assets: T.Optional[list["ReleaseAsset"]] = None,
+    ):
+        """
+        Download the published build state of the release.
+
+        :param assets: the current assets of the release, e.g.
+            :attr:`Release.assets`, they are listed if not given.
+        """
+        if assets is None:
+            with metrics.stage("list assets") as stage:
+                assets = retry.call(lambda: list(release.get_assets()))
+                stage.add(api_calls=1)
+        published = cls(release=release, assets={asset.name: asset for asset in assets})
+        if build_state_asset_name in published.assets:
+            path_published_state = paths.dir_tmp.joinpath(
+                f"published-{build_state_asset_name}"
+            )
+            with metrics.stage("download state") as stage:
+                retry.call(
+                    published.assets[build_state_asset_name].download_asset,
+                    path=f"{path_published_state}",
+                    chunk_size=1024 * 1024,
+                )
+                stage.add(files=1, bytes=path_published_state.stat().st_size, api_calls=1)
+            published.digests = BuildState.from_json(path_published_state).digests
+            published.state_sha256 = sha256_of_file(path_published_state)
+        return published
+
+    def is_unchanged(self, path: Path, digest: str) -> bool:
+        """
+        Check if the published asset of the same name has the same digest.
+        """
+        existing = self.assets.get(path.name)
+        return (
+            existing is not None
+            and self.digests.get(path.name) == digest
+            and existing.size == path.stat().st_size
+        )
+
+    def get_stale_assets(
+        self,
+        config: "Config",
+        digests: dict[str, str],
+    ) -> list[ReleaseAsset]:
+        """
+        :returns: the shards of a previous build that are not produced any more.
+        """
+        return [
+            asset
+            for asset_name, asset in self.assets.items()
+            if asset_name not in digests
+            and any(group.is_shard_asset_name(asset_name) for group in config.document_groups)
+        ]
+
+
+def upload_assets(
+    release: "Release",
+    paths: Paths,
+    config: "Config",
+    jobs: int = 4,
+    retry: T.Optional[RetryPolicy] = None,
+    assets: T.Optional[list["ReleaseAsset"]] = None,
+):
+    """
+    Upload knowledge base files as assets to the GitHub release.
+
+    Replaces any existing assets with the same names to ensure
+    the release always has the latest versions of all document groups.
+    Document groups are uploaded concurrently, each delete + upload is
+    retried on transient errors. Assets whose digest matches the published
+    :class:`BuildState` are not uploaded again.
+
+    :param jobs: max number of concurrent uploads.
+    :param retry: the :class:`RetryPolicy`, use the default one if not given.
+    :param assets: the current assets of the release, e.g.
+        :attr:`Release.assets`, they are listed if not given.
+    """
+    print("--- Publish all in one knowledge base")
+    if retry is None:
+        retry = RetryPolicy()
+    published = PublishedRelease.fetch(
+        release=release,
+        paths=paths,
+        retry=retry,
+        assets=assets,
+    )
+    state_changed = published.state_sha256 != sha256_of_file(paths.path_build_state_json)
+    digests = BuildState.from_json(paths.path_build_state_json).digests
+    changed_asset_names = list()
+    for asset_name in digests:
+        path = paths.dir_document_groups.joinpath(asset_name)
+        if published.is_unchanged(path, digests[asset_name]):
+            print(f"asset {asset_name!r} is unchanged, skip upload")
+        else:
+            changed_asset_names.append(asset_name)
+    stale_assets = published.get_stale_assets(config, digests)
+    if state_changed is False and not changed_asset_names and not stale_assets:
+        print("all assets are unchanged")
+        return
+    # The build state describes the byte layout of the group assets, remove
+    # it first so a partially failed upload never leaves a stale state behind.
+    if build_state_asset_name in published.assets:
+        remove_asset(published.assets[build_state_asset_name], retry)
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [
+            executor.submit(
+                replace_asset,
+                release=release,
+                path=paths.dir_document_groups.joinpath(asset_name),
+                existing=published.assets.get(asset_name),
+                retry=retry,
+            )
+            for asset_name in changed_asset_names
+        ]
+        futures.extend(
+            executor.submit(remove_asset, asset, retry) for asset in stale_assets
+        )
+        for future in futures:
+            future.result()
+    replace_asset(
+        release=release,
+        path=paths.path_build_state_json,
+        existing=None,
+        retry=retry,
+    )
+
+
+def download_previous_build(
+    paths: Paths,
+    config: "Config",
+    client: T.Optional[GitHubClient] = None,
+) -> T.Optional[BuildState]:
+    """
+    Download the :class:`BuildState` and the document group assets of the
+    previously published knowledge base into :attr:`Paths.dir_previous`.
+
+    :param client: the :class:`GitHubClient`, created from the environment
+        variables if not given.
+
+    :returns: ``None`` if there is no usable previous build.
+    """
+    from github import GithubException
+
+    print("=== Download previous knowledge base")
+    shutil.rmtree(paths.dir_previous, ignore_errors=True)
+    paths.dir_previous.mkdir(parents=True)
+    if client is None:  # pragma: no cover
+        client = GitHubClient.from_env()
+    try:
+        release = client.get_release(release_name)
+    except GithubException as e:
+        if e.status == 404:
+            print(f"Release {release_name!r} not exists.")
+            return None
+        else:
+            raise e
+    finally:
+        client.etag_cache.save()
+    existing_assets: dict[str, ReleaseAsset] = {
+        asset.name: asset for asset in release.assets
+    }
+    asset_names = [build_state_asset_name] + [
+        group.asset_name for group in config.document_groups
+    ]
+    for asset_name in asset_names:
+        if asset_name not in existing_assets:
+            print(f"Asset {asset_name!r} not exists.")
+            return None
+        print(f"Download asset {asset_name!r} ...")
+        path = paths.dir_previous.joinpath(asset_name)
+        with metrics.stage(f"download:{asset_name}") as stage:
+            existing_assets[asset_name].download_asset(
+                path=f"{path}",
+                chunk_size=1024 * 1024,
+            )
+            stage.add(files=1, bytes=path.stat().st_size, api_calls=1)
+    return BuildState.from_json(paths.dir_previous.joinpath(build_state_asset_name))
+
+
+def publish_knowledge_base(
+    paths: Paths,
+    config: "Config",
+    upload_jobs: int = 4,
+    client: T.Optional[GitHubClient] = None,
+):
+    """
+    Publish all document group files to GitHub releases.
+
+    This is the main publishing function that handles GitHub authentication,
+    release creation, and asset uploading for all document groups.
+
+    :param client: the :class:`GitHubClient`, created from the environment
+        variables if not given, its connection pool is sized for the uploads.
+    """
+    print("=== Publish knowledge base")
+    if client is None:  # pragma: no cover
+        client = GitHubClient.from_env(pool_size=max(upload_jobs, 1) + 2)
+    release = create_release(client)
+    try:
+        upload_assets(
+            release=release,
+            paths=paths,
+            config=config,
+            jobs=upload_jobs,
+            assets=release.assets,
+        )
+    finally:
+        client.etag_cache.save()
+    client.etag_cache.print()
+
+
+async def _gather_or_cancel(*aws):
+    """
+    Wait for all awaitables. If one fails, cancel the others, wait until they
+    are done, then raise the error. A call that already runs in a thread can
+    not be interrupted, it runs to the end, but no new work is started.
+    """
+    import asyncio
+
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _build_and_publish(
+    paths: Paths,
+    config: "Config",
+    client: GitHubClient,
+    cache: T.Optional[RenderCache] = None,
+    previous: T.Optional[BuildState] = None,
+    jobs: int = 1,
+    upload_jobs: int = 4,
+    queue_size: int = 4,
+) -> DocumentSet:
+    """
+    See :func:`build_and_publish_knowledge_base`.
+    """
+    import asyncio
+
+    retry = RetryPolicy()
+    prompt = paths.path_prompt_md.read_text(encoding="utf-8").encode("utf-8")
+
+    def resolve_release() -> PublishedRelease:
+        release = create_release(client, retry=retry)
+        return PublishedRelease.fetch(
+            release=release,
+            paths=paths,
+            retry=retry,
+            assets=release.assets,
+        )
+
+    published_future = asyncio.ensure_future(asyncio.to_thread(resolve_release))
+    # the changed asset files, ``None`` tells an uploader to stop
+    queue: "asyncio.Queue[T.Optional[Path]]" = asyncio.Queue(maxsize=max(queue_size, 1))
+    pending_groups = iter(config.document_groups)  # shared by the builders
+    results = dict()
+    state_removal = None
+    n_uploads = 0
+
+    async def remove_published_state():
+        # The build state describes the byte layout of the group assets,
+        # remove it before the first upload, so a partially failed publish
+        # never leaves a stale state behind.
+        nonlocal state_removal
+        if state_removal is None:
+            asset = published_future.result().assets.get(build_state_asset_name)
+            state_removal = asyncio.ensure_future(
+                asyncio.sleep(0)
+                if asset is None
+                else asyncio.to_thread(remove_asset, asset, retry)
+            )
+        await state_removal
+
+    async def build_groups(document_set: DocumentSet):
+        for group in pending_groups:
+            print(f"--- processing document group {group.name!r}")
+            results[group.name] = await asyncio.to_thread(
+                build_group_asset,
+                paths=paths,
+                group=group,
+                prompt=prompt,
+                documents=document_set.select(group),
+                cache=cache,
+            )
+            published = await published_future
+            for asset_name, digest in results[group.name][1].items():
+                path = paths.dir_document_groups.joinpath(asset_name)
+                if published.is_unchanged(path, digest):
+                    print(f"asset {asset_name!r} is unchanged, skip upload")
+                else:
+                    # wait here if the uploads fall behind
+                    await queue.put(path)
+
+    async def build() -> DocumentSet:
+        document_set = await asyncio.to_thread(
+            patch_or_render_documents,
+            paths=paths,
+            config=config,
+            prompt=prompt,
+            cache=cache,
+            previous=previous,
+            jobs=jobs,
+        )
+        await _gather_or_cancel(
+            *[build_groups(document_set) for _ in range(max(jobs, 1))]
+        )
+        for _ in range(max(upload_jobs, 1)):
+            await queue.put(None)
+        return document_set
+
+    async def upload():
+        nonlocal n_uploads
+        while True:
+            path = await queue.get()
+            if path is None:
+                return
+            await remove_published_state()
+            published = published_future.result()
+            await asyncio.to_thread(
+                replace_asset,
+                release=published.release,
+                path=path,
+                existing=published.assets.get(path.name),
+                retry=retry,
+            )
+            n_uploads += 1
+
+    _, document_set, *_ = await _gather_or_cancel(
+        published_future,
+        build(),
+        *[upload() for _ in range(max(upload_jobs, 1))],
+    )
+
+    # same order as build_knowledge_base, so the build state is the same
+    groups = dict()
+    digests = dict()
+    duplicates = dict()
+    for group in config.document_groups:
+        groups[group.name], group_digests, group_duplicates = results[group.name]
+        digests.update(group_digests)
+        if group_duplicates:
+            duplicates[group.name] = sorted(group_duplicates)
+    token_report = write_build_state(
+        paths=paths,
+        config=config,
+        prompt=prompt,
+        document_set=document_set,
+        groups=groups,
+        digests=digests,
+        duplicates=duplicates,
+    )
+    token_report.print()
+    published = published_future.result()
+    stale_assets = published.get_stale_assets(config, digests)
+    if (
+        n_uploads == 0
+        and not stale_assets
+        and published.state_sha256 == sha256_of_file(paths.path_build_state_json)
+    ):
+        print("all assets are unchanged")
+        return document_set
+    await remove_published_state()
+    await _gather_or_cancel(
+        *[asyncio.to_thread(remove_asset, asset, retry) for asset in stale_assets]
+    )
+    await asyncio.to_thread(
+        replace_asset,
+        release=published.release,
+        path=paths.path_build_state_json,
+        existing=None,
+        retry=retry,
+    )
+    return document_set
+
+
+def build_and_publish_knowledge_base(
+    paths: Paths,
+    config: "Config",
+    cache: T.Optional[RenderCache] = None,
+    previous: T.Optional[BuildState] = None,
+    jobs: int = 1,
+    upload_jobs: int = 4,
+    client: T.Optional[GitHubClient] = None,
+    queue_size: int = 4,
+) -> DocumentSet:
+    """
+    Same as :func:`build_knowledge_base` followed by
+    :func:`publish_knowledge_base`, but the network time overlaps with the
+    build time, so the wall time is close to the longer of the two instead
+    of their sum:
+
+    - the release is resolved, or created, while the documents are rendered.
+    - the assets of a document group are uploaded as soon as it is built,
+      while the next document groups are built.
+
+    The changed assets go through a queue of ``queue_size`` files, the build
+    waits when the uploads fall behind. If anything fails, the pending builds
+    and uploads are cancelled and the error is raised. The build state is
+    removed before the first upload and published last, like in
+    :func:`upload_assets`.
+
+    :param jobs: number of worker processes to render files, and number of
+        document groups built concurrently.
+    :param upload_jobs: max number of concurrent asset uploads.
+    :param client: the :class:`GitHubClient`, created from the environment
+        variables if not given.
+    """
+    import asyncio
+
+    print("=== Build and publish knowledge base")
+    if client is None:  # pragma: no cover
+        client = GitHubClient.from_env(pool_size=max(upload_jobs, 1) + 2)
+    try:
+        document_set = asyncio.run(
+            _build_and_publish(
+                paths=paths,
+                config=config,
+                client=client,
+                cache=cache,
+                previous=previous,
+                jobs=jobs,
+                upload_jobs=upload_jobs,
+                queue_size=queue_size,
+            )
+        )
+    finally:
+        client.etag_cache.save()
+    client.etag_cache.print()
+    return document_set
+
+
+def find_deciding_pattern(
+    patterns: list[str],
+    relpath: str,
+) -> T.Optional[str]:
+    """
+    Find the pattern that decides whether the path matches, the last one
+    that matches it, like in ``.gitignore``.
+    """
+    deciding = None
+    for pattern in patterns:
+        compiled = CompiledPatterns.compile([pattern.lstrip("!")])
+        if compiled.rules and compiled.match(relpath):
+            deciding = pattern
+    return deciding
+
+
+def explain_path(
+    paths: Paths,
+    config: "Config",
+    path: str,
+) -> list[str]:
+    """
+    Explain why a file is or is not in every document group.
+
+    :param path: a path relative to the repo root, or an absolute path.
+
+    :returns: the lines to print.
+    """
+    path_abs = paths.dir_project_root.joinpath(path).absolute()
+    try:
+        relpath = path_abs.relative_to(paths.dir_project_root).as_posix()
+    except ValueError:
+        return [f"{path}: not in the repo {paths.dir_project_root}"]
+    lines = [f"{relpath}:"]
+    if path_abs.is_file() is False:
+        return lines + ["  not a file"]
+    if "." not in path_abs.name:
+        return lines + ["  not a candidate, only file names with a dot are"]
+    with path_abs.open("rb") as f:
+        binary = is_binary(f.read(SNIFF_BYTES))
+        size = os.fstat(f.fileno()).st_size
+    for group in config.document_groups:
+        matcher = PathMatcher.new(include=group.include, exclude=group.exclude)
+        name = repr(group.name)
+        if group.include:
+            pattern = find_deciding_pattern(group.include, relpath)
+            if pattern is None:
+                lines.append(f"  {name}: excluded, no include pattern matches")
+                continue
+            if pattern.startswith("!"):
+                lines.append(f"  {name}: excluded by include pattern {pattern!r}")
+                continue
+            reason = f"included by {pattern!r}"
+        else:
+            reason = "included, there is no include pattern"
+        if matcher.is_match(relpath) is False:
+            pattern = find_deciding_pattern(group.exclude, relpath)
+            lines.append(f"  {name}: {reason}, but excluded by {pattern!r}")
+            continue
+        if binary:
+            lines.append(f"  {name}: {reason}, but skipped as a binary file")
+        elif group.is_oversize(size):
+            action = "skipped" if group.oversize == "skip" else "excerpted"
+            lines.append(
+                f"  {name}: {reason}, but {action}, it has {size} bytes, "
+                f"more than max_file_bytes {group.max_file_bytes}"
+            )
+        else:
+            lines.append(f"  {name}: {reason}")
+    return lines
+
+
+def _make_shared_options(
+    is_command: bool,
+) -> tuple[argparse.ArgumentParser, argparse.ArgumentParser, argparse.ArgumentParser]:
+    """
+    The build, publish and run options, they are accepted before and after
+    the command. The copies of the commands have no defaults, so they don't
+    overwrite an option given before the command.
+
+    :returns: the build, publish and run option parents.
+    """
+
+    def default(value):
+        return argparse.SUPPRESS if is_command else value
+
+    build_options = argparse.ArgumentParser(add_help=False)
+    build_options.add_argument(
+        "--incremental",
+        action="store_true",
+        default=default(False),
+        help=(
+            "patch the previously published knowledge base with the files "
+            "changed since the commit it was built from, fall back to a full "
+            "build if that is not possible"
+        ),
+    )
+    build_options.add_argument(
+        "--jobs",
+        type=int,
+        default=default(1),
+        metavar="N",
+        help="number of worker processes to render files and build document groups",
+    )
+    publish_options = argparse.ArgumentParser(add_help=False)
+    publish_options.add_argument(
+        "--upload-jobs",
+        type=int,
+        default=default(4),
+        metavar="N",
+        help="max number of concurrent asset uploads",
+    )
+    run_options = argparse.ArgumentParser(add_help=False)
+    run_options.add_argument(
+        "--metrics",
+        type=Path,
+        default=default(None),
+        metavar="PATH",
+        help=(
+            "write the wall time, files, bytes and API calls of every stage to "
+            "this JSON file, they are always written to the GitHub Actions job "
+            "summary when GITHUB_STEP_SUMMARY is set"
+        ),
+    )
+    run_options.add_argument(
+        "--profile",
+        action="store_true",
+        default=default(env_var.ESCLUSIVE_AI_PROFILE),
+        help=(
+            "profile the build and the publish with cProfile and tracemalloc, "
+            "write the reports to tmp/profile/, same as ESCLUSIVE_AI_PROFILE=1"
+        ),
+    )
+    return build_options, publish_options, run_options
+
+
+def parse_args(args: T.Optional[list[str]] = None) -> argparse.Namespace:
+    build_options, publish_options, run_options = _make_shared_options(False)
+    command_build_options, command_publish_options, command_run_options = (
+        _make_shared_options(True)
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Build and publish the knowledge base of a GitHub repo.",
+        epilog=(
+            "Without a command, build and publish, like in the GitHub Actions "
+            "workflow, the uploads overlap with the build."
+        ),
+        parents=[build_options, publish_options, run_options],
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.add_parser(
+        "build",
+        parents=[command_build_options, command_run_options],
+        help=(
+            "build the knowledge base into tmp/document_groups/, it works "
+            "offline unless --incremental is given"
+        ),
+    )
+    subparsers.add_parser(
+        "publish",
+        parents=[command_publish_options, command_run_options],
+        help="publish the last build to the GitHub release",
+    )
+    stats_parser = subparsers.add_parser(
+        "stats",
+        help=(
+            "estimate the files, bytes and tokens of every document group "
+            "from the source files, without building"
+        ),
+    )
+    stats_parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        metavar="N",
+        help="number of largest files to list",
+    )
+    watch_parser = subparsers.add_parser(
+        "watch",
+        parents=[command_build_options, command_run_options],
+        help=(
+            "build, then keep the document groups in tmp/document_groups/ up "
+            "to date while files change, until Ctrl+C"
+        ),
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=int,
+        default=100,
+        metavar="MS",
+        help="milliseconds without a change before a batch of changes is applied",
+    )
+    watch_parser.add_argument(
+        "--poll",
+        type=int,
+        default=None,
+        metavar="MS",
+        help="poll for changes with this interval instead of using inotify",
+    )
+    explain_parser = subparsers.add_parser(
+        "explain",
+        help="explain why files are or are not in every document group",
+    )
+    explain_parser.add_argument("paths", nargs="+", metavar="PATH")
+    return parser.parse_args(args)
+
+
+def cli(args: T.Optional[list[str]] = None):
+    """
+    The command line entry point, see :func:`parse_args`.
+    """
+    args = parse_args(args)
+    # before anything is measured, including the config load, in GitHub
+    # Actions the job summary always gets the metrics
+    metrics.enabled = hasattr(args, "metrics") and (
+        args.metrics is not None or bool(env_var.GITHUB_STEP_SUMMARY)
+    )
+    paths = Paths(
+        dir_project_root=Path.cwd().absolute(),
+    )
+    config = Config.from_json(paths.path_esclusive_ai_for_github_repo_config_json)
+    if args.command == "stats":
+        TokenReport.from_sources(paths=paths, config=config, top_n=args.top).print()
+        return
+    if args.command == "explain":
+        for path in args.paths:
+            print("\n".join(explain_path(paths=paths, config=config, path=path)))
+        return
+
+    is_build = args.command in (None, "build", "watch")
+    is_publish = args.command in (None, "publish")
+    # fmt: off
     print(f"dir_project_root                              = {paths.dir_project_root}")
     print(f"path_esclusive_ai_for_github_repo_config_json = {paths.path_esclusive_ai_for_github_repo_config_json}")
     print(f"dir_tmp                                       = {paths.dir_tmp}")
     print(f"dir_staging                                   = {paths.dir_staging}")
     print(f"dir_document_groups                           = {paths.dir_document_groups}")
     print(f"path_prompt_md                                = {paths.path_prompt_md}")
+    print(f"dir_cache                                     = {paths.dir_cache}")
     # fmt: on
-    config = Config.from_json(paths.path_esclusive_ai_for_github_repo_config_json)
-    build_knowledge_base(paths=paths, config=config)
-    publish_knowledge_base(paths=paths, config=config)
-    url = f"{env_var.GITHUB_SERVER_URL}/{env_var.GITHUB_REPOSITORY}/releases/tag/knowledge-base"
-    print(f"Your all-in-one knowledge base file is ready")
-    print(f"To download your 📙 knowledge file in GitHub release, Click this link 🔗 {url}")
+    if is_publish and not is_build and not paths.path_build_state_json.exists():
+        sys.exit(f"{paths.path_build_state_json} not found, run the build command first")
+    client = None
+    if is_publish or args.incremental:  # pragma: no cover
+        client = GitHubClient.from_env(
+            pool_size=max(getattr(args, "upload_jobs", 1), 1) + 2,
+            etag_cache=ETagCache.load(paths.path_etag_cache_json)
+            if env_var.ESCLUSIVE_AI_CACHE_MAX_BYTES > 0
+            else None,
+        )
+    if is_build:
+        if env_var.ESCLUSIVE_AI_CACHE_MAX_BYTES > 0:
+            cache = RenderCache(
+                dir_root=paths.dir_cache,
+                max_bytes=env_var.ESCLUSIVE_AI_CACHE_MAX_BYTES,
+            )
+        else:
+            cache = None
+        if args.incremental:  # pragma: no cover
+            previous = download_previous_build(paths=paths, config=config, client=client)
+        else:
+            previous = None
+    if is_build and is_publish:  # pragma: no cover
+        with profile(paths.dir_profile, "build-and-publish", enabled=args.profile):
+            build_and_publish_knowledge_base(
+                paths=paths,
+                config=config,
+                cache=cache,
+                previous=previous,
+                jobs=args.jobs,
+                upload_jobs=args.upload_jobs,
+                client=client,
+            )
+    elif is_build:
+        with profile(paths.dir_profile, "build", enabled=args.profile):
+            document_set = build_knowledge_base(
+                paths=paths,
+                config=config,
+                cache=cache,
+                previous=previous,
+                jobs=args.jobs,
+            )
+    if args.command == "watch":
+        watch_knowledge_base(
+            paths=paths,
+            config=config,
+            document_set=document_set,
+            cache=cache,
+            jobs=args.jobs,
+            debounce=args.debounce / 1000,
+            poll_interval=None if args.poll is None else args.poll / 1000,
+        )
+    if is_publish and not is_build:  # pragma: no cover
+        with profile(paths.dir_profile, "publish", enabled=args.profile):
+            publish_knowledge_base(
+                paths=paths,
+                config=config,
+                upload_jobs=args.upload_jobs,
+                client=client,
+            )
+    if args.metrics is not None:
+        metrics.to_json(args.metrics)
+    if metrics.enabled:
+        metrics.write_step_summary()
+    if is_publish:  # pragma: no cover
+        url = f"{env_var.GITHUB_SERVER_URL}/{env_var.GITHUB_REPOSITORY}/releases/tag/knowledge-base"
+        print(f"Your all-in-one knowledge base file is ready")
+        print(f"To download your 📙 knowledge file in GitHub release, Click this link 🔗 {url}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    cli()
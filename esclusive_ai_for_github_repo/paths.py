@@ -31,3 +31,9 @@ dir_load_test = dir_project_root / "tests_load"
 # ------------------------------------------------------------------------------
 dir_docs_source = dir_project_root / "docs" / "source"
 dir_docs_build_html = dir_project_root / "docs" / "build" / "html"
+
+# ------------------------------------------------------------------------------
+# Build Related
+# ------------------------------------------------------------------------------
+dir_build = dir_project_root / "build"
+dir_dist = dir_project_root / "dist"
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+Build ``esclusive_ai_for_github_repo.pyz``, a single file zipapp of
+``main.py``, ``prompt.md`` and the dependencies in ``requirements.txt``.
+
+A consuming workflow downloads this one file and runs it, there is nothing
+to ``pip install``. The dependencies are built for the GitHub Actions runner
+(Linux x86_64, CPython 3.11 by default), see
+:mod:`esclusive_ai_for_github_repo.pyz_bootstrap` for how it runs.
+
+The archive is reproducible: entries are sorted and have a fixed timestamp,
+so the same inputs always give the same bytes, and ``release.py`` only
+uploads it again when something changed.
+"""
+
+import typing as T
+import json
+import shutil
+import hashlib
+import zipfile
+import subprocess
+import sys
+from pathlib import Path
+
+from .paths import dir_package, dir_project_root, dir_build, dir_dist
+
+pyz_name = "esclusive_ai_for_github_repo.pyz"
+build_info_name = "build.json"
+zip_date_time = (1980, 1, 1, 0, 0, 0)
+
+
+def install_requirements(
+    path_requirements: Path,
+    dir_site_packages: Path,
+    python_version: str,
+    platform: str,
+):
+    """
+    Install the pinned requirements for the target platform, without
+    resolving them again, ``requirements.txt`` already lists every package.
+    """
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            "--quiet",
+            "--no-deps",
+            "--no-compile",
+            "--only-binary=:all:",
+            f"--platform={platform}",
+            f"--python-version={python_version}",
+            "--implementation=cp",
+            f"--target={dir_site_packages}",
+            "-r",
+            f"{path_requirements}",
+        ],
+        check=True,
+    )
+
+
+def iter_files(dir_root: Path) -> T.Iterable[tuple[str, Path]]:
+    """
+    Yield the ``(arcname, path)`` of every file, without bytecode caches.
+    """
+    for path in sorted(dir_root.rglob("*")):
+        if path.is_dir() or "__pycache__" in path.parts or path.suffix == ".pyc":
+            continue
+        yield path.relative_to(dir_root).as_posix(), path
+
+
+def write_entry(zf: zipfile.ZipFile, arcname: str, data: bytes):
+    info = zipfile.ZipInfo(arcname, date_time=zip_date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    zf.writestr(info, data)
+
+
+def build_pyz(
+    path_pyz: Path = dir_dist / pyz_name,
+    path_main_py: Path = dir_package / "main.py",
+    path_prompt_md: Path = dir_project_root / "prompt.md",
+    path_requirements: T.Optional[Path] = dir_project_root / "requirements.txt",
+    dir_staging: Path = dir_build / "pyz",
+    python_version: str = "3.11",
+    platform: str = "manylinux2014_x86_64",
+    interpreter: str = "/usr/bin/env python3",
+) -> Path:
+    """
+    Build the zipapp.
+
+    :param path_requirements: ``None`` bundles no dependencies, they must be
+        installed in the running interpreter.
+    :param dir_staging: the dependencies are installed here first.
+    :param python_version: the Python version of the runner, the zipapp
+        refuses to run on any other.
+    :param platform: the pip platform tag of the runner.
+
+    :returns: ``path_pyz``.
+    """
+    shutil.rmtree(dir_staging, ignore_errors=True)
+    dir_site_packages = dir_staging / "site-packages"
+    dir_site_packages.mkdir(parents=True)
+    if path_requirements is not None:
+        print(f"Install {path_requirements.name} for {platform}, Python {python_version} ...")
+        install_requirements(
+            path_requirements=path_requirements,
+            dir_site_packages=dir_site_packages,
+            python_version=python_version,
+            platform=platform,
+        )
+    entries = {
+        "__main__.py": dir_package.joinpath("pyz_bootstrap.py").read_bytes(),
+        "app/main.py": path_main_py.read_bytes(),
+        "app/prompt.md": path_prompt_md.read_bytes(),
+    }
+    for arcname, path in iter_files(dir_site_packages):
+        entries[f"site-packages/{arcname}"] = path.read_bytes()
+    h = hashlib.sha256()
+    for arcname in sorted(entries):
+        h.update(arcname.encode("utf-8"))
+        h.update(b"\0")
+        h.update(hashlib.sha256(entries[arcname]).digest())
+    build_info = {
+        "build_id": h.hexdigest()[:16],
+        "python_version": python_version,
+        "platform": platform,
+    }
+    entries[build_info_name] = json.dumps(build_info, indent=2).encode("utf-8")
+
+    path_pyz.parent.mkdir(parents=True, exist_ok=True)
+    with path_pyz.open("wb") as f:
+        f.write(f"#!{interpreter}\n".encode("utf-8"))
+        with zipfile.ZipFile(f, "w") as zf:
+            for arcname in sorted(entries):
+                write_entry(zf, arcname, entries[arcname])
+    path_pyz.chmod(0o755)
+    print(f"Built {path_pyz} ({path_pyz.stat().st_size} bytes), build id {build_info['build_id']}")
+    return path_pyz
+
+
+if __name__ == "__main__":
+    build_pyz()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Entry point of the ``esclusive_ai_for_github_repo.pyz`` zipapp, it is stored
+as ``__main__.py`` at the root of the archive by
+:func:`esclusive_ai_for_github_repo.pyz.build_pyz`.
+
+The archive bundles ``main.py``, ``prompt.md`` and the dependencies built for
+one platform and Python version. Some of the dependencies are C extensions
+that can not be imported from a zip file, so the archive is extracted once
+into the cache directory, keyed by its build id, and reused by every later
+run. Only the standard library can be used in this file.
+
+Usage::
+
+    python esclusive_ai_for_github_repo.pyz [main.py options]
+    python esclusive_ai_for_github_repo.pyz --benchmark-startup [N]
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import zipfile
+import tempfile
+import subprocess
+from pathlib import Path
+
+path_pyz = Path(__file__).absolute().parent
+build_info_name = "build.json"
+
+
+def read_build_info(path: Path) -> dict:
+    with zipfile.ZipFile(path) as zf:
+        return json.loads(zf.read(build_info_name).decode("utf-8"))
+
+
+def get_dir_cache() -> Path:
+    """
+    Same as ``Paths.dir_cache`` of ``main.py``, the workflow persists it.
+    """
+    if os.environ.get("ESCLUSIVE_AI_CACHE_DIR"):
+        return Path(os.environ["ESCLUSIVE_AI_CACHE_DIR"])
+    return Path.home().joinpath(".cache", "esclusive_ai_for_github_repo")
+
+
+def extract(path: Path, dir_app: Path) -> bool:
+    """
+    Extract the archive to ``dir_app`` unless it is already there.
+
+    :returns: ``True`` if the archive is extracted by this call.
+    """
+    if dir_app.joinpath(build_info_name).exists():
+        return False
+    dir_app.parent.mkdir(parents=True, exist_ok=True)
+    # extract next to the target, then rename, a killed or concurrent run
+    # never leaves a partial directory behind
+    dir_tmp = Path(tempfile.mkdtemp(prefix=f"{dir_app.name}.", dir=dir_app.parent))
+    try:
+        with zipfile.ZipFile(path) as zf:
+            zf.extractall(dir_tmp)
+        os.replace(dir_tmp, dir_app)
+    except OSError:
+        if not dir_app.joinpath(build_info_name).exists():
+            raise
+    finally:
+        shutil.rmtree(dir_tmp, ignore_errors=True)
+    return True
+
+
+def setup(path: Path) -> Path:
+    """
+    Extract the archive if needed and put its dependencies on ``sys.path``.
+
+    :returns: the directory of the extracted archive.
+    """
+    build_info = read_build_info(path)
+    python_version = "{}.{}".format(*sys.version_info[:2])
+    if python_version != build_info["python_version"]:
+        sys.exit(
+            f"{path.name} is built for Python {build_info['python_version']}, "
+            f"but it is running on Python {python_version}"
+        )
+    dir_app = get_dir_cache().joinpath("pyz", build_info["build_id"])
+    if extract(path, dir_app):
+        # the cache is persisted across runs, drop the older builds
+        for dir_old in dir_app.parent.iterdir():
+            if dir_old.name != dir_app.name and "." not in dir_old.name:
+                shutil.rmtree(dir_old, ignore_errors=True)
+    sys.path.insert(0, str(dir_app.joinpath("site-packages")))
+    return dir_app
+
+
+def install_prompt(dir_app: Path):
+    """
+    ``main.py`` reads the prompt from ``tmp/prompt.md``, always replace it
+    with the bundled one, like the workflow always downloaded the prompt of
+    the release, so a prompt left from an earlier run is never used.
+    """
+    path_prompt_md = Path.cwd().joinpath("tmp", "prompt.md")
+    path_prompt_md.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(dir_app.joinpath("app", "prompt.md"), path_prompt_md)
+
+
+def benchmark_startup(path: Path, n: int = 5) -> dict:
+    """
+    Measure the first run extraction, the import of ``main.py`` and the
+    process startup of ``--help``, in seconds.
+    """
+    results = dict()
+    with tempfile.TemporaryDirectory() as dir_cache:
+        env = dict(os.environ, ESCLUSIVE_AI_CACHE_DIR=dir_cache)
+        dir_app = Path(dir_cache).joinpath("pyz", read_build_info(path)["build_id"])
+        start = time.perf_counter()
+        extract(path, dir_app)
+        results["extract_seconds"] = round(time.perf_counter() - start, 4)
+        code = (
+            "import sys, time; start = time.perf_counter(); "
+            f"sys.path[:0] = [{str(dir_app / 'site-packages')!r}, {str(dir_app / 'app')!r}]; "
+            "import main; print(time.perf_counter() - start)"
+        )
+        import_times = list()
+        help_times = list()
+        for _ in range(n):
+            output = subprocess.run(
+                [sys.executable, "-c", code],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            import_times.append(float(output.strip().splitlines()[-1]))
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, str(path), "--help"],
+                env=env,
+                check=True,
+                capture_output=True,
+            )
+            help_times.append(time.perf_counter() - start)
+    results["import_main_seconds"] = round(min(import_times), 4)
+    results["run_help_seconds"] = round(min(help_times), 4)
+    results["n"] = n
+    return results
+
+
+def main():
+    if sys.argv[1:2] == ["--benchmark-startup"]:
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        print(json.dumps(benchmark_startup(path_pyz, n=n), indent=2))
+        return
+    dir_app = setup(path_pyz)
+    install_prompt(dir_app)
+    path_main_py = dir_app.joinpath("app", "main.py")
+    sys.argv[0] = str(path_main_py)
+    runpy.run_path(str(path_main_py), run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local, in-memory stand-in of the GitHub REST API endpoints used to publish
+the knowledge base and to release this tool, see ``release.py``: repository,
+branch, tag, ref, release and release asset.
+
+It lets the publishing code be tested and benchmarked offline::
+
+    with FakeGitHub(repository="owner/repo") as server:
+        client = GitHubClient(
+            token="dummy", repository="owner/repo", api_url=server.url,
+        )
+        publish_knowledge_base(paths, config, client=client)
+
+Release assets are uploaded to the ``/uploads`` prefix of the same server,
+and downloaded through a redirect to the ``/downloads`` prefix, like the
+uploads and the storage hosts of GitHub. ``GET`` responses have an ETag, a
+conditional request with a matching ``If-None-Match`` gets a ``304`` that,
+like on GitHub, does not count against the rate limit.
+"""
+
+import typing as T
+import re
+import json
+import time
+import hashlib
+import threading
+import dataclasses
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+@dataclasses.dataclass
+class FakeAsset:
+    id: int
+    release_id: int
+    name: str
+    label: str
+    data: bytes
+
+
+@dataclasses.dataclass
+class FakeRelease:
+    id: int
+    tag_name: str
+    name: str
+    body: str
+
+
+class FakeGitHub:
+    """
+    :param repository: the ``owner/repo`` full name served.
+    :param default_branch: name of the default branch.
+    :param token: requests without this token get a 401.
+    :param latency: seconds to wait before every response, simulates the
+        round trip to GitHub.
+    :param page_size: max assets per page when listing release assets.
+    :param asset_digest: include the ``digest`` of the assets, GitHub
+        doesn't have it for assets uploaded before June 2025.
+    """
+
+    def __init__(
+        self,
+        repository: str = "owner/repo",
+        default_branch: str = "main",
+        token: str = "dummy-token",
+        latency: float = 0.0,
+        page_size: int = 30,
+        asset_digest: bool = True,
+    ):
+        self.repository = repository
+        self.default_branch = default_branch
+        self.token = token
+        self.latency = latency
+        self.page_size = page_size
+        self.asset_digest = asset_digest
+        self.commit_sha = hashlib.sha1(repository.encode("utf-8")).hexdigest()
+        self.refs: dict[str, str] = dict()
+        self.tags: dict[str, dict] = dict()
+        self.releases: dict[int, FakeRelease] = dict()
+        self.assets: dict[int, FakeAsset] = dict()
+        #: status codes to respond to the next requests, for failure injection
+        self.failures: list[int] = list()
+        #: ``(method, path)`` of every request served
+        self.requests: list[tuple[str, str]] = list()
+        #: number of TCP connections accepted, lower than the number of
+        #: requests when the client keeps the connections alive
+        self.n_connections = 0
+        #: number of requests counted against the rate limit
+        self.rate_limit_used = 0
+        #: number of ``304 Not Modified`` responses
+        self.n_not_modified = 0
+        self.lock = threading.RLock()
+        self.next_id = 1
+        self.server: T.Optional[ThreadingHTTPServer] = None
+        self.thread: T.Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(RequestHandler):
+            github = fake
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def new_id(self) -> int:
+        with self.lock:
+            self.next_id += 1
+            return self.next_id
+
+    def get_release_by_tag(self, tag: str) -> T.Optional[FakeRelease]:
+        for release in self.releases.values():
+            if release.tag_name == tag:
+                return release
+        return None
+
+    def release_to_dict(self, release: FakeRelease) -> dict:
+        return {
+            "id": release.id,
+            "tag_name": release.tag_name,
+            "name": release.name,
+            "body": release.body,
+            "url": f"{self.url}/repos/{self.repository}/releases/{release.id}",
+            "upload_url": (
+                f"{self.url}/uploads/repos/{self.repository}"
+                f"/releases/{release.id}/assets{{?name,label}}"
+            ),
+            "assets": [
+                self.asset_to_dict(asset)
+                for asset in sorted(self.assets.values(), key=lambda asset: asset.id)
+                if asset.release_id == release.id
+            ],
+        }
+
+    def ref_to_dict(self, ref: str) -> dict:
+        sha = self.refs[ref]
+        return {
+            "ref": ref,
+            "url": f"{self.url}/repos/{self.repository}/git/{ref}",
+            "object": {
+                "sha": sha,
+                # an annotated tag or a commit
+                "type": "tag" if sha in self.tags else "commit",
+            },
+        }
+
+    def asset_to_dict(self, asset: FakeAsset) -> dict:
+        data = {
+            "id": asset.id,
+            "name": asset.name,
+            "label": asset.label,
+            "size": len(asset.data),
+            "state": "uploaded",
+            "content_type": "application/octet-stream",
+            "url": f"{self.url}/repos/{self.repository}/releases/assets/{asset.id}",
+            "browser_download_url": f"{self.url}/downloads/{asset.id}/{asset.name}",
+        }
+        if self.asset_digest:
+            data["digest"] = f"sha256:{hashlib.sha256(asset.data).hexdigest()}"
+        return data
+
+    def get_asset_names(self, tag: str) -> list[str]:
+        release = self.get_release_by_tag(tag)
+        return sorted(
+            asset.name
+            for asset in self.assets.values()
+            if release is not None and asset.release_id == release.id
+        )
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Route the requests to the :class:`FakeGitHub` instance of the server.
+    """
+
+    # keep alive, every response has a Content-Length
+    protocol_version = "HTTP/1.1"
+    github: FakeGitHub
+
+    def setup(self):
+        super().setup()
+        with self.github.lock:
+            self.github.n_connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, data=None, headers: T.Optional[dict] = None):
+        body = b"" if data is None else json.dumps(data).encode("utf-8")
+        headers = dict(headers or dict())
+        if self.command == "GET" and status == 200:
+            etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status, body, data = 304, b"", None
+        with self.github.lock:
+            if status == 304:
+                self.github.n_not_modified += 1
+            else:
+                self.github.rate_limit_used += 1
+        self.send_response(status)
+        if data is not None:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, message: str):
+        self.send_json(status, {"message": message})
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def handle_request(self, method: str):
+        github = self.github
+        parts = urlsplit(self.path)
+        path, query = parts.path, parse_qs(parts.query)
+        # always read the body, so the connection can be reused
+        body = self.read_body()
+        with github.lock:
+            github.requests.append((method, path))
+            failure = github.failures.pop(0) if github.failures else None
+        if github.latency:
+            time.sleep(github.latency)
+        if failure is not None:
+            return self.send_error_json(failure, "injected failure")
+        match = re.match(r"^/downloads/(\d+)/", path)
+        if method == "GET" and match:
+            asset = github.assets.get(int(match.group(1)))
+            if asset is None:
+                return self.send_error_json(404, "Not Found")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(asset.data)))
+            self.end_headers()
+            self.wfile.write(asset.data)
+            return
+        if self.headers.get("Authorization") not in (
+            f"Bearer {github.token}",
+            f"token {github.token}",
+        ):
+            return self.send_error_json(401, "Bad credentials")
+
+        prefix = f"/repos/{github.repository}"
+        upload_prefix = f"/uploads{prefix}"
+        if path.startswith(upload_prefix):
+            route = path[len(upload_prefix) :]
+            match = re.match(r"^/releases/(\d+)/assets$", route)
+            if method == "POST" and match:
+                return self.upload_asset(int(match.group(1)), query, body)
+            return self.send_error_json(404, "Not Found")
+        if not (path == prefix or path.startswith(prefix + "/")):
+            return self.send_error_json(404, "Not Found")
+        route = path[len(prefix) :]
+        data = json.loads(body) if body else dict()
+
+        if method == "GET" and route == "":
+            return self.send_json(
+                200,
+                {
+                    "full_name": github.repository,
+                    "default_branch": github.default_branch,
+                    "url": f"{github.url}{prefix}",
+                },
+            )
+        match = re.match(r"^/branches/(.+)$", route)
+        if method == "GET" and match:
+            if match.group(1) != github.default_branch:
+                return self.send_error_json(404, "Branch not found")
+            return self.send_json(
+                200, {"name": match.group(1), "commit": {"sha": github.commit_sha}}
+            )
+        if method == "POST" and route == "/git/tags":
+            sha = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+            github.tags[sha] = data
+            return self.send_json(201, {"sha": sha, "tag": data["tag"]})
+        match = re.match(r"^/git/tags/(\w+)$", route)
+        if method == "GET" and match:
+            tag = github.tags.get(match.group(1))
+            if tag is None:
+                return self.send_error_json(404, "Not Found")
+            return self.send_json(
+                200,
+                {
+                    "sha": match.group(1),
+                    "tag": tag["tag"],
+                    "object": {"sha": tag["object"], "type": tag["type"]},
+                },
+            )
+        if method == "POST" and route == "/git/refs":
+            if data["ref"] in github.refs:
+                return self.send_error_json(422, "Reference already exists")
+            github.refs[data["ref"]] = data["sha"]
+            return self.send_json(201, github.ref_to_dict(data["ref"]))
+        match = re.match(r"^/git/(refs/.+)$", route)
+        if match:
+            ref = match.group(1)
+            if ref not in github.refs:
+                return self.send_error_json(404, "Not Found")
+            if method == "GET":
+                return self.send_json(200, github.ref_to_dict(ref))
+            if method == "PATCH":
+                github.refs[ref] = data["sha"]
+                return self.send_json(200, github.ref_to_dict(ref))
+        match = re.match(r"^/releases/tags/(.+)$", route)
+        if method == "GET" and match:
+            release = github.get_release_by_tag(match.group(1))
+            if release is None:
+                return self.send_error_json(404, "Not Found")
+            return self.send_json(200, github.release_to_dict(release))
+        if method == "POST" and route == "/releases":
+            if github.get_release_by_tag(data["tag_name"]) is not None:
+                return self.send_error_json(422, "Validation Failed")
+            release = FakeRelease(
+                id=github.new_id(),
+                tag_name=data["tag_name"],
+                name=data.get("name", data["tag_name"]),
+                body=data.get("body", ""),
+            )
+            github.releases[release.id] = release
+            # the tag is created on the default branch if it does not exist
+            github.refs.setdefault(f"refs/tags/{release.tag_name}", github.commit_sha)
+            return self.send_json(201, github.release_to_dict(release))
+        match = re.match(r"^/releases/(\d+)/assets$", route)
+        if method == "GET" and match:
+            return self.list_assets(int(match.group(1)), query)
+        match = re.match(r"^/releases/assets/(\d+)$", route)
+        if match:
+            asset = github.assets.get(int(match.group(1)))
+            if asset is None:
+                return self.send_error_json(404, "Not Found")
+            if method == "DELETE":
+                del github.assets[asset.id]
+                return self.send_json(204)
+            if method == "PATCH":
+                with github.lock:
+                    name = data.get("name", asset.name)
+                    for other in github.assets.values():
+                        if (
+                            other.release_id == asset.release_id
+                            and other.name == name
+                            and other.id != asset.id
+                        ):
+                            return self.send_error_json(422, "already_exists")
+                    asset.name = name
+                    asset.label = data.get("label", asset.label)
+                return self.send_json(200, github.asset_to_dict(asset))
+            if method == "GET":
+                if self.headers.get("Accept") == "application/octet-stream":
+                    location = f"{github.url}/downloads/{asset.id}/{asset.name}"
+                    return self.send_json(302, headers={"Location": location})
+                return self.send_json(200, github.asset_to_dict(asset))
+        return self.send_error_json(404, "Not Found")
+
+    def list_assets(self, release_id: int, query: dict):
+        github = self.github
+        if release_id not in github.releases:
+            return self.send_error_json(404, "Not Found")
+        per_page = min(int(query.get("per_page", [github.page_size])[0]), github.page_size)
+        page = int(query.get("page", ["1"])[0])
+        assets = sorted(
+            (asset for asset in github.assets.values() if asset.release_id == release_id),
+            key=lambda asset: asset.id,
+        )
+        items = assets[(page - 1) * per_page : page * per_page]
+        headers = dict()
+        if page * per_page < len(assets):
+            url = (
+                f"{github.url}/repos/{github.repository}/releases/{release_id}"
+                f"/assets?per_page={per_page}&page={page + 1}"
+            )
+            headers["Link"] = f'<{url}>; rel="next"'
+        return self.send_json(
+            200, [github.asset_to_dict(asset) for asset in items], headers
+        )
+
+    def upload_asset(self, release_id: int, query: dict, body: bytes):
+        github = self.github
+        if release_id not in github.releases:
+            return self.send_error_json(404, "Not Found")
+        name = query.get("name", [""])[0]
+        if not name:
+            return self.send_error_json(422, "Validation Failed")
+        with github.lock:
+            for asset in github.assets.values():
+                if asset.release_id == release_id and asset.name == name:
+                    return self.send_error_json(422, "already_exists")
+            asset = FakeAsset(
+                id=github.new_id(),
+                release_id=release_id,
+                name=name,
+                label=query.get("label", [""])[0],
+                data=body,
+            )
+            github.assets[asset.id] = asset
+        return self.send_json(201, github.asset_to_dict(asset))
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
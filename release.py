@@ -6,20 +6,40 @@ Publish esclusive_repo_ai to GitHub as a release.
 This script automates the process of creating or updating GitHub releases with
 the latest version of the esclusive_ai_for_github_repo tool. It handles tag and
 release management and uploads the necessary files as downloadable assets.
+
+It works in two phases:
+
+1. **Plan**: fetch the tag, the release and the assets of every target
+   release concurrently, and compute the minimal changes: the tags to move
+   to the latest commit, the releases to create and the assets whose digest
+   changed.
+2. **Apply**: print the plan, then apply it to all targets in parallel.
+
+A tag is moved in place and a release is never deleted, so the assets stay
+downloadable during the release. A changed asset is uploaded under a
+temporary name first, then swapped with the old one.
+
+Run ``python release.py --dry-run`` to print the plan without applying it.
 """
 
 import typing as T
+import hashlib
+import argparse
+import dataclasses
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from github import (
     Github,
     GithubException,
-    GitTag,
     GitRef,
     GitRelease,
+    GitReleaseAsset,
+    Repository,
 )
 
 from esclusive_ai_for_github_repo.main import __version__
+from esclusive_ai_for_github_repo.pyz import build_pyz
 
 
 # ------------------------------------------------------------------------------
@@ -32,6 +52,7 @@ path_asset_list = [
     dir_here.joinpath("esclusive_ai_for_github_repo", "main.py"),
     dir_here.joinpath("prompt.md"),
     dir_here.joinpath("requirements.txt"),
+    dir_here.joinpath("dist", "esclusive_ai_for_github_repo.pyz"),
 ]
 path_github_token = Path.home().joinpath(
     ".github",
@@ -39,244 +60,295 @@ path_github_token = Path.home().joinpath(
     "MacHu-GWU",
     "sanhe-dev.txt",
 )
-github_token = path_github_token.read_text(encoding="utf-8").strip()
-gh = Github(github_token)
-repo = gh.get_repo(f"{account_name}/{repo_name}")
 
 
-def get_latest_commit_sha() -> str:
-    """
-    Get the SHA of the latest commit on the default branch.
-    """
-    return repo.get_branch(repo.default_branch).commit.sha
+def get_repo() -> "Repository":
+    github_token = path_github_token.read_text(encoding="utf-8").strip()
+    gh = Github(github_token)
+    return gh.get_repo(f"{account_name}/{repo_name}")
 
 
-def get_git_tag_and_ref(tag_name: str) -> tuple[
-    T.Optional["GitTag"],
-    T.Optional["GitRef"],
-]:
-    """
-    Get the Git tag and reference objects for a given tag name.
+def sha256_of_file(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
 
-    :param tag_name: The name of the tag to retrieve.
 
-    :return: A tuple containing the GitTag and GitRef objects, or None if not found.
+@dataclasses.dataclass
+class Target:
+    """
+    A release to keep in sync with the latest commit of the default branch.
     """
-    try:
-        ref = repo.get_git_ref(f"tags/{tag_name}")
-    except GithubException as e:
-        if e.status == 404:
-            return (None, None)
-        else:  # pragma: no cover
-            raise e
-    except Exception as e:
-        raise e
-
-    tag_sha = ref.object.sha
-
-    try:
-        tag = repo.get_git_tag(tag_sha)
-    except GithubException as e:
-        if e.status == 404:
-            return (None, ref)
-        else:  # pragma: no cover
-            raise e
-    except Exception as e:
-        raise e
 
-    return (tag, ref)
+    tag_name: str = dataclasses.field()
+    release_name: str = dataclasses.field()
 
 
-def get_git_release(release_name: str) -> T.Optional["GitRelease"]:
+@dataclasses.dataclass
+class RemoteState:
     """
-    Get the GitRelease object for a given release name.
-
-    :param release_name: the name of the release to retrieve.
+    The current state of a :class:`Target` on GitHub.
 
-    :return: GitRelease object or None if not found
+    :param ref: the ``refs/tags/{tag_name}`` reference, ``None`` if not exists.
+    :param commit_sha: the commit the tag points to, annotated tags are
+        dereferenced.
+    :param release: ``None`` if not exists.
+    :param assets: the release assets by name.
     """
-    try:
-        return repo.get_release(release_name)
-    except GithubException as e:
-        if e.status == 404:
-            return None
-        else:  # pragma: no cover
-            raise e
-    except Exception as e:  # pragma: no cover
-        raise e
 
+    target: Target = dataclasses.field()
+    ref: T.Optional["GitRef"] = dataclasses.field(default=None)
+    commit_sha: T.Optional[str] = dataclasses.field(default=None)
+    release: T.Optional["GitRelease"] = dataclasses.field(default=None)
+    assets: dict[str, "GitReleaseAsset"] = dataclasses.field(default_factory=dict)
 
-def is_tag_latest_on_main(tag_name: str) -> tuple[
-    bool,
-    T.Optional["GitTag"],
-    T.Optional["GitRef"],
-    T.Optional[str],
-]:
-    """
-    Check if the tag points to the latest commit on the main branch.
 
-    :returns: a tuple of four elements:
+def get_asset_digest(asset: "GitReleaseAsset") -> str:
     """
-    latest_commit_sha = get_latest_commit_sha()
-    tag, ref = get_git_tag_and_ref(tag_name)
-    if tag is None:
-        return (False, tag, ref, latest_commit_sha)
-    else:
-        flag = tag.object.sha == latest_commit_sha
-        return (flag, tag, ref, latest_commit_sha)
-
-
-def clean_up_existing_release(release_name: str) -> bool:
+    Get the sha256 of a release asset, from the ``digest`` field GitHub
+    computes on upload, or by downloading the asset if it is not there,
+    see :func:`is_asset_changed`.
     """
-    Delete an existing release if it exists.
-
-    :returns: a boolean flag to indicate whether the operation is performed.
+    digest = (asset.raw_data or dict()).get("digest") or ""
+    if digest.startswith("sha256:"):
+        return digest[len("sha256:") :]
+    h = hashlib.sha256()
+    _, _, chunks = asset.download_asset(chunk_size=1024 * 1024)
+    for chunk in chunks:
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def is_asset_changed(
+    asset: T.Optional["GitReleaseAsset"],
+    path: Path,
+    local_digest: str,
+) -> bool:
     """
-    release = get_git_release(release_name)
-    if release is None:
-        return False
-    else:
-        release.delete_release()
+    Compare a release asset with the local file. The size is compared first,
+    so an asset without ``digest`` is only downloaded if the sizes match.
+    """
+    if asset is None or asset.size != path.stat().st_size:
         return True
+    return get_asset_digest(asset) != local_digest
 
 
-def clean_up_existing_tag(tag_name: str) -> bool:
+def fetch_state(repo: "Repository", target: Target) -> RemoteState:
     """
-    Delete an existing tag if it exists.
-
-    :returns: a boolean flag to indicate whether the operation is performed.
+    Fetch the tag, the release and the assets of a target.
     """
+    state = RemoteState(target=target)
     try:
-        ref = repo.get_git_ref(f"tags/{tag_name}")
-        ref.delete()
-        return True
+        state.ref = repo.get_git_ref(f"tags/{target.tag_name}")
+    except GithubException as e:
+        if e.status != 404:  # pragma: no cover
+            raise e
+    if state.ref is not None:
+        if state.ref.object.type == "tag":
+            state.commit_sha = repo.get_git_tag(state.ref.object.sha).object.sha
+        else:
+            state.commit_sha = state.ref.object.sha
+    try:
+        state.release = repo.get_release(target.release_name)
     except GithubException as e:
-        if e.status == 404:
-            return False
-        else:  # pragma: no cover
+        if e.status != 404:  # pragma: no cover
             raise e
+    if state.release is not None:
+        state.assets = {asset.name: asset for asset in state.release.assets}
+    return state
 
 
-def create_tag(
-    tag_name: str,
-    latest_commit_sha: T.Optional[str] = None,
-) -> tuple["GitTag", "GitRef"]:
+@dataclasses.dataclass
+class Plan:
     """
-    Create a new Git tag pointing to the latest commit.
-    """
-    if latest_commit_sha is None:
-        latest_commit_sha = get_latest_commit_sha()
-    tag = repo.create_git_tag(
-        tag=tag_name,
-        message=f"Tag {tag_name}",
-        object=latest_commit_sha,
-        type="commit",
-    )
-    ref = repo.create_git_ref(
-        ref=f"refs/tags/{tag_name}",
-        sha=tag.sha,
-    )
-    return tag, ref
+    The minimal changes to bring a :class:`Target` up to date.
 
+    :param head_sha: the latest commit of the default branch.
+    :param move_tag: create the tag, or move it to ``head_sha``.
+    :param create_release: the release does not exist.
+    :param changed_assets: local files that are missing in the release, or
+        whose digest differs from the published asset.
+    """
 
-def create_release(tag_name: str, release_name: str) -> "GitRelease":
+    state: RemoteState = dataclasses.field()
+    head_sha: str = dataclasses.field()
+    move_tag: bool = dataclasses.field()
+    create_release: bool = dataclasses.field()
+    changed_assets: list[Path] = dataclasses.field()
+
+    @property
+    def target(self) -> Target:
+        return self.state.target
+
+    def is_noop(self) -> bool:
+        return not (self.move_tag or self.create_release or self.changed_assets)
+
+    def describe(self) -> list[str]:
+        lines = list()
+        if self.move_tag:
+            if self.state.ref is None:
+                lines.append(f"create tag {self.target.tag_name!r} at {self.head_sha[:7]}")
+            else:
+                lines.append(
+                    f"move tag {self.target.tag_name!r} "
+                    f"{(self.state.commit_sha or '?')[:7]} -> {self.head_sha[:7]}"
+                )
+        if self.create_release:
+            lines.append(f"create release {self.target.release_name!r}")
+        for path in self.changed_assets:
+            action = "replace" if path.name in self.state.assets else "upload"
+            lines.append(f"{action} asset {path.name!r}")
+        return lines
+
+
+def make_plan(
+    state: RemoteState,
+    head_sha: str,
+    path_list: list[Path],
+    local_digests: dict[str, str],
+) -> Plan:
     """
-    Create a new GitHub release for a tag.
-    :param tag_name:
-    :param release_name:
-    :return:
+    Compare the remote state with the latest commit and the local files.
     """
-    return repo.create_git_release(
-        tag=tag_name,
-        name=release_name,
-        message=f"Release {release_name}",
+    changed_assets = [
+        path
+        for path in path_list
+        if is_asset_changed(state.assets.get(path.name), path, local_digests[path.name])
+    ]
+    return Plan(
+        state=state,
+        head_sha=head_sha,
+        move_tag=state.commit_sha != head_sha,
+        create_release=state.release is None,
+        changed_assets=changed_assets,
     )
 
 
-def update_release(
-    tag_name: str,
-    release_name: str,
-) -> tuple[
-    bool,
-    T.Optional["GitTag"],
-    T.Optional["GitRef"],
-    T.Optional["GitRelease"],
-]:
+def plan_release(
+    repo: "Repository",
+    targets: list[Target],
+    path_list: list[Path],
+) -> list[Plan]:
     """
-    Update the GitHub release and tag to point to the latest commit.
+    Fetch the remote state of all targets concurrently and plan each of them.
+    """
+    local_digests = {path.name: sha256_of_file(path) for path in path_list}
+    with ThreadPoolExecutor(max_workers=len(targets) + 1) as executor:
+        future_head = executor.submit(
+            lambda: repo.get_branch(repo.default_branch).commit.sha
+        )
+        future_states = [
+            executor.submit(fetch_state, repo, target) for target in targets
+        ]
+        head_sha = future_head.result()
+        return list(
+            executor.map(
+                lambda state: make_plan(state, head_sha, path_list, local_digests),
+                [future.result() for future in future_states],
+            )
+        )
+
 
-    This function handles the core logic of ensuring that the release
-    tag always points to the latest code, creating or updating as needed.
+def print_plan(plans: list[Plan]):
+    for plan in plans:
+        print(f"--- release {plan.target.release_name!r}")
+        lines = plan.describe()
+        if not lines:
+            print("  up to date")
+        for line in lines:
+            print(f"  {line}")
 
-    :returns: a boolean flag to indicate whether the operation is performed.
+
+def move_tag(repo: "Repository", plan: Plan):
+    """
+    Point the tag to the latest commit in place, the release attached to the
+    tag name and its assets are kept.
     """
-    print("Checking if the tag is latest on main branch...")
-    (flag, tag, ref, latest_commit_sha) = is_tag_latest_on_main(tag_name)
-    print(f"Tag = {tag}, Ref = {ref}, Latest commit SHA = {latest_commit_sha}")
-    if flag is True:
-        print("Tag is latest on main branch, no need to update.")
-        return False, tag, ref, None
+    tag = repo.create_git_tag(
+        tag=plan.target.tag_name,
+        message=f"Tag {plan.target.tag_name}",
+        object=plan.head_sha,
+        type="commit",
+    )
+    if plan.state.ref is None:
+        repo.create_git_ref(ref=f"refs/tags/{plan.target.tag_name}", sha=tag.sha)
     else:
-        print("Tag is not latest on main branch, updating ...")
-    print("Cleaning up existing release and tag ...")
-    clean_up_existing_release(release_name)
-    if tag is not None:
-        print("Cleaning up existing tag ...")
-        clean_up_existing_tag(tag_name)
-    print("Creating new tag ...")
-    tag, ref = create_tag(tag_name=tag_name, latest_commit_sha=latest_commit_sha)
-    print("Creating new release ...")
-    release = create_release(tag_name=tag_name, release_name=release_name)
-    print("Done!")
-    return True, tag, ref, release
-
-
-def update_assets(
+        plan.state.ref.edit(sha=tag.sha, force=True)
+
+
+def replace_asset(
     release: "GitRelease",
-    path_list: T.List[Path],
+    path: Path,
+    assets: dict[str, "GitReleaseAsset"],
 ):
     """
-    Update the assets attached to a GitHub release.
-
-    This function ensures that the specified files are attached to the
-    release, replacing any existing assets with the same names.
+    Upload the file under a temporary name, then swap it with the existing
+    asset, so the asset is missing only between the delete and the rename.
+    """
+    print(f"Uploading asset {path.name!r} ...")
+    existing = assets.get(path.name)
+    if existing is None:
+        release.upload_asset(path=f"{path}", label=path.name)
+        return
+    tmp_name = f"{path.name}.new"
+    if tmp_name in assets:  # left behind by an interrupted run
+        assets[tmp_name].delete_asset()
+    new = release.upload_asset(path=f"{path}", label=path.name, name=tmp_name)
+    existing.delete_asset()
+    new.update_asset(name=path.name, label=path.name)
+
+
+def apply_plan(repo: "Repository", plan: Plan, jobs: int = 3):
     """
-    filename_set = {path.name for path in path_list}
-    for asset in release.get_assets():
-        if asset.name in filename_set:
-            print(asset.delete_asset)
-            asset.delete_asset()
-    for path in path_list:
-        print(f"Uploading asset {path.name!r} ...")
-        release.upload_asset(
-            path=f"{path}",
-            label=path.name,
+    Apply the plan of one target, the assets are uploaded in parallel.
+    """
+    if plan.move_tag:
+        move_tag(repo, plan)
+    release = plan.state.release
+    if plan.create_release:
+        release = repo.create_git_release(
+            tag=plan.target.tag_name,
+            name=plan.target.release_name,
+            message=f"Release {plan.target.release_name}",
         )
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [
+            executor.submit(replace_asset, release, path, plan.state.assets)
+            for path in plan.changed_assets
+        ]
+        for future in futures:
+            future.result()
+    print(f"release {plan.target.release_name!r} is done")
 
 
-if __name__ == "__main__":
-    # Update the versioned tag and release
-    release_name, tag_name = __version__, __version__
-    flag, tag, ref, release = update_release(
-        tag_name=tag_name,
-        release_name=release_name,
-    )
-    if release is None:
-        release = get_git_release(release_name)
-    update_assets(
-        release=release,
-        path_list=[path_asset for path_asset in path_asset_list],
-    )
+def apply_plans(repo: "Repository", plans: list[Plan]):
+    """
+    Apply the plans of all targets in parallel.
+    """
+    plans = [plan for plan in plans if not plan.is_noop()]
+    if not plans:
+        print("Everything is up to date.")
+        return
+    with ThreadPoolExecutor(max_workers=len(plans)) as executor:
+        for future in [executor.submit(apply_plan, repo, plan) for plan in plans]:
+            future.result()
 
-    # Update the latest release
-    release_name, tag_name = "latest", "latest"
-    flag, tag, ref, release = update_release(
-        tag_name=tag_name,
-        release_name=release_name,
-    )
-    if release is None:
-        release = get_git_release(release_name)
-    update_assets(
-        release=release,
-        path_list=[path_asset for path_asset in path_asset_list],
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the plan without applying it",
     )
+    args = parser.parse_args()
+    # it is reproducible, it is only uploaded again if something changed
+    build_pyz(path_pyz=path_asset_list[-1])
+    repo = get_repo()
+    # the versioned release and the latest release
+    targets = [
+        Target(tag_name=__version__, release_name=__version__),
+        Target(tag_name="latest", release_name="latest"),
+    ]
+    plans = plan_release(repo=repo, targets=targets, path_list=path_asset_list)
+    print_plan(plans)
+    if not args.dry_run:
+        apply_plans(repo=repo, plans=plans)
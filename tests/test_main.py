@@ -1,12 +1,50 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import gzip
+import json
+import time
+import pstats
+import hashlib
+import shutil
+import zipfile
+import threading
+import subprocess
+from pathlib import Path
+
+import pytest
+from github import GithubException
+from pathpick.api import PathPick
+from docpack.api import GitHubPipeline
+from docpack.find_matching_files import find_matching_files
 
 from esclusive_ai_for_github_repo.paths import dir_project_root
+from esclusive_ai_for_github_repo.tests.fake_github import FakeGitHub
 from esclusive_ai_for_github_repo.main import (
     Paths,
     Config,
+    PathMatcher,
+    RenderCache,
+    BuildState,
+    RenderedDocument,
+    combine_documents,
+    RetryPolicy,
+    GitHubClient,
+    ETagCache,
+    plan_shards,
+    compact_python,
+    upload_assets,
+    publish_knowledge_base,
+    download_previous_build,
+    get_literal_dir_prefix,
+    scan_repo,
     build_knowledge_base,
+    build_and_publish_knowledge_base,
+    WatchSession,
+    open_watcher,
+    collect_changes,
+    watch_knowledge_base,
 )
 
 os.environ["CI"] = "true"
@@ -56,6 +94,1356 @@ def test_build_knowledge_base():
     build_knowledge_base(paths=paths, config=config)
 
 
+def make_repo(dir_repo: Path) -> Paths:
+    """
+    Create a small synthetic git repo folder with a ``tmp/prompt.md``.
+    """
+    files = {
+        "README.rst": "readme",
+        "pkg/__init__.py": "",
+        "pkg/core.py": "def core(): pass",
+        "pkg/sub/util.py": "def util(): pass",
+        "docs/source/index.rst": "index",
+        ".venv/lib/site.py": "venv",
+    }
+    for relpath, content in files.items():
+        path = dir_repo.joinpath(relpath)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+    paths = Paths(dir_project_root=dir_repo)
+    paths.path_prompt_md.write_text("PROMPT", encoding="utf-8")
+    return paths
+
+
+def test_build_knowledge_base_single_pass(tmp_path):
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "all", "include": ["**/*.py", "**/*.rst"], "exclude": [".venv/"]},
+                {"name": "python", "include": ["pkg/**/*.py"], "exclude": []},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    document_set = build_knowledge_base(paths=paths, config=config)
+    # every file is rendered only once, even if it is in multiple groups
+    assert sorted(document_set.documents) == [
+        "README.rst",
+        "docs/source/index.rst",
+        "pkg/__init__.py",
+        "pkg/core.py",
+        "pkg/sub/util.py",
+    ]
+    assert len(list(paths.dir_staging.glob("*.xml"))) == 5
+    assert document_set.selections["python"] == [
+        "pkg/__init__.py",
+        "pkg/core.py",
+        "pkg/sub/util.py",
+    ]
+    assert document_set.selections["document"] == [
+        "README.rst",
+        "docs/source/index.rst",
+    ]
+    text = paths.dir_document_groups.joinpath("all.txt").read_text(encoding="utf-8")
+    assert text.startswith("PROMPT\n<document>")
+    assert text.count("<document>") == 5
+    assert ".venv" not in text
+
+
+def test_render_cache(tmp_path):
+    paths = make_repo(tmp_path.joinpath("repo"))
+    config = Config.from_dict(
+        {"document_groups": [{"name": "all", "include": [], "exclude": [".venv", "tmp"]}]}
+    )
+    cache = RenderCache(dir_root=tmp_path.joinpath("cache"), max_bytes=1024 * 1024)
+    build_knowledge_base(paths=paths, config=config, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 5)
+    content = paths.dir_document_groups.joinpath("all.txt").read_text(encoding="utf-8")
+
+    # rendered XML is the same as the docpack pipeline
+    dir_out = tmp_path.joinpath("docpack")
+    GitHubPipeline(
+        domain=os.environ["GITHUB_SERVER_URL"],
+        account="easyscalecloud",
+        repo="esclusive-ai-for-github-repo",
+        branch="main",
+        dir_repo=paths.dir_project_root,
+        include=[],
+        exclude=[".venv", "tmp"],
+        dir_out=dir_out,
+    ).fetch()
+    expected = {path.name: path.read_text() for path in dir_out.glob("*.xml")}
+    actual = {path.name: path.read_text() for path in paths.dir_staging.glob("*.xml")}
+    assert actual == expected
+
+    # only the changed file is rendered again
+    paths.dir_project_root.joinpath("pkg", "core.py").write_text("def core(): return 1")
+    cache = RenderCache(dir_root=cache.dir_root, max_bytes=cache.max_bytes)
+    build_knowledge_base(paths=paths, config=config, cache=cache)
+    assert (cache.hits, cache.misses) == (4, 1)
+    new_content = paths.dir_document_groups.joinpath("all.txt").read_text(encoding="utf-8")
+    assert new_content == content.replace("def core(): pass", "def core(): return 1")
+
+    # a killed zipapp extraction leaves a temp directory in the cache
+    cache.dir_root.joinpath("pyz", "0123456789abcdef.x1y2z3").mkdir(parents=True)
+    # least recently used entries are evicted first
+    assert len(list(cache.dir_root.glob("*/*.xml"))) == 6
+    cache.max_bytes = 0
+    assert cache.evict() == 6
+    assert len(list(cache.dir_root.glob("*/*.xml"))) == 0
+
+
+def git(dir_repo: Path, *args: str):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=dir_repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+def test_incremental_build(tmp_path):
+    paths = make_repo(tmp_path)
+    tmp_path.joinpath(".gitignore").write_text("tmp/\npkg/_generated.py\n")
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-q", "-m", "first")
+    # not tracked by git, but in the full build
+    tmp_path.joinpath("pkg", "_generated.py").write_text("def generated(): pass")
+    tmp_path.joinpath("pkg", "draft.py").write_text("def draft(): pass")
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    build_knowledge_base(paths=paths, config=config)
+    # simulate downloading the published assets
+    shutil.copytree(paths.dir_document_groups, paths.dir_previous)
+    previous = BuildState.from_json(paths.path_build_state_json)
+    assert previous.commit is not None
+
+    tmp_path.joinpath("pkg", "core.py").write_text("def core(): return 1")
+    tmp_path.joinpath("pkg", "new.py").write_text("def new(): pass")
+    tmp_path.joinpath("docs", "source", "index.rst").unlink()
+    git(tmp_path, "mv", "pkg/sub/util.py", "pkg/sub/helper.py")
+    git(tmp_path, "add", "pkg", "docs")
+    git(tmp_path, "commit", "-q", "-m", "second")
+    # changes that are not committed
+    tmp_path.joinpath("pkg", "_generated.py").write_text("def generated_v2(): pass")
+    tmp_path.joinpath("pkg", "draft.py").unlink()
+    tmp_path.joinpath("pkg", "wip.py").write_text("def wip(): pass")
+    tmp_path.joinpath("README.rst").write_text("readme v2")
+
+    document_set = build_knowledge_base(paths=paths, config=config, previous=previous)
+    # only the added, modified, renamed and untracked files are rendered
+    assert sorted(path.name.split("~")[-2] for path in paths.dir_staging.glob("*.xml")) == [
+        "README.rst",
+        "_generated.py",
+        "core.py",
+        "helper.py",
+        "new.py",
+        "wip.py",
+    ]
+    assert document_set.documents["pkg/__init__.py"].path_xml.parent == paths.dir_previous
+    incremental = {
+        path.name: path.read_bytes() for path in paths.dir_document_groups.glob("*")
+    }
+
+    # the result is byte-identical to a full build
+    build_knowledge_base(paths=paths, config=config)
+    full = {path.name: path.read_bytes() for path in paths.dir_document_groups.glob("*")}
+    assert incremental == full
+    assert b"util.py" not in full["python.txt"]
+    assert b"docs/source/index.rst" not in full["document.txt"]
+    assert b"generated_v2" in full["python.txt"] and b"wip" in full["python.txt"]
+    assert b"draft" not in full["python.txt"]
+
+    # fall back to full build when the prompt changed
+    paths.path_prompt_md.write_text("NEW PROMPT", encoding="utf-8")
+    previous = BuildState.from_json(paths.path_build_state_json)
+    document_set = build_knowledge_base(paths=paths, config=config, previous=previous)
+    assert document_set.documents["README.rst"].path_xml.parent == paths.dir_staging
+
+
+@pytest.mark.parametrize("zero_copy", [True, False])
+def test_combine_documents(tmp_path, monkeypatch, zero_copy):
+    import esclusive_ai_for_github_repo.main as main
+
+    if zero_copy is False:
+        monkeypatch.setattr(main, "_copy_methods", [main._copy_with_buffer])
+        monkeypatch.setattr(main, "COPY_BUFFER_SIZE", 7)
+    path_a = tmp_path.joinpath("a.xml")
+    path_a.write_bytes("<document>ä</document>".encode("utf-8") * 10)
+    path_b = tmp_path.joinpath("b.xml")
+    path_b.write_bytes(b"0123456789<document>b</document>")
+    documents = [
+        RenderedDocument(path="a", path_xml=path_a),
+        RenderedDocument(path="b", path_xml=path_b, offset=10, size=22),
+    ]
+    path_asset = tmp_path.joinpath("out", "asset.txt")
+    # the asset is hashed while it is written, not read back
+    monkeypatch.setattr(main, "sha256_of_file", None)
+    index, digest = combine_documents(
+        path_asset=path_asset,
+        prompt=b"PROMPT",
+        documents=documents,
+    )
+    expected = b"\n".join([b"PROMPT", path_a.read_bytes(), b"<document>b</document>"])
+    data = path_asset.read_bytes()
+    assert data == expected
+    assert digest == hashlib.sha256(data).hexdigest()
+    for path, offset, size in index:
+        assert data[offset : offset + size].startswith(b"<document>")
+        assert data[offset : offset + size].endswith(b"</document>")
+
+    # a truncated source is an error, not a silently broken asset
+    documents = [RenderedDocument(path="b", path_xml=path_b, offset=10, size=100)]
+    with pytest.raises(ValueError):
+        combine_documents(path_asset=path_asset, prompt=b"", documents=documents)
+
+
+def test_copy_range_unsupported_in_threads(tmp_path, monkeypatch):
+    import errno
+    import esclusive_ai_for_github_repo.main as main
+
+    barrier = threading.Barrier(4)
+
+    def unsupported(fd_in, fd_out, offset, size):
+        # every thread finds out at the same time
+        barrier.wait()
+        raise OSError(errno.EXDEV, "cross device")
+
+    monkeypatch.setattr(main, "_copy_methods", [unsupported, main._copy_with_buffer])
+    path_xml = tmp_path.joinpath("a.xml")
+    path_xml.write_bytes(b"<document>a</document>")
+    documents = [RenderedDocument(path="a", path_xml=path_xml)]
+    paths_asset = [tmp_path.joinpath(f"asset-{i}.txt") for i in range(4)]
+    threads = [
+        threading.Thread(
+            target=combine_documents,
+            kwargs=dict(path_asset=path_asset, prompt=b"P", documents=documents),
+        )
+        for path_asset in paths_asset
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert main._copy_methods == [main._copy_with_buffer]
+    for path_asset in paths_asset:
+        assert path_asset.read_bytes() == b"P\n<document>a</document>"
+
+
+def test_build_knowledge_base_jobs(tmp_path):
+    paths = make_repo(tmp_path.joinpath("repo"))
+    for i in range(30):
+        path = paths.dir_project_root.joinpath("pkg", f"m{i % 3}", f"mod{i}.py")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"x = {i}\n" * i)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "all", "include": ["**/*.py", "**/*.rst"], "exclude": [".venv/"]},
+                {"name": "python", "include": ["pkg/**/*.py"], "exclude": []},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    build_knowledge_base(paths=paths, config=config, jobs=1)
+    serial = {path.name: path.read_bytes() for path in paths.dir_document_groups.glob("*.txt")}
+
+    cache = RenderCache(dir_root=tmp_path.joinpath("cache"), max_bytes=1024 * 1024)
+    for expected_hits in [0, 35]:
+        build_knowledge_base(paths=paths, config=config, cache=cache, jobs=3)
+        parallel = {
+            path.name: path.read_bytes() for path in paths.dir_document_groups.glob("*.txt")
+        }
+        assert parallel == serial
+        assert cache.hits == expected_hits
+
+
+def test_zst_compression_availability(monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    dct = {
+        "document_groups": [
+            {"name": "python", "include": ["**/*.py"], "exclude": [], "compression": ["zst"]}
+        ]
+    }
+    monkeypatch.setattr(main, "is_zstd_available", lambda: False)
+    with pytest.raises(ValueError, match="zstandard"):
+        Config.from_dict(json.loads(json.dumps(dct)))
+    monkeypatch.setattr(main, "is_zstd_available", lambda: True)
+    Config.from_dict(json.loads(json.dumps(dct)))
+    assert isinstance(main.is_zstd_available(), bool)
+
+
+def test_compressed_assets(tmp_path):
+    paths = make_repo(tmp_path.joinpath("repo"))
+    config = Config.from_dict(
+        {
+            "compression": ["gz"],
+            "document_groups": [
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                {
+                    "name": "document",
+                    "include": ["**/*.rst"],
+                    "exclude": [],
+                    "compression": ["gz", "zip"],
+                },
+                {"name": "none", "include": ["**/*.rst"], "exclude": [], "compression": []},
+            ],
+        }
+    )
+    assert config.document_groups[0].asset_names == ["python.txt", "python.txt.gz"]
+    cache = RenderCache(dir_root=tmp_path.joinpath("cache"), max_bytes=1024 * 1024)
+    build_knowledge_base(paths=paths, config=config, cache=cache)
+    dir_out = paths.dir_document_groups
+    assert sorted(path.name for path in dir_out.glob("*.txt*")) == [
+        "document.txt",
+        "document.txt.gz",
+        "document.txt.zip",
+        "none.txt",
+        "python.txt",
+        "python.txt.gz",
+    ]
+    plain = dir_out.joinpath("document.txt").read_bytes()
+    assert gzip.decompress(dir_out.joinpath("document.txt.gz").read_bytes()) == plain
+    with zipfile.ZipFile(dir_out.joinpath("document.txt.zip")) as zf:
+        assert zf.read("document.txt") == plain
+    state = BuildState.from_json(paths.path_build_state_json)
+    assert len(state.digests) == 9  # 6 assets + 3 manifests
+    compressed = {path.name: path.read_bytes() for path in dir_out.glob("*.txt.*")}
+
+    # compressed assets of unchanged groups are reused from the cache
+    hits = cache.hits
+    build_knowledge_base(paths=paths, config=config, cache=cache)
+    assert cache.hits - hits == 5 + 3
+    assert {path.name: path.read_bytes() for path in dir_out.glob("*.txt.*")} == compressed
+
+    with pytest.raises(ValueError):
+        Config.from_dict(
+            {"document_groups": [{"name": "a", "include": [], "exclude": [], "compression": ["rar"]}]}
+        )
+
+
+def test_token_report(tmp_path):
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    document_set = build_knowledge_base(paths=paths, config=config)
+    report = json.loads(paths.path_token_report_json.read_text())
+    assert report["n_files"] == len(document_set.documents)
+    python = report["groups"]["python"]
+    assert python["n_files"] == 3
+    assert python["bytes"] == paths.dir_document_groups.joinpath("python.txt").stat().st_size
+    assert python["tokens"] == (python["bytes"] + 3) // 4
+    sizes = [file["bytes"] for file in report["files"]]
+    assert sizes == sorted(sizes, reverse=True)
+    assert report["total_bytes"] == sum(
+        document.get_size() for document in document_set.documents.values()
+    )
+    # every document has an estimate, the top files are a summary of them
+    assert [file["path"] for file in report["documents"]] == sorted(
+        document_set.documents
+    )
+    for file in report["documents"]:
+        assert file["bytes"] == document_set.documents[file["path"]].get_size()
+        assert file["tokens"] == (file["bytes"] + 3) // 4
+    assert all(file in report["documents"] for file in report["files"])
+
+
+def test_manifest_and_priority(tmp_path):
+    paths = make_repo(tmp_path)
+    group = {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]}
+    config = Config.from_dict({"document_groups": [dict(group)]})
+    build_knowledge_base(paths=paths, config=config)
+    path_asset = paths.dir_document_groups.joinpath("python.txt")
+    path_manifest = paths.dir_document_groups.joinpath("python.manifest.json")
+    asset = path_asset.read_bytes()
+    manifest = json.loads(path_manifest.read_text())
+    assert [file["path"] for file in manifest["files"]] == [
+        "pkg/__init__.py",
+        "pkg/core.py",
+        "pkg/sub/util.py",
+    ]
+    for file in manifest["files"]:
+        xml = asset[file["offset"] : file["offset"] + file["size"]]
+        assert xml.startswith(b"<document>")
+        content = tmp_path.joinpath(file["path"]).read_bytes()
+        assert file["sha256"] == hashlib.sha256(content).hexdigest()
+
+    # rebuilding the same commit is byte identical
+    build_knowledge_base(paths=paths, config=config, jobs=2)
+    assert path_asset.read_bytes() == asset
+    assert json.loads(path_manifest.read_text()) == manifest
+
+    config = Config.from_dict(
+        {"document_groups": [dict(group, priority=["pkg/sub/", "core.py"])]}
+    )
+    build_knowledge_base(paths=paths, config=config)
+    manifest = json.loads(path_manifest.read_text())
+    assert [file["path"] for file in manifest["files"]] == [
+        "pkg/sub/util.py",
+        "pkg/core.py",
+        "pkg/__init__.py",
+    ]
+
+
+def test_dedup(tmp_path):
+    paths = make_repo(tmp_path)
+    license = "Licensed under the Apache License, Version 2.0\n" * 20
+    for relpath in ["LICENSE.txt", "vendor/a/LICENSE.txt", "vendor/b/LICENSE.txt"]:
+        tmp_path.joinpath(relpath).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(relpath).write_text(license)
+    tmp_path.joinpath(".gitignore").write_text("tmp/\n")
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-q", "-m", "first")
+    config = Config.from_dict(
+        {
+            "dedup": True,
+            "document_groups": [
+                {"name": "all", "include": ["**/*.txt", "**/*.py"], "exclude": [".venv", "tmp"]},
+                {"name": "plain", "include": ["**/*.txt"], "exclude": ["tmp"], "dedup": False},
+            ],
+        }
+    )
+    build_knowledge_base(paths=paths, config=config)
+    dir_out = paths.dir_document_groups
+    text = dir_out.joinpath("all.txt").read_text()
+    assert text.count("Apache License") == 20
+    assert text.count("Same content as LICENSE.txt") == 2
+    assert dir_out.joinpath("plain.txt").read_text().count("Apache License") == 60
+    manifest = json.loads(dir_out.joinpath("all.manifest.json").read_text())
+    assert manifest["n_duplicates"] == 2
+    assert manifest["bytes_saved"] > len(license)
+    files = {file["path"]: file for file in manifest["files"]}
+    assert files["vendor/a/LICENSE.txt"]["duplicate_of"] == "LICENSE.txt"
+    assert "duplicate_of" not in files["LICENSE.txt"]
+    state = BuildState.from_json(paths.path_build_state_json)
+    assert state.duplicates == {"all": ["vendor/a/LICENSE.txt", "vendor/b/LICENSE.txt"]}
+
+    # the original changed, the duplicates are resolved in an incremental build
+    shutil.copytree(dir_out, paths.dir_previous)
+    tmp_path.joinpath("LICENSE.txt").write_text("MIT License")
+    git(tmp_path, "commit", "-q", "-am", "second")
+    build_knowledge_base(paths=paths, config=config, previous=state)
+    incremental = {path.name: path.read_bytes() for path in dir_out.glob("*")}
+    build_knowledge_base(paths=paths, config=config)
+    full = {path.name: path.read_bytes() for path in dir_out.glob("*")}
+    assert incremental == full
+    assert full["all.txt"].count(b"Same content as vendor/a/LICENSE.txt") == 1
+
+
+def test_compact_python():
+    source = (
+        "#!/usr/bin/env python\n"
+        "# Copyright (C) 2025 Someone\n"
+        "# Licensed under the MIT License\n"
+        "\n"
+        '"""Module docstring."""\n'
+        "\n\n\n"
+        "import os   \n"
+        "\n"
+        "\n"
+        "def f():\n"
+        '    """Only a docstring."""\n'
+        "\n"
+        "\n"
+        "def g(x):  # comment\n"
+        '    """Docstring."""\n'
+        '    s = """keep   \n'
+        "\n"
+        '  this"""\n'
+        "    # comment\n"
+        "    return x\n"
+    )
+    assert compact_python(source) == (
+        "#!/usr/bin/env python\n"
+        "\n"
+        '"""Module docstring."""\n'
+        "\n"
+        "import os\n"
+        "\n"
+        "def f():\n"
+        '    """Only a docstring."""\n'
+        "\n"
+        "def g(x):  # comment\n"
+        '    """Docstring."""\n'
+        '    s = """keep   \n'
+        "\n"
+        '  this"""\n'
+        "    # comment\n"
+        "    return x\n"
+    )
+    assert compact_python(source, strip=True) == (
+        "#!/usr/bin/env python\n"
+        "\n"
+        "import os\n"
+        "\n"
+        "def f():\n"
+        "    ...\n"
+        "\n"
+        "def g(x):\n"
+        '    s = """keep   \n'
+        "\n"
+        '  this"""\n'
+        "    return x\n"
+    )
+    # invalid Python is never changed
+    assert compact_python("def f(:\n\n\n    pass  \n") == "def f(:\n\n\n    pass  \n"
+
+
+def test_compact_document_group(tmp_path):
+    paths = make_repo(tmp_path)
+    tmp_path.joinpath("pkg", "core.py").write_text(
+        "# Copyright (C) 2025 Someone\n\n\n\ndef core():\n    # comment\n    pass\n"
+    )
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "all", "include": ["**/*.py"], "exclude": [".venv", "tmp"]},
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"], "compact": "strip"},
+            ]
+        }
+    )
+    build_knowledge_base(paths=paths, config=config)
+    dir_out = paths.dir_document_groups
+    assert "Copyright" in dir_out.joinpath("all.txt").read_text()
+    python = dir_out.joinpath("python.txt").read_text()
+    assert "Copyright" not in python
+    assert "def core():\n    pass\n" in python
+    report = json.loads(paths.path_token_report_json.read_text())
+    compaction = report["compaction"]["strip"]
+    assert compaction["n_files"] == 3
+    assert compaction["bytes_after"] < compaction["bytes_before"]
+
+    with pytest.raises(ValueError):
+        Config.from_dict(
+            {"document_groups": [{"name": "a", "include": [], "exclude": [], "compact": "max"}]}
+        )
+
+
+def test_large_and_binary_files(tmp_path):
+    paths = make_repo(tmp_path)
+    tmp_path.joinpath("docs", "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n\0\0")
+    tmp_path.joinpath("docs", "data.txt").write_bytes(b"ok\n" + b"\xff\xfe" * 10)
+    lines = [f"line {i}" for i in range(10_000)]
+    tmp_path.joinpath("docs", "big.log").write_text("\n".join(lines))
+    tmp_path.joinpath(".gitignore").write_text("tmp/\n")
+    git(tmp_path, "init", "-q")
+    git(tmp_path, "add", "-A")
+    git(tmp_path, "commit", "-q", "-m", "first")
+    config = Config.from_dict(
+        {
+            "max_file_bytes": 50_000,
+            "document_groups": [
+                {"name": "all", "include": [], "exclude": [".git", ".venv", "tmp"], "oversize": "excerpt"},
+                {"name": "docs", "include": ["docs/"], "exclude": []},
+                {"name": "unlimited", "include": ["docs/"], "exclude": [], "max_file_bytes": 0},
+            ],
+        }
+    )
+    document_set = build_knowledge_base(paths=paths, config=config)
+    assert "docs/logo.png" not in document_set.selections["all"]
+    assert "docs/data.txt" not in document_set.selections["all"]
+    assert document_set.selections["docs"] == ["docs/source/index.rst"]
+    assert document_set.selections["unlimited"] == ["docs/big.log", "docs/source/index.rst"]
+    dir_out = paths.dir_document_groups
+    text = dir_out.joinpath("all.txt").read_text()
+    assert "PNG" not in text
+    assert "line 0\n" in text and "line 9999" in text
+    assert "line 5000" not in text
+    assert "bytes omitted, the file is too large" in text
+    assert "line 5000" in dir_out.joinpath("unlimited.txt").read_text()
+
+    # the excerpt is reused in an incremental build
+    shutil.copytree(dir_out, paths.dir_previous)
+    previous = BuildState.from_json(paths.path_build_state_json)
+    tmp_path.joinpath("README.rst").write_text("new readme")
+    git(tmp_path, "commit", "-q", "-am", "second")
+    build_knowledge_base(paths=paths, config=config, previous=previous)
+    incremental = {path.name: path.read_bytes() for path in dir_out.glob("*")}
+    build_knowledge_base(paths=paths, config=config)
+    full = {path.name: path.read_bytes() for path in dir_out.glob("*")}
+    assert incremental == full
+
+
+def test_plan_shards(tmp_path):
+    sizes = {
+        "README.rst": 9,
+        "a/x/1.py": 29,
+        "a/x/2.py": 29,
+        "a/y/1.py": 49,
+        "b/1.py": 9,
+        "b/2.py": 9,
+        "c/big.py": 199,
+        "d/1.py": 9,
+    }
+    documents = [
+        RenderedDocument(path=path, path_xml=tmp_path, size=size)
+        for path, size in sizes.items()
+    ]
+    shards = plan_shards(documents, max_size=100)
+    assert [[document.path for document in shard] for shard in shards] == [
+        ["README.rst", "a/x/1.py", "a/x/2.py"],  # "a" doesn't fit, "a/x" does
+        ["a/y/1.py", "b/1.py", "b/2.py"],  # "b" is not split
+        ["c/big.py"],  # oversize document gets its own shard
+        ["d/1.py"],
+    ]
+
+
+def test_build_shards(tmp_path):
+    paths = make_repo(tmp_path)
+    for i in range(20):
+        path = tmp_path.joinpath("pkg", f"m{i % 4}", f"mod{i}.py")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"x = {i}\n" * 20)
+    group = {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]}
+    config = Config.from_dict({"document_groups": [dict(group, max_bytes=2000)]})
+    build_knowledge_base(paths=paths, config=config)
+    dir_out = paths.dir_document_groups
+    full = dir_out.joinpath("python.txt").read_text()
+    shards = sorted(dir_out.glob("python.part-*.txt"))
+    assert len(shards) > 1
+    n_documents = 0
+    for nth, path in enumerate(shards, start=1):
+        text = path.read_text()
+        assert len(text.encode("utf-8")) <= 2000
+        assert text.startswith(f"PROMPT\n<shard_index>")
+        assert f"<shard>{nth} of {len(shards)}</shard>" in text
+        n_documents += text.count("<document>")
+    assert n_documents == full.count("<document>")
+    assert "<first_path>pkg/__init__.py</first_path>" in shards[0].read_text()
+    state = BuildState.from_json(paths.path_build_state_json)
+    assert sorted(state.digests) == sorted(
+        ["python.txt", "python.manifest.json"] + [path.name for path in shards]
+    )
+    for path in shards + [dir_out.joinpath("python.txt")]:
+        assert state.digests[path.name] == hashlib.sha256(path.read_bytes()).hexdigest()
+
+    # stale shards are removed from the release
+    release = FakeRelease()
+    upload_assets(release=release, paths=paths, config=config)
+    assert len(release.assets) == len(shards) + 3
+    config = Config.from_dict({"document_groups": [dict(group, max_tokens=10_000)]})
+    build_knowledge_base(paths=paths, config=config)
+    assert list(dir_out.glob("python.part-*.txt")) == []
+    upload_assets(release=release, paths=paths, config=config)
+    assert sorted(release.assets) == [
+        "knowledge-base-state.json",
+        "python.manifest.json",
+        "python.txt",
+    ]
+
+
+class FakeAsset:
+    def __init__(self, release: "FakeRelease", name: str, data: bytes):
+        self.release = release
+        self.name = name
+        self.data = data
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def download_asset(self, path: str, chunk_size: int = 1):
+        Path(path).write_bytes(self.data)
+
+    def delete_asset(self):
+        with self.release.lock:
+            self.release.assets.pop(self.name, None)
+        return True
+
+
+class FakeRelease:
+    """
+    In-process stand-in of a GitHub release that fails the first uploads.
+    """
+
+    def __init__(self, n_failures: int = 0):
+        self.lock = threading.Lock()
+        self.assets: dict[str, FakeAsset] = dict()
+        self.n_failures = n_failures
+        self.uploads: list[str] = list()
+
+    def get_assets(self):
+        with self.lock:
+            return list(self.assets.values())
+
+    def upload_asset(self, path: str, label: str):
+        path = Path(path)
+        with self.lock:
+            if path.name in self.assets:
+                raise GithubException(422, {"message": "already_exists"})
+            # a failed upload leaves a broken asset behind, like GitHub does
+            self.assets[path.name] = FakeAsset(self, path.name, b"")
+            if self.n_failures > 0:
+                self.n_failures -= 1
+                raise GithubException(502, {"message": "Bad Gateway"})
+            self.assets[path.name].data = path.read_bytes()
+            self.uploads.append(path.name)
+
+
+def test_upload_assets(tmp_path, monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    monkeypatch.setattr(main.time, "sleep", lambda seconds: None)
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "all", "include": [], "exclude": [".venv", "tmp"]},
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    build_knowledge_base(paths=paths, config=config)
+    release = FakeRelease(n_failures=2)
+    release.assets["python.txt"] = FakeAsset(release, "python.txt", b"old")
+    upload_assets(release=release, paths=paths, config=config, jobs=3)
+    assert sorted(release.assets) == [
+        "all.manifest.json",
+        "all.txt",
+        "document.manifest.json",
+        "document.txt",
+        "knowledge-base-state.json",
+        "python.manifest.json",
+        "python.txt",
+    ]
+    for name, asset in release.assets.items():
+        assert asset.data == paths.dir_document_groups.joinpath(name).read_bytes()
+    # the build state is always uploaded last
+    assert release.uploads[-1] == "knowledge-base-state.json"
+
+    # give up after max attempts, non retryable errors are raised immediately
+    release = FakeRelease(n_failures=10)
+    with pytest.raises(GithubException):
+        upload_assets(release=release, paths=paths, config=config, retry=RetryPolicy(max_attempts=3))
+    retry = RetryPolicy()
+    assert retry.is_retryable(GithubException(503)) is True
+    assert retry.is_retryable(GithubException(429)) is True
+    assert retry.is_retryable(GithubException(404)) is False
+    assert retry.is_retryable(ConnectionResetError()) is True
+    assert retry.is_retryable(ValueError()) is False
+    assert 0 <= retry.get_delay(10) <= retry.max_delay
+
+
+def test_upload_assets_skip_unchanged(tmp_path):
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    release = FakeRelease()
+    build_knowledge_base(paths=paths, config=config)
+    upload_assets(release=release, paths=paths, config=config)
+    assert len(release.uploads) == 5
+
+    # nothing changed, nothing is uploaded
+    build_knowledge_base(paths=paths, config=config)
+    upload_assets(release=release, paths=paths, config=config)
+    assert len(release.uploads) == 5
+
+    # only the changed group and the build state are uploaded
+    tmp_path.joinpath("README.rst").write_text("new readme")
+    build_knowledge_base(paths=paths, config=config)
+    upload_assets(release=release, paths=paths, config=config)
+    assert sorted(release.uploads[5:-1]) == ["document.manifest.json", "document.txt"]
+    assert release.uploads[-1] == "knowledge-base-state.json"
+    assert release.assets["document.txt"].data == paths.dir_document_groups.joinpath(
+        "document.txt"
+    ).read_bytes()
+
+
+def test_publish_with_fake_github(tmp_path, monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    monkeypatch.setattr(main.time, "sleep", lambda seconds: None)
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    build_knowledge_base(paths=paths, config=config)
+    with FakeGitHub(repository="owner/repo", page_size=2) as server:
+        path_etags = tmp_path.joinpath("etags.json")
+        client = GitHubClient(
+            token="dummy-token",
+            repository="owner/repo",
+            api_url=server.url,
+            etag_cache=ETagCache(path=path_etags),
+        )
+        assert download_previous_build(paths=paths, config=config, client=client) is None
+
+        # the release and the tag are created
+        publish_knowledge_base(paths=paths, config=config, upload_jobs=2, client=client)
+        assert "refs/tags/knowledge-base" in server.refs
+        assert server.get_asset_names("knowledge-base") == [
+            "document.manifest.json",
+            "document.txt",
+            "knowledge-base-state.json",
+            "python.manifest.json",
+            "python.txt",
+        ]
+        # connections are kept alive and reused
+        assert server.n_connections <= 4 < len(server.requests)
+
+        # nothing changed, from the second run on the release and its assets
+        # are a 304, only the download of the published build state counts
+        # against the rate limit
+        publish_knowledge_base(paths=paths, config=config, client=client)
+        assert server.n_not_modified == 0
+        n_requests = len(server.requests)
+        rate_limit_used = server.rate_limit_used
+        publish_knowledge_base(paths=paths, config=config, client=client)
+        methods = [method for method, _ in server.requests[n_requests:]]
+        assert "POST" not in methods and "DELETE" not in methods
+        assert server.n_not_modified == 1
+        assert server.rate_limit_used - rate_limit_used == 1
+
+        # the assets listed across pages are cached as well
+        release = main.create_release(client)
+        assert len(list(release.get_assets())) == 5
+        assert len(list(release.get_assets())) == 5
+        assert server.n_not_modified == 2 + 3
+
+        # transient errors of listing and uploading are retried
+        tmp_path.joinpath("README.rst").write_text("new readme")
+        build_knowledge_base(paths=paths, config=config)
+        server.failures.extend([502, 503])
+        publish_knowledge_base(paths=paths, config=config, client=client)
+        assert server.failures == []
+        # the ETags are persisted across runs
+        download_previous_build(paths=paths, config=config, client=client)
+        client = GitHubClient(
+            token="dummy-token",
+            repository="owner/repo",
+            api_url=server.url,
+            etag_cache=ETagCache.load(path_etags),
+        )
+        n_not_modified = server.n_not_modified
+        state = download_previous_build(paths=paths, config=config, client=client)
+        assert server.n_not_modified == n_not_modified + 1
+        assert state.digests == BuildState.from_json(paths.path_build_state_json).digests
+        assert paths.dir_previous.joinpath("python.txt").read_bytes() == (
+            paths.dir_document_groups.joinpath("python.txt").read_bytes()
+        )
+
+        # bad credentials are not retried
+        client = GitHubClient(token="wrong", repository="owner/repo", api_url=server.url)
+        with pytest.raises(GithubException) as e:
+            publish_knowledge_base(paths=paths, config=config, client=client)
+        assert e.value.status == 401
+
+
+def test_build_and_publish(tmp_path, monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ],
+            "compression": ["gz"],
+        }
+    )
+    with FakeGitHub(repository="owner/repo", latency=0.01) as server:
+        client = GitHubClient(token=server.token, repository="owner/repo", api_url=server.url)
+
+        def get_published_state() -> bytes:
+            for asset in server.assets.values():
+                if asset.name == "knowledge-base-state.json":
+                    return asset.data
+
+        build_and_publish_knowledge_base(
+            paths=paths, config=config, jobs=2, upload_jobs=2, client=client
+        )
+        assert server.get_asset_names("knowledge-base") == [
+            "document.manifest.json",
+            "document.txt",
+            "document.txt.gz",
+            "knowledge-base-state.json",
+            "python.manifest.json",
+            "python.txt",
+            "python.txt.gz",
+        ]
+        # the same build state as a separate build, it is published last
+        state = paths.path_build_state_json.read_bytes()
+        assert get_published_state() == state
+        assert server.requests[-1][0] == "POST"
+        build_knowledge_base(paths=paths, config=config)
+        assert paths.path_build_state_json.read_bytes() == state
+
+        # nothing changed
+        n_requests = len(server.requests)
+        build_and_publish_knowledge_base(paths=paths, config=config, client=client)
+        methods = [method for method, _ in server.requests[n_requests:]]
+        assert "POST" not in methods and "DELETE" not in methods
+
+        # a failed build cancels the publish, the build state is never
+        # published for a partial upload
+        tmp_path.joinpath("README.rst").write_text("new readme")
+        build_group_asset = main.build_group_asset
+
+        def failing_build_group_asset(group, **kwargs):
+            if group.name == "python":
+                raise RuntimeError("build failed")
+            return build_group_asset(group=group, **kwargs)
+
+        monkeypatch.setattr(main, "build_group_asset", failing_build_group_asset)
+        with pytest.raises(RuntimeError):
+            build_and_publish_knowledge_base(paths=paths, config=config, client=client)
+        assert get_published_state() in (state, None)
+        monkeypatch.setattr(main, "build_group_asset", build_group_asset)
+
+        # a failed release lookup cancels the build
+        n_requests = len(server.requests)
+        client = GitHubClient(token="wrong", repository="owner/repo", api_url=server.url)
+        with pytest.raises(GithubException) as e:
+            build_and_publish_knowledge_base(paths=paths, config=config, client=client)
+        assert e.value.status == 401
+        assert [method for method, _ in server.requests[n_requests:]] == ["GET"]
+
+
+@pytest.mark.parametrize("poll_interval", [None, 0.02])
+def test_watch(tmp_path, poll_interval):
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "python", "include": ["pkg/**/*.py"], "exclude": []},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    document_set = build_knowledge_base(paths=paths, config=config)
+    session = WatchSession.new(paths=paths, config=config, document_set=document_set)
+    watcher = open_watcher(
+        paths=paths,
+        matchers=list(session.matchers.values()),
+        poll_interval=poll_interval,
+    )
+    try:
+        # a burst of saves, a new directory and a deletion
+        tmp_path.joinpath("pkg", "core.py").write_text("def core_v2(): pass")
+        tmp_path.joinpath("pkg", "core.py").write_text("def core_v3(): pass")
+        tmp_path.joinpath("pkg", "new", "deep").mkdir(parents=True)
+        tmp_path.joinpath("pkg", "new", "deep", "mod.py").write_text("def mod(): pass")
+        tmp_path.joinpath("pkg", "sub", "util.py").unlink()
+        changes = collect_changes(watcher, debounce=0.1, timeout=5)
+        assert session.update(changes) == ["python"]
+        text = paths.dir_document_groups.joinpath("python.txt").read_text()
+        assert "core_v3" in text and "core_v2" not in text
+        assert "def mod()" in text
+        assert "def util()" not in text
+        assert document_set.selections["python"] == [
+            "pkg/__init__.py",
+            "pkg/core.py",
+            "pkg/new/deep/mod.py",
+        ]
+        state = BuildState.from_json(paths.path_build_state_json)
+        assert [relpath for relpath, _, _ in state.groups["python"]] == (
+            document_set.selections["python"]
+        )
+        # the assets written by the update are not changes
+        assert collect_changes(watcher, debounce=0.1, timeout=0.3) == set()
+    finally:
+        watcher.close()
+
+    def edit():
+        time.sleep(0.3)
+        tmp_path.joinpath("README.rst").write_text("readme v2")
+
+    thread = threading.Thread(target=edit)
+    thread.start()
+    watch_knowledge_base(
+        paths=paths,
+        config=config,
+        document_set=document_set,
+        debounce=0.05,
+        poll_interval=poll_interval,
+        max_batches=1,
+    )
+    thread.join()
+    text = paths.dir_document_groups.joinpath("document.txt").read_text()
+    assert "readme v2" in text
+
+
+def test_watch_update_retry(tmp_path, monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {
+            "document_groups": [
+                {"name": "python", "include": ["pkg/**/*.py"], "exclude": []},
+                {"name": "document", "include": ["**/*.rst"], "exclude": []},
+            ]
+        }
+    )
+    document_set = build_knowledge_base(paths=paths, config=config)
+    session = WatchSession.new(paths=paths, config=config, document_set=document_set)
+    render_matches = main.render_matches
+
+    def render_matches_gone(**kwargs):
+        # a file is deleted between the change event and the render
+        monkeypatch.setattr(main, "render_matches", render_matches)
+        raise FileNotFoundError(2, "No such file", "README.rst")
+
+    monkeypatch.setattr(main, "render_matches", render_matches_gone)
+    tmp_path.joinpath("pkg", "sub", "util.py").unlink()
+    tmp_path.joinpath("README.rst").write_text("readme v2")
+    changes = {"pkg/sub/util.py", "README.rst"}
+    with pytest.raises(FileNotFoundError):
+        session.update(changes)
+    # the python group only lost a file, it is rebuilt by the retry
+    assert sorted(session.update(changes)) == ["document", "python"]
+    assert "def util()" not in paths.dir_document_groups.joinpath("python.txt").read_text()
+    assert "readme v2" in paths.dir_document_groups.joinpath("document.txt").read_text()
+    assert session.pending_groups == set()
+
+
+def test_metrics(tmp_path, monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    metrics = main.Metrics()
+    monkeypatch.setattr(main, "metrics", metrics)
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {"document_groups": [{"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]}]}
+    )
+    # disabled by default, nothing is recorded
+    build_knowledge_base(paths=paths, config=config)
+    assert metrics.stages == []
+
+    metrics.enabled = True
+    build_knowledge_base(paths=paths, config=config)
+    upload_assets(release=FakeRelease(), paths=paths, config=config)
+    stages = {stage.name: stage for stage in metrics.stages}
+    assert stages["scan"].files == 3
+    assert stages["render"].files == 3
+    assert stages["combine:python"].bytes == (
+        paths.dir_document_groups.joinpath("python.txt").stat().st_size
+    )
+    assert stages["upload:python.txt"].api_calls == 1
+    assert stages["upload:knowledge-base-state.json"].files == 1
+    assert all(stage.seconds >= 0 for stage in metrics.stages)
+
+    path_summary = tmp_path.joinpath("summary.md")
+    monkeypatch.setenv("GITHUB_STEP_SUMMARY", str(path_summary))
+    metrics.write_step_summary()
+    summary = path_summary.read_text()
+    assert "| Stage | Seconds | Files | Bytes | API calls |" in summary
+    assert "| upload:python.txt |" in summary
+    path_metrics = tmp_path.joinpath("metrics.json")
+    metrics.to_json(path_metrics)
+    data = json.loads(path_metrics.read_text())
+    assert len(data["stages"]) == len(metrics.stages)
+
+
+def test_profile(tmp_path, monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    paths = make_repo(tmp_path)
+    config = Config.from_dict(
+        {"document_groups": [{"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]}]}
+    )
+    with main.profile(paths.dir_profile, "build"):
+        build_knowledge_base(paths=paths, config=config)
+    assert sorted(path.name for path in paths.dir_profile.iterdir()) == [
+        "build-cpu.txt",
+        "build-memory.txt",
+        "build.prof",
+    ]
+    assert "build_knowledge_base" in paths.dir_profile.joinpath("build-cpu.txt").read_text()
+    memory = paths.dir_profile.joinpath("build-memory.txt").read_text()
+    assert memory.startswith("peak traced memory: ")
+
+    def get_function_names(name: str) -> set[str]:
+        stats = pstats.Stats(str(paths.dir_profile.joinpath(f"{name}.prof")))
+        return {function for _, _, function in stats.stats}
+
+    assert "combine_documents" in get_function_names("build")
+    # the work done in the thread pool is profiled too
+    with main.profile(paths.dir_profile, "build-jobs"):
+        build_knowledge_base(paths=paths, config=config, jobs=2)
+    assert {"build_group_asset", "combine_documents"} <= get_function_names("build-jobs")
+
+    monkeypatch.setenv("ESCLUSIVE_AI_PROFILE", "1")
+    assert main.parse_args([]).profile is True
+    monkeypatch.delenv("ESCLUSIVE_AI_PROFILE")
+    assert main.parse_args([]).profile is False
+    assert main.parse_args(["--profile"]).profile is True
+
+
+def test_parse_args_options_before_command():
+    import esclusive_ai_for_github_repo.main as main
+
+    # an option is accepted before and after the command, the defaults of
+    # the command don't overwrite it
+    args = main.parse_args(["--jobs", "4", "--incremental", "build"])
+    assert (args.jobs, args.incremental) == (4, True)
+    assert main.parse_args(["build", "--jobs", "4"]).jobs == 4
+    assert main.parse_args(["--profile", "publish"]).profile is True
+    assert main.parse_args(["--upload-jobs", "8", "publish"]).upload_jobs == 8
+    args = main.parse_args(["--metrics", "m.json", "watch", "--debounce", "50"])
+    assert (args.metrics, args.debounce) == (Path("m.json"), 50)
+    args = main.parse_args(["build"])
+    assert (args.jobs, args.incremental, args.profile) == (1, False, False)
+
+
+def test_cli(tmp_path, monkeypatch, capsys):
+    import esclusive_ai_for_github_repo.main as main
+
+    paths = make_repo(tmp_path)
+    paths.path_esclusive_ai_for_github_repo_config_json.parent.mkdir(parents=True)
+    paths.path_esclusive_ai_for_github_repo_config_json.write_text(
+        json.dumps(
+            {
+                "document_groups": [
+                    {"name": "python", "include": ["**/*.py"], "exclude": [".venv/"]},
+                    {"name": "document", "include": ["**/*.rst"], "exclude": []},
+                ]
+            }
+        )
+    )
+    git(tmp_path, "init", "-q", "-b", "dev")
+    git(tmp_path, "remote", "add", "origin", "git@github.com:owner/repo.git")
+    for name in ["GITHUB_SERVER_URL", "GITHUB_REPOSITORY", "GITHUB_REF_NAME", "GITHUB_TOKEN"]:
+        monkeypatch.delenv(name)
+    monkeypatch.setenv("ESCLUSIVE_AI_CACHE_DIR", str(tmp_path.joinpath(".cache")))
+    monkeypatch.setattr(main, "env_var", main.EnvVar())
+    monkeypatch.chdir(tmp_path)
+
+    # the repo and the branch come from the local git repo
+    assert main.env_var.GITHUB_SERVER_URL == "https://github.com"
+    assert main.env_var.GITHUB_REPOSITORY == "owner/repo"
+    assert main.env_var.GITHUB_REF_NAME == "dev"
+    assert main.parse_git_remote_url("https://ghe.example.com/a/b.git") == (
+        "https://ghe.example.com",
+        "a/b",
+    )
+
+    monkeypatch.setattr(main, "metrics", main.Metrics())
+    path_metrics = tmp_path.joinpath("metrics.json")
+    main.cli(["build", "--metrics", str(path_metrics)])
+    text = paths.dir_document_groups.joinpath("python.txt").read_text()
+    assert "github.com/owner/repo/blob/dev/pkg/core.py" in text
+    stages = json.loads(path_metrics.read_text())["stages"]
+    assert stages[0]["name"] == "load config"
+
+    # the job summary gets the metrics without --metrics
+    path_summary = tmp_path.joinpath("summary.md")
+    monkeypatch.setenv("GITHUB_STEP_SUMMARY", str(path_summary))
+    monkeypatch.setattr(main, "metrics", main.Metrics())
+    main.cli(["build"])
+    assert "| load config |" in path_summary.read_text()
+    monkeypatch.delenv("GITHUB_STEP_SUMMARY")
+
+    capsys.readouterr()
+    main.cli(["stats", "--top", "2"])
+    out = capsys.readouterr().out
+    assert "document group 'python': 3 files" in out
+    assert "top 2 largest files" in out
+
+    tmp_path.joinpath("logo.png").write_bytes(b"\x89PNG\0")
+    main.cli(["explain", "pkg/core.py", ".venv/lib/site.py", "logo.png", "LICENSE"])
+    out = capsys.readouterr().out
+    assert "  'python': included by '**/*.py'" in out
+    assert "  'document': excluded, no include pattern matches" in out
+    assert "  'python': included by '**/*.py', but excluded by '.venv/'" in out
+    assert "logo.png:\n  'python': excluded" in out
+    assert "LICENSE:\n  not a file" in out
+
+    paths.path_build_state_json.unlink()
+    with pytest.raises(SystemExit):
+        main.cli(["publish"])
+
+    # the heavy dependencies are only imported when they are needed
+    code = (
+        "import sys, esclusive_ai_for_github_repo.main; "
+        "print([m for m in ['github', 'requests', 'pydantic'] if m in sys.modules])"
+    )
+    res = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert res.stdout.strip() == "[]"
+
+
+# (pattern, path, is_match) cases from the Include-Exclude Pattern Matching Guide
+guide_cases = [
+    ("README.md", "README.md", True),
+    ("README.md", "folder/README.md", True),
+    ("README.md", "folder/subfolder/README.md", True),
+    ("*.py", "example.py", True),
+    ("*.py", "folder/example.py", True),
+    ("*.py", "folder/subfolder/example.py", True),
+    ("src/*.py", "src/example.py", True),
+    ("src/*.py", "example.py", False),
+    ("src/*.py", "folder/example.py", False),
+    ("src/*.py", "src/folder/example.py", False),
+    ("src/**/*.py", "src/example.py", True),
+    ("src/**/*.py", "src/folder/example.py", True),
+    ("src/**/*.py", "src/folder/subfolder/example.py", True),
+    ("docs/source/*/**/index.rst", "docs/source/Section-1/index.rst", True),
+    ("docs/source/*/**/index.rst", "docs/source/Section-1/Section-1-1/index.rst", True),
+    ("docs/source/*/**/index.rst", "docs/source/index.rst", False),
+    ("tmp", "tmp/file.txt", True),
+    ("tmp", "tmp/folder/file.txt", True),
+    ("tmp", "tmp/folder/subfolder/file.txt", True),
+    ("tmp", "tests/tmp/file.txt", True),
+    ("tmp", "tests/tmp/folder/file.txt", True),
+    ("tmp", "tests/tmp/subfolder/file.txt", True),
+    ("tmp/", "tmp", False),
+    ("tmp/", "tmp/file.txt", True),
+    ("tmp/", "tmp/folder/file.txt", True),
+    ("tmp/", "tmp/folder/subfolder/file.txt", True),
+    ("tmp/", "tests/tmp/file.txt", True),
+    ("tmp/", "tests/tmp/folder/file.txt", True),
+    ("tmp/", "tests/tmp/subfolder/file.txt", True),
+    ("*.py[cod]", "test.pyc", True),
+    ("*.py[cod]", "test.pyo", True),
+    ("*.py[cod]", "test.pyd", True),
+]
+
+
+@pytest.mark.parametrize("pattern,path,expected", guide_cases)
+def test_path_matcher_guide_cases(pattern, path, expected):
+    include = PathMatcher.new(include=[pattern], exclude=[])
+    # the regexes of the pinned pathspec are known, they are combined
+    assert include.include.regex is not None
+    assert include.is_match(path) is expected
+    assert PathPick.new(include=[pattern], exclude=[]).is_match(path) is expected
+    exclude = PathMatcher.new(include=[], exclude=[pattern])
+    assert exclude.is_match(path) is (not expected)
+
+
+def test_path_matcher_unknown_pathspec_regex(monkeypatch):
+    import esclusive_ai_for_github_repo.main as main
+
+    pattern_to_regex = main.GitWildMatchPattern.pattern_to_regex
+
+    def renamed_group(pattern):
+        regex, include = pattern_to_regex(pattern)
+        if regex is not None:
+            regex = regex.replace("(?P<ps_d>", "(?P<dir>")
+        return regex, include
+
+    # a pathspec upgrade changes the generated regexes, every pattern is
+    # matched with its own regex and directories are not pruned
+    monkeypatch.setattr(main.GitWildMatchPattern, "pattern_to_regex", renamed_group)
+    for pattern, path, expected in guide_cases:
+        matcher = PathMatcher.new(include=[pattern], exclude=[pattern, "build/"])
+        assert matcher.include.regex is None
+        assert matcher.include.match(path) is expected
+        assert matcher.exclude.match_all_below("build") is False
+
+
+def test_path_matcher_negation():
+    matcher = PathMatcher.new(include=["**/*.py", "!tests/"], exclude=["*.txt", "!keep.txt"])
+    assert matcher.include.regex is None
+    assert matcher.is_match("pkg/a.py") is True
+    assert matcher.is_match("tests/test_a.py") is False
+    assert matcher.is_match("pkg/keep.txt") is False  # not included
+    assert matcher.is_dir_pruned("docs") is False
+
+    # comments and blank lines are ignored
+    matcher = PathMatcher.new(include=["# comment", ""], exclude=["# comment"])
+    assert matcher.is_match("a.py") is False
+    matcher = PathMatcher.new(include=[], exclude=["# comment"])
+    assert matcher.is_match("a.py") is True
+
+
+@pytest.mark.parametrize(
+    "pattern,prefix",
+    [
+        ("*.py", ()),
+        ("tmp/", ()),
+        ("**/index.rst", ()),
+        ("README.rst", ()),
+        ("/README.rst", ()),
+        ("src/*.py", ("src",)),
+        ("docs/source/**/*.rst", ("docs", "source")),
+        (".github/workflows/**.*", (".github", "workflows")),
+        ("a/b/", ("a", "b")),
+    ],
+)
+def test_get_literal_dir_prefix(pattern, prefix):
+    assert get_literal_dir_prefix(pattern) == prefix
+
+
+def test_path_matcher_is_dir_pruned():
+    matcher = PathMatcher.new(
+        include=["src/**/*.py", "docs/source/*/**/index.rst"],
+        exclude=[".venv/", "node_modules", "src/vendor/**"],
+    )
+    assert matcher.is_dir_pruned("src") is False
+    assert matcher.is_dir_pruned("src/pkg") is False
+    assert matcher.is_dir_pruned("docs") is False
+    assert matcher.is_dir_pruned("docs/source/Section-1") is False
+    assert matcher.is_dir_pruned("docs/build") is True
+    assert matcher.is_dir_pruned("tests") is True
+    assert matcher.is_dir_pruned("src/vendor") is True
+    assert matcher.is_dir_pruned("src/pkg/node_modules") is True
+
+    matcher = PathMatcher.new(include=["**/*.py"], exclude=[".venv/", "*.pyc"])
+    assert matcher.is_dir_pruned("pkg") is False
+    assert matcher.is_dir_pruned(".venv") is True
+    assert matcher.is_dir_pruned("pkg/.venv") is True
+    assert matcher.is_dir_pruned("pkg/mod.pyc") is True
+
+    # a negation pattern can re-include files below an excluded directory
+    matcher = PathMatcher.new(include=[], exclude=["build/", "!build/keep.py"])
+    assert matcher.is_dir_pruned("build") is False
+
+
+def test_scan_repo_is_same_as_docpack(tmp_path):
+    paths = make_repo(tmp_path)
+    groups = [
+        {"name": "a", "include": ["**/*.py"], "exclude": [".venv/"]},
+        {"name": "b", "include": ["pkg/*.py", "README.rst"], "exclude": []},
+        {"name": "c", "include": [], "exclude": ["tmp/", "*.rst"]},
+        {"name": "d", "include": ["docs/source/*/**/index.rst"], "exclude": []},
+    ]
+    config = Config.from_dict({"document_groups": groups})
+    matches = scan_repo(dir_repo=paths.dir_project_root, config=config)
+    for group in config.document_groups:
+        expected = sorted(
+            path.relative_to(tmp_path).as_posix()
+            for path in find_matching_files(
+                dir_root=tmp_path,
+                include=group.include,
+                exclude=group.exclude,
+            )
+            if path.is_file()
+        )
+        actual = [path for path, names in matches.items() if group.name in names]
+        assert actual == expected
+
+
 if __name__ == "__main__":
     from esclusive_ai_for_github_repo.tests import run_cov_test
 
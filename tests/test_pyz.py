@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import zipfile
+import subprocess
+
+from esclusive_ai_for_github_repo.paths import dir_project_root
+from esclusive_ai_for_github_repo.main import __version__
+from esclusive_ai_for_github_repo.pyz import build_pyz
+
+
+def test_build_pyz(tmp_path):
+    python_version = "{}.{}".format(*sys.version_info[:2])
+    kwargs = dict(
+        # the dependencies come from the running interpreter
+        path_requirements=None,
+        dir_staging=tmp_path.joinpath("staging"),
+        python_version=python_version,
+    )
+    path_pyz = build_pyz(path_pyz=tmp_path.joinpath("a.pyz"), **kwargs)
+    # reproducible
+    assert (
+        build_pyz(path_pyz=tmp_path.joinpath("b.pyz"), **kwargs).read_bytes()
+        == path_pyz.read_bytes()
+    )
+    with zipfile.ZipFile(path_pyz) as zf:
+        assert {"__main__.py", "app/main.py", "app/prompt.md"} <= set(zf.namelist())
+        build_id = json.loads(zf.read("build.json"))["build_id"]
+
+    dir_cache = tmp_path.joinpath("cache")
+    dir_cache.joinpath("pyz", "0123456789abcdef").mkdir(parents=True)
+    dir_work = tmp_path.joinpath("work")
+    # a prompt left from an earlier run is replaced with the bundled one
+    dir_work.joinpath("tmp").mkdir(parents=True)
+    dir_work.joinpath("tmp", "prompt.md").write_text("stale")
+    env = dict(os.environ, ESCLUSIVE_AI_CACHE_DIR=str(dir_cache))
+    result = subprocess.run(
+        [sys.executable, str(path_pyz), "--help"],
+        cwd=dir_work,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert "--incremental" in result.stdout
+    # extracted once into the cache, the older build is removed
+    assert [path.name for path in dir_cache.joinpath("pyz").iterdir()] == [build_id]
+    with zipfile.ZipFile(path_pyz) as zf:
+        prompt = zf.read("app/prompt.md").decode("utf-8")
+    assert dir_work.joinpath("tmp", "prompt.md").read_text() == prompt
+
+    result = subprocess.run(
+        [sys.executable, str(path_pyz), "--benchmark-startup", "1"],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    assert set(json.loads(result.stdout)) == {
+        "extract_seconds",
+        "import_main_seconds",
+        "run_help_seconds",
+        "n",
+    }
+
+
+def test_run_yml_version():
+    # release.py publishes the zipapp to the release of __version__
+    text = dir_project_root.joinpath(".github", "workflows", "run.yml").read_text()
+    assert f"/releases/download/{__version__}\"" in text
+    # the fallback is a release that is already published
+    assert "/releases/download/0.1.1\"" in text
+
+
+if __name__ == "__main__":
+    from esclusive_ai_for_github_repo.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "esclusive_ai_for_github_repo.pyz",
+        preview=False,
+    )
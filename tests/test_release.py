@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import importlib.util
+
+from github import Auth, Github
+
+from esclusive_ai_for_github_repo.paths import dir_project_root
+from esclusive_ai_for_github_repo.tests.fake_github import (
+    FakeGitHub,
+    FakeAsset,
+    FakeRelease,
+)
+
+# release.py is a script at the project root, not a module of the package
+spec = importlib.util.spec_from_file_location(
+    "release", dir_project_root.joinpath("release.py")
+)
+release = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(release)
+
+
+def get_repo(server: FakeGitHub):
+    gh = Github(
+        auth=Auth.Token(server.token),
+        base_url=server.url,
+        # PyGithub waits a second between writes by default
+        seconds_between_requests=None,
+        seconds_between_writes=None,
+    )
+    return gh.get_repo(server.repository)
+
+
+def add_release(server: FakeGitHub, tag: str, commit_sha: str, assets: dict):
+    fake_release = FakeRelease(id=server.new_id(), tag_name=tag, name=tag, body="")
+    server.releases[fake_release.id] = fake_release
+    server.refs[f"refs/tags/{tag}"] = commit_sha
+    for name, data in assets.items():
+        asset_id = server.new_id()
+        server.assets[asset_id] = FakeAsset(
+            id=asset_id,
+            release_id=fake_release.id,
+            name=name,
+            label=name,
+            data=data,
+        )
+
+
+def get_assets(server: FakeGitHub, tag: str) -> dict[str, bytes]:
+    fake_release = server.get_release_by_tag(tag)
+    return {
+        asset.name: asset.data
+        for asset in server.assets.values()
+        if asset.release_id == fake_release.id
+    }
+
+
+def get_tag_commit(server: FakeGitHub, tag: str) -> str:
+    sha = server.refs[f"refs/tags/{tag}"]
+    return server.tags[sha]["object"] if sha in server.tags else sha
+
+
+def test_plan_and_apply_release(tmp_path, capsys):
+    path_list = [
+        tmp_path.joinpath("main.py"),
+        tmp_path.joinpath("prompt.md"),
+        tmp_path.joinpath("requirements.txt"),
+    ]
+    path_list[0].write_bytes(b"print('main')\n")
+    path_list[1].write_bytes(b"prompt v2\n")
+    path_list[2].write_bytes(b"docpack==0.1.2\n")
+    targets = [
+        release.Target(tag_name="0.2.0", release_name="0.2.0"),
+        release.Target(tag_name="latest", release_name="latest"),
+    ]
+    with FakeGitHub(repository="owner/repo") as server:
+        # the versioned release is behind: the tag is on an older commit, an
+        # asset is unchanged, one has the same size but another content, one
+        # is missing. The latest release does not exist yet.
+        add_release(
+            server,
+            tag="0.2.0",
+            commit_sha="0" * 40,
+            assets={
+                "main.py": b"print('main')\n",
+                "prompt.md": b"prompt v1\n",
+                # left behind by an interrupted run
+                "prompt.md.new": b"prompt v?\n",
+            },
+        )
+        unchanged_ids = {
+            asset.id for asset in server.assets.values() if asset.name == "main.py"
+        }
+        repo = get_repo(server)
+
+        versioned, latest = release.plan_release(repo, targets, path_list)
+        assert (versioned.move_tag, versioned.create_release) == (True, False)
+        assert versioned.changed_assets == path_list[1:]
+        assert (latest.move_tag, latest.create_release) == (True, True)
+        assert latest.changed_assets == path_list
+        release.print_plan([versioned, latest])
+        assert "replace asset 'prompt.md'" in capsys.readouterr().out
+
+        release.apply_plans(repo, [versioned, latest])
+        expected = {path.name: path.read_bytes() for path in path_list}
+        for target in targets:
+            assert get_assets(server, target.tag_name) == expected
+            assert get_tag_commit(server, target.tag_name) == server.commit_sha
+        # the unchanged asset is not uploaded again
+        assert unchanged_ids <= set(server.assets)
+
+        # nothing to do anymore
+        plans = release.plan_release(repo, targets, path_list)
+        assert all(plan.is_noop() for plan in plans)
+
+        # without the digest, an asset is only downloaded if the size matches
+        server.asset_digest = False
+        path_list[1].write_bytes(b"a longer prompt v3\n")
+        n_requests = len(server.requests)
+        plans = release.plan_release(repo, targets, path_list)
+        assert [plan.changed_assets for plan in plans] == [path_list[1:2]] * 2
+        downloads = sorted(
+            path.rsplit("/", 1)[-1]
+            for _, path in server.requests[n_requests:]
+            if path.startswith("/downloads/")
+        )
+        assert downloads == ["main.py", "main.py", "requirements.txt", "requirements.txt"]
+
+
+def test_get_asset_digest():
+    with FakeGitHub(repository="owner/repo", asset_digest=False) as server:
+        add_release(server, tag="0.2.0", commit_sha="0" * 40, assets={"a.txt": b"abc"})
+        asset = get_repo(server).get_release("0.2.0").assets[0]
+        assert release.get_asset_digest(asset) == hashlib.sha256(b"abc").hexdigest()
+
+
+if __name__ == "__main__":
+    from esclusive_ai_for_github_repo.tests import run_cov_test
+
+    run_cov_test(
+        __file__,
+        "release",
+        preview=False,
+    )
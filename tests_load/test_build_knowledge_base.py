@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load test of :func:`~esclusive_ai_for_github_repo.main.build_knowledge_base`
+on synthetic repositories.
+
+The real build is run a few times, every stage is timed through
+:data:`~esclusive_ai_for_github_repo.main.metrics`, the throughput and the
+peak RSS are written to ``tests_load/load-test-results.json``. The file
+name matching happens in the same walk as the scan, it prunes directories,
+so it is part of the ``scan`` stage. The assets are written by the
+``combine`` stage, ``write state`` is the build state and the token report.
+
+Runners differ in speed, so the seconds are not compared. Every stage is
+divided by the seconds of a fixed calibration workload, see :func:`calibrate`,
+measured on the same runner right before the build. The test fails if this
+relative cost of a stage is higher than in ``baseline.json`` by more than the
+tolerance. Stages that take less than :data:`min_share` of the build are too
+noisy to compare on their own, they still count in the ``total``.
+
+Environment variables:
+
+- ``LOAD_TEST_SHAPES``: comma separated repo shapes to run, default ``1k,10k``,
+  see :data:`shapes`.
+- ``LOAD_TEST_REPEAT``: how many times the build runs, the fastest run of
+  every stage is compared, default ``3``.
+- ``LOAD_TEST_TOLERANCE``: allowed slowdown ratio, default ``1.0``, a stage
+  fails if its relative cost is more than ``baseline * (1 + tolerance)``.
+- ``LOAD_TEST_UPDATE_BASELINE``: set to ``1`` to store the results as the
+  new baseline instead of comparing against it.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import tempfile
+import dataclasses
+from pathlib import Path
+
+import pytest
+
+import esclusive_ai_for_github_repo.main as main
+from esclusive_ai_for_github_repo.paths import dir_load_test
+from esclusive_ai_for_github_repo.main import (
+    Paths,
+    Config,
+    Metrics,
+    build_knowledge_base,
+)
+
+# main.py imports docpack on the first render, import it here so the render
+# stage measures the rendering, not the one time import
+import docpack.github_fetcher
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+os.environ.setdefault("CI", "true")
+os.environ.setdefault("GITHUB_SERVER_URL", "https://github.com")
+os.environ.setdefault("GITHUB_REPOSITORY", "easyscalecloud/esclusive-ai-for-github-repo")
+os.environ.setdefault("GITHUB_REF_NAME", "main")
+os.environ.setdefault("GITHUB_TOKEN", "dummy-token")
+
+path_baseline_json = dir_load_test / "baseline.json"
+path_results_json = dir_load_test / "load-test-results.json"
+
+#: the :class:`~esclusive_ai_for_github_repo.main.Metrics` stage name
+#: prefixes, ``combine:all``, ``combine:python`` ... are one ``combine`` stage
+stages = ["scan", "render", "combine", "write state", "total"]
+#: stages below this share of the total seconds are not compared on their own
+min_share = 0.05
+
+
+@dataclasses.dataclass
+class RepoShape:
+    """
+    :param n_files: number of source files, excluding vendored and binary files.
+    :param depth: max directory depth of the source tree.
+    :param fanout: number of sub directories per directory.
+    :param file_size: average source file size in bytes.
+    :param n_vendored: number of files in an excluded ``node_modules/`` dir.
+    :param n_binaries: number of binary files in ``docs/_static/``.
+    """
+
+    n_files: int = dataclasses.field()
+    depth: int = dataclasses.field(default=4)
+    fanout: int = dataclasses.field(default=8)
+    file_size: int = dataclasses.field(default=2000)
+    n_vendored: int = dataclasses.field(default=0)
+    n_binaries: int = dataclasses.field(default=0)
+
+
+shapes = {
+    "1k": RepoShape(n_files=1_000, n_vendored=1_000, n_binaries=20),
+    "10k": RepoShape(n_files=10_000, depth=6, n_vendored=10_000, n_binaries=100),
+    "100k": RepoShape(n_files=100_000, depth=8, n_vendored=50_000, n_binaries=500),
+}
+
+config_data = {
+    "document_groups": [
+        {"name": "all", "include": [], "exclude": ["node_modules/", "tmp/"]},
+        {"name": "python", "include": ["src/**/*.py"], "exclude": []},
+        {"name": "document", "include": ["**/*.md", "docs/**"], "exclude": []},
+    ]
+}
+
+
+def generate_repo(dir_repo: Path, shape: RepoShape, seed: int = 1):
+    """
+    Generate a synthetic repository, the same shape and seed always give the
+    same files.
+    """
+    rnd = random.Random(seed)
+    line = "value = compute(alpha, beta, gamma)  # a typical line of code\n"
+    dirs = [""]
+    for _ in range(shape.depth):
+        dirs.extend(
+            f"{parent}/d{i}" if parent else f"d{i}"
+            for parent in dirs[-shape.fanout :]
+            for i in range(shape.fanout)
+        )
+    for i in range(shape.n_files):
+        reldir = rnd.choice(dirs)
+        ext = rnd.choice([".py", ".py", ".py", ".md", ".txt"])
+        n_lines = max(1, int(rnd.expovariate(len(line) / shape.file_size)))
+        path = dir_repo.joinpath("src", reldir, f"file_{i}{ext}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"# file {i}\n" + line * n_lines)
+    for i in range(shape.n_vendored):
+        path = dir_repo.joinpath("node_modules", f"pkg_{i % 100}", f"index_{i}.js")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(f"module.exports = {i};\n")
+    for i in range(shape.n_binaries):
+        path = dir_repo.joinpath("docs", "_static", f"image_{i}.png")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"\x89PNG\r\n\x1a\n" + rnd.randbytes(shape.file_size))
+    dir_repo.joinpath("tmp").mkdir(exist_ok=True)
+    dir_repo.joinpath("tmp", "prompt.md").write_text("PROMPT")
+
+
+def get_peak_rss() -> int:
+    """
+    Peak resident set size of this process in bytes, ``0`` if unknown.
+    """
+    if resource is None:  # pragma: no cover
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # it is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def calibrate(n: int = 5) -> float:
+    """
+    Seconds of a fixed workload that is similar to a build: pure Python
+    string work and hashing and writing files, the best of ``n`` runs.
+    """
+    line = "value = compute(alpha, beta, gamma)  # a typical line of code\n"
+    timings = list()
+    with tempfile.TemporaryDirectory() as dir_tmp:
+        for _ in range(n):
+            start = time.perf_counter()
+            for i in range(500):
+                text = "".join(f"{i}:{line}" for _ in range(200))
+                data = text.replace("\r\n", "\n").encode("utf-8")
+                path = Path(dir_tmp, f"{i}.txt")
+                path.write_bytes(data)
+                hashlib.sha256(path.read_bytes()).hexdigest()
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def measure_build(paths: Paths, monkeypatch) -> dict:
+    """
+    Run the build once, sum the seconds, files and bytes of every stage.
+    """
+    config = Config.from_dict(json.loads(json.dumps(config_data)))
+    metrics = Metrics()
+    metrics.enabled = True
+    monkeypatch.setattr(main, "metrics", metrics)
+    start = time.perf_counter()
+    build_knowledge_base(paths=paths, config=config)
+    total = time.perf_counter() - start
+
+    summed = {stage: {"seconds": 0.0, "files": 0, "bytes": 0} for stage in stages}
+    summed["total"]["seconds"] = total
+    summed["total"]["files"] = metrics.stages[0].files
+    for stage_metrics in metrics.stages:
+        stage = stage_metrics.name.split(":", 1)[0]
+        if stage in summed:
+            summed[stage]["seconds"] += stage_metrics.seconds
+            summed[stage]["files"] += stage_metrics.files
+            summed[stage]["bytes"] += stage_metrics.bytes
+    return summed
+
+
+def run_benchmark(dir_repo: Path, monkeypatch, n: int = 3) -> dict:
+    """
+    Run the build ``n`` times and keep the fastest run of every stage, the
+    slower runs are the noise of other processes on the runner.
+    """
+    paths = Paths(dir_project_root=dir_repo)
+    runs = [measure_build(paths, monkeypatch) for _ in range(n)]
+    peak_rss = get_peak_rss()
+    summed = {
+        stage: min((run[stage] for run in runs), key=lambda dct: dct["seconds"])
+        for stage in stages
+    }
+    results = dict()
+    for stage, dct in summed.items():
+        elapsed = dct["seconds"]
+        results[stage] = {
+            "seconds": round(elapsed, 4),
+            "items_per_second": round(dct["files"] / elapsed, 1) if elapsed else None,
+            "bytes_per_second": round(dct["bytes"] / elapsed, 1) if elapsed else None,
+            "peak_rss_bytes": peak_rss,
+        }
+    return results
+
+
+def get_shape_names() -> list[str]:
+    names = os.environ.get("LOAD_TEST_SHAPES", "1k,10k")
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def read_json(path: Path) -> dict:
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return dict()
+
+
+def write_json(path: Path, data: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+
+
+@pytest.mark.parametrize("shape_name", get_shape_names())
+def test_build_knowledge_base_load(shape_name, tmp_path, monkeypatch):
+    shape = shapes[shape_name]
+    dir_repo = tmp_path.joinpath("repo")
+    generate_repo(dir_repo, shape)
+    calibration = calibrate()
+    results = run_benchmark(
+        dir_repo, monkeypatch, n=int(os.environ.get("LOAD_TEST_REPEAT", "3"))
+    )
+    for result in results.values():
+        result["relative"] = round(result["seconds"] / calibration, 3)
+
+    print(f"\n--- load test {shape_name!r}: {shape}, calibration {calibration:.3f} s")
+    for stage in stages:
+        result = results[stage]
+        print(
+            f"{stage:>12}: {result['seconds']:>8.3f} s, "
+            f"{result['relative']:>8.3f} x calibration, "
+            f"{result['items_per_second']} items/s, "
+            f"peak RSS {result['peak_rss_bytes'] / 1024 / 1024:.1f} MB"
+        )
+    all_results = read_json(path_results_json)
+    all_results[shape_name] = dict(results, calibration_seconds=round(calibration, 4))
+    write_json(path_results_json, all_results)
+
+    baseline = read_json(path_baseline_json)
+    if os.environ.get("LOAD_TEST_UPDATE_BASELINE") == "1":
+        baseline[shape_name] = {
+            stage: {"relative": results[stage]["relative"]} for stage in stages
+        }
+        write_json(path_baseline_json, baseline)
+        return
+    if shape_name not in baseline:
+        pytest.skip(f"no baseline for shape {shape_name!r}")
+    tolerance = float(os.environ.get("LOAD_TEST_TOLERANCE", "1.0"))
+    total = baseline[shape_name]["total"]["relative"]
+    regressions = list()
+    for stage in stages:
+        expected = baseline[shape_name][stage]["relative"]
+        if stage != "total" and expected < total * min_share:
+            continue
+        limit = expected * (1 + tolerance)
+        if results[stage]["relative"] > limit:
+            regressions.append(
+                f"{stage}: {results[stage]['relative']:.3f} > {limit:.3f} x calibration"
+            )
+    assert not regressions, "stages regressed past the baseline:\n" + "\n".join(
+        regressions
+    )
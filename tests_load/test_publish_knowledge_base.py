@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load test of :func:`~esclusive_ai_for_github_repo.main.publish_knowledge_base`
+against the local fake GitHub server, no network access needed.
+
+Every document group asset is uploaded through the pooled
+:class:`~esclusive_ai_for_github_repo.main.GitHubClient`, with a simulated
+round trip latency per request. The wall time, the upload throughput and
+the number of TCP connections are written to ``tests_load/load-test-results.json``.
+
+The overlapped
+:func:`~esclusive_ai_for_github_repo.main.build_and_publish_knowledge_base`
+is compared with a build followed by a publish.
+
+Environment variables:
+
+- ``LOAD_TEST_PUBLISH_LATENCY``: simulated round trip per request in seconds,
+  default ``0.02``.
+"""
+
+import typing as T
+import os
+import time
+
+import pytest
+
+from esclusive_ai_for_github_repo.main import (
+    Paths,
+    Config,
+    GitHubClient,
+    build_knowledge_base,
+    publish_knowledge_base,
+    build_and_publish_knowledge_base,
+)
+from esclusive_ai_for_github_repo.tests.fake_github import FakeGitHub
+
+from test_build_knowledge_base import path_results_json, read_json, write_json
+
+n_groups = 20
+file_size = 256 * 1024
+
+
+def make_config(compression: T.Optional[list[str]] = None) -> Config:
+    return Config.from_dict(
+        {
+            "document_groups": [
+                {"name": f"group_{i}", "include": [f"group_{i}/**"], "exclude": []}
+                for i in range(n_groups)
+            ],
+            "compression": compression or [],
+        }
+    )
+
+
+def make_repo(dir_repo):
+    dir_repo.joinpath("tmp").mkdir(parents=True)
+    dir_repo.joinpath("tmp", "prompt.md").write_text("PROMPT")
+    for i in range(n_groups):
+        path = dir_repo.joinpath(f"group_{i}", "data.txt")
+        path.parent.mkdir(parents=True)
+        # different content per group, so nothing is deduplicated
+        path.write_text(f"{i}\n" + "x" * file_size)
+    return Paths(dir_project_root=dir_repo)
+
+
+@pytest.mark.parametrize("upload_jobs", [1, 4])
+def test_publish_knowledge_base_load(upload_jobs, tmp_path):
+    paths = make_repo(tmp_path.joinpath("repo"))
+    config = make_config()
+    build_knowledge_base(paths=paths, config=config)
+    latency = float(os.environ.get("LOAD_TEST_PUBLISH_LATENCY", "0.02"))
+    with FakeGitHub(repository="owner/repo", latency=latency) as server:
+        client = GitHubClient(
+            token=server.token,
+            repository="owner/repo",
+            api_url=server.url,
+            pool_size=upload_jobs + 2,
+        )
+        start = time.perf_counter()
+        publish_knowledge_base(
+            paths=paths, config=config, upload_jobs=upload_jobs, client=client
+        )
+        elapsed = time.perf_counter() - start
+        n_bytes = sum(len(asset.data) for asset in server.assets.values())
+        n_requests = len(server.requests)
+        n_connections = server.n_connections
+
+    results = {
+        "seconds": round(elapsed, 4),
+        "bytes_per_second": round(n_bytes / elapsed, 1),
+        "requests": n_requests,
+        "connections": n_connections,
+    }
+    print(f"\n--- publish with {upload_jobs} upload job(s): {results}")
+    all_results = read_json(path_results_json)
+    all_results[f"publish-{upload_jobs}-jobs"] = results
+    write_json(path_results_json, all_results)
+
+    # every upload reuses a pooled keep alive connection
+    assert n_connections <= upload_jobs + 2 < n_requests
+
+
+def test_build_and_publish_load(tmp_path):
+    paths = make_repo(tmp_path.joinpath("repo"))
+    # the compression makes the build take about as long as the publish
+    config = make_config(compression=["gz", "zip"])
+    latency = float(os.environ.get("LOAD_TEST_PUBLISH_LATENCY", "0.02"))
+    results = dict()
+    for name in ["sequential", "overlapped"]:
+        with FakeGitHub(repository="owner/repo", latency=latency) as server:
+            client = GitHubClient(
+                token=server.token,
+                repository="owner/repo",
+                api_url=server.url,
+                pool_size=6,
+            )
+            start = time.perf_counter()
+            if name == "sequential":
+                build_knowledge_base(paths=paths, config=config)
+                build_seconds = time.perf_counter() - start
+                publish_knowledge_base(
+                    paths=paths, config=config, upload_jobs=4, client=client
+                )
+            else:
+                build_and_publish_knowledge_base(
+                    paths=paths, config=config, upload_jobs=4, client=client
+                )
+            results[name] = time.perf_counter() - start
+            assert len(server.get_asset_names("knowledge-base")) == 4 * n_groups + 1
+
+    publish_seconds = results["sequential"] - build_seconds
+    results = {
+        "build_seconds": round(build_seconds, 4),
+        "publish_seconds": round(publish_seconds, 4),
+        "sequential_seconds": round(results["sequential"], 4),
+        "overlapped_seconds": round(results["overlapped"], 4),
+    }
+    print(f"\n--- build and publish: {results}")
+    all_results = read_json(path_results_json)
+    all_results["build-and-publish"] = results
+    write_json(path_results_json, all_results)
+
+    # the shorter of the build and the publish is mostly hidden
+    assert results["overlapped_seconds"] < results["sequential_seconds"]